@@ -3,11 +3,15 @@
 iCloud CalDAV USER_ID Discovery Script
 Step 1: Get your USER_ID from iCloud CalDAV
 
-Usage: python3 1_get_user_id.py
+Usage: python3 1_get_user_id.py [--profile]
 """
 
+import argparse
+
 import requests
-from requests.auth import HTTPBasicAuth
+
+import instrumentation
+from caldav_client import get_client
 
 # ============================================
 # CONFIGURATION - REPLACE WITH YOUR VALUES!
@@ -34,12 +38,8 @@ def get_user_id():
         return
 
     try:
-        response = requests.request(
-            "PROPFIND",
-            "https://caldav.icloud.com/.well-known/caldav",
-            auth=HTTPBasicAuth(EMAIL, PASSWORD),
-            headers={"Depth": "0"}
-        )
+        client = get_client(EMAIL, PASSWORD)
+        response = client.propfind("/.well-known/caldav", depth="0")
 
         print(f"Status: {response.status_code}")
 
@@ -96,4 +96,7 @@ def get_user_id():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Get your USER_ID from iCloud CalDAV")
+    instrumentation.add_arguments(parser)
+    instrumentation.configure(parser.parse_args())
     get_user_id()
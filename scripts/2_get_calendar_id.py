@@ -3,12 +3,16 @@
 iCloud CalDAV CALENDAR_ID Discovery Script
 Step 2: List all your calendars and their IDs
 
-Usage: python3 2_get_calendar_id.py
+Usage: python3 2_get_calendar_id.py [--profile]
 """
 
+import argparse
+
 import requests
-from requests.auth import HTTPBasicAuth
-import re
+
+import instrumentation
+from discovery import account_client
+from multistatus import iter_calendars, response_chunks
 
 # ============================================
 # CONFIGURATION - REPLACE WITH YOUR VALUES!
@@ -36,12 +40,8 @@ def get_calendars():
         return
 
     try:
-        response = requests.request(
-            "PROPFIND",
-            f"https://caldav.icloud.com/{USER_ID}/calendars/",
-            auth=HTTPBasicAuth(EMAIL, PASSWORD),
-            headers={"Depth": "1"}
-        )
+        client = account_client(EMAIL, PASSWORD)
+        response = client.propfind(f"/{USER_ID}/calendars/", depth="1", stream=True)
 
         print(f"Status: {response.status_code}")
 
@@ -50,29 +50,10 @@ def get_calendars():
             print("SUCCESS! Retrieved calendar list")
             print("=" * 60)
 
-            # Parse calendars from response
-            calendars = []
-            responses = re.findall(r'<response[^>]*>(.*?)</response>', response.text, re.DOTALL)
-
-            for resp in responses:
-                href_match = re.search(r'<href>([^<]+)</href>', resp)
-                name_match = re.search(r'<displayname>([^<]*)</displayname>', resp, re.IGNORECASE)
-                color_match = re.search(r'<calendar-color[^>]*>([^<]*)</calendar-color>', resp, re.IGNORECASE)
-
-                if href_match:
-                    href = href_match.group(1)
-                    # Only actual calendars (with UUID)
-                    if '/calendars/' in href and href.count('/') >= 4:
-                        calendar_id = href.split('/calendars/')[-1].rstrip('/')
-                        # Skip system folders
-                        if calendar_id and calendar_id not in ['inbox', 'outbox', 'notification', 'tasks']:
-                            name = name_match.group(1) if name_match else "Unnamed"
-                            color = color_match.group(1) if color_match else ""
-                            calendars.append({
-                                'name': name,
-                                'id': calendar_id,
-                                'color': color
-                            })
+            # Parse calendars from the streamed response
+            # (keep the first bytes around for the raw fallback below)
+            head = bytearray()
+            calendars = list(iter_calendars(response_chunks(response, head=head)))
 
             if calendars:
                 print(f"\nFound {len(calendars)} calendar(s):\n")
@@ -89,7 +70,7 @@ def get_calendars():
             else:
                 print("\nNo calendars found automatically.")
                 print("\n--- RAW RESPONSE (for manual parsing) ---")
-                print(response.text)
+                print(head.decode("utf-8", errors="replace"))
 
         elif response.status_code == 401:
             print("\nERROR: Authentication failed (401)")
@@ -116,4 +97,7 @@ def get_calendars():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List your iCloud calendars and their IDs")
+    instrumentation.add_arguments(parser)
+    instrumentation.configure(parser.parse_args())
     get_calendars()
@@ -3,13 +3,30 @@
 iCloud CalDAV Read Test
 Step 3: Test reading events from your calendar
 
-Usage: python3 3_test_read_events.py
+Usage: python3 3_test_read_events.py [--sync | --all] [--days N]
+
+With --sync the calendar is kept in a local store via sync-collection
+(RFC 6578): only changed/deleted events are transferred on each run and the
+date range is answered from the local copy.
+
+With --all every calendar in CALENDARS is queried concurrently and the
+results are merged into one time-ordered list, tagged by calendar.
+
+--days reads a longer range starting today; spans over a month are fetched
+in parallel time windows instead of one slow REPORT (see range_read.py).
 """
 
-import requests
-from requests.auth import HTTPBasicAuth
+import argparse
 import datetime
-import re
+
+import instrumentation
+from caldav_client import DEFAULT_POOL_MAXSIZE, CalDAVClient
+from calendar_read import EXPAND, SUMMARY_PROPS, ReadError, occurrence_key, read_calendars
+from calendar_sync import SyncError, SyncStore, query_local, sync_calendar
+from discovery import account_base_url, account_client
+from ics_parser import iter_occurrences
+from multistatus import iter_calendar_data
+from read_cache import cached_occurrences
 
 # ============================================
 # CONFIGURATION - REPLACE WITH YOUR VALUES!
@@ -18,98 +35,165 @@ EMAIL = "YOUR_APPLE_ID@email.com"           # Your Apple ID email
 PASSWORD = "xxxx-xxxx-xxxx-xxxx"            # App-specific password
 USER_ID = "YOUR_USER_ID"                    # From step 1
 CALENDAR_ID = "YOUR_CALENDAR_ID"            # From step 2 (the one you want to use)
+
+# Optional: named calendars for --all (like CALENDARS in the n8n workflow)
+CALENDARS = {
+    # 'personal': 'YOUR_CALENDAR_ID',
+    # 'work': 'ANOTHER_CALENDAR_ID',
+}
 # ============================================
 
 
 def get_events(start_date, end_date):
     """
     Query events using CalDAV REPORT request
+
+    Goes through the read-through cache, so repeated identical queries in the
+    same process (e.g. when imported by a long-running service) reuse one REPORT.
+    Ranges over a month are read in parallel windows (range_read.py).
     """
     print(f"\nQuerying events from {start_date} to {end_date}...")
 
-    # CalDAV REPORT XML request
-    xml_body = f"""<?xml version="1.0" encoding="UTF-8"?>
-<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
-  <d:prop>
-    <d:getetag/>
-    <c:calendar-data/>
-  </d:prop>
-  <c:filter>
-    <c:comp-filter name="VCALENDAR">
-      <c:comp-filter name="VEVENT">
-        <c:time-range start="{start_date}T000000Z" end="{end_date}T235959Z"/>
-      </c:comp-filter>
-    </c:comp-filter>
-  </c:filter>
-</c:calendar-query>"""
-
-    url = f"https://caldav.icloud.com/{USER_ID}/calendars/{CALENDAR_ID}/"
+    window_start, window_end = query_window(start_date, end_date)
+    path = f"/{USER_ID}/calendars/{CALENDAR_ID}/"
 
     try:
-        response = requests.request(
-            "REPORT",
-            url,
-            data=xml_body,
-            auth=HTTPBasicAuth(EMAIL, PASSWORD),
-            headers={
-                "Content-Type": "application/xml; charset=utf-8",
-                "Depth": "1"
-            }
-        )
-
-        print(f"Status: {response.status_code}")
-
-        if response.status_code == 207:  # Multi-Status (success)
-            events = parse_events(response.text)
-            return events
-        else:
-            print(f"Error: {response.status_code}")
-            print(f"Response: {response.text[:500]}")
-            return None
+        client = account_client(EMAIL, PASSWORD)
+        # Only titles and times are shown: ask for just those, expanded to the range
+        occurrences = cached_occurrences(client, path, window_start, window_end,
+                                         props=SUMMARY_PROPS, recurrence=EXPAND)
+    except ReadError as e:
+        print(f"Status: {e.status_code}")
+        print(f"Error: {e}")
+        return None
+    except Exception as e:
+        print(f"Connection error: {e}")
+        return None
+
+    # Already sorted by real start time (all-day events first on their day)
+    return [_event_from_occurrence(occ) for occ in occurrences]
 
+
+def get_events_synced(start_date, end_date):
+    """
+    Sync the calendar incrementally, then answer the range from the local store
+    """
+    print(f"\nSyncing calendar, then reading {start_date} to {end_date} locally...")
+
+    path = f"/{USER_ID}/calendars/{CALENDAR_ID}/"
+    store = SyncStore.for_calendar(EMAIL, path)
+
+    try:
+        client = account_client(EMAIL, PASSWORD)
+        result = sync_calendar(client, path, store)
+    except SyncError as e:
+        print(f"Error: {e}")
+        return None
     except Exception as e:
         print(f"Connection error: {e}")
         return None
 
+    kind = "Full sync" if result["full"] else "Incremental sync"
+    print(f"{kind}: {len(result['changed'])} changed, {len(result['deleted'])} deleted, "
+          f"{len(store.resources)} stored")
+
+    window_start, window_end = query_window(start_date, end_date)
+    # query_local() already yields in start order
+    return [_event_from_occurrence(occ) for occ in query_local(store, window_start, window_end)]
+
 
-def parse_events(xml_response):
+def get_events_all_calendars(start_date, end_date):
     """
-    Parse ICS events from XML response
+    Query every calendar in CALENDARS concurrently and merge by start time
     """
+    print(f"\nQuerying {len(CALENDARS)} calendar(s) from {start_date} to {end_date}...")
+
+    window_start, window_end = query_window(start_date, end_date)
+    client = CalDAVClient(EMAIL, PASSWORD, base_url=account_base_url(EMAIL),
+                          pool_maxsize=max(len(CALENDARS), DEFAULT_POOL_MAXSIZE))
+    try:
+        timeline, errors = read_calendars(client, USER_ID, CALENDARS, window_start, window_end,
+                                          props=SUMMARY_PROPS, recurrence=EXPAND)
+    finally:
+        client.close()
+
+    for name, error in errors.items():
+        print(f"Error ({name}): {error}")
+    if errors and len(errors) == len(CALENDARS):
+        return None
+
     events = []
+    for occ in timeline:
+        event = _event_from_occurrence(occ)
+        event["calendar"] = occ["calendar"]
+        events.append(event)
+    return events
 
-    # Find VEVENT blocks
-    vevent_pattern = r'BEGIN:VEVENT(.*?)END:VEVENT'
-    matches = re.findall(vevent_pattern, xml_response, re.DOTALL)
-
-    for match in matches:
-        # SUMMARY (event title)
-        summary_match = re.search(r'SUMMARY[^:]*:(.+)', match)
-        summary = summary_match.group(1).strip() if summary_match else "Untitled"
-
-        # DTSTART (start time)
-        dtstart_match = re.search(r'DTSTART[^:]*:(\d{8}T?\d{0,6})', match)
-        if dtstart_match:
-            dtstart = dtstart_match.group(1)
-            if 'T' in dtstart and len(dtstart) >= 13:
-                time_str = dtstart[9:11] + ":" + dtstart[11:13]
-            else:
-                time_str = "All day"
-        else:
-            time_str = "?"
 
-        events.append({
-            "title": summary,
-            "time": time_str
-        })
+def query_window(start_date, end_date):
+    """
+    The [start, end) UTC window covered by a REPORT for YYYYMMDD dates
+    """
+    start = datetime.datetime.strptime(start_date, "%Y%m%d").replace(tzinfo=datetime.timezone.utc)
+    end = datetime.datetime.strptime(end_date, "%Y%m%d").replace(tzinfo=datetime.timezone.utc)
+    return start, end + datetime.timedelta(days=1)
+
+
+def iter_events(xml_response, window_start=None, window_end=None):
+    """
+    Yield event occurrences one at a time from a REPORT response
+
+    xml_response may be the full body or an iterable of body chunks.
+    Recurring events are expanded within [window_start, window_end).
+    """
+    for resource in iter_calendar_data(xml_response):
+        for occurrence in iter_occurrences(resource["calendar_data"], window_start, window_end):
+            yield _event_from_occurrence(occurrence)
+
+
+def _event_from_occurrence(occurrence):
+    """Build the {"title", "time", "start", "end"} dict for one occurrence"""
+    start = occurrence["start"]
+    if occurrence["all_day"]:
+        time_str = "All day"
+    else:
+        # Show TZID/UTC times in the local time zone
+        local = start.astimezone() if start.tzinfo is not None else start
+        time_str = local.strftime("%H:%M")
+
+    return {
+        "title": occurrence["title"],
+        "time": time_str,
+        "start": start,
+        "end": occurrence["end"],
+    }
 
-    # Sort by time
-    events.sort(key=lambda x: x['time'] if x['time'] not in ["All day", "?"] else "00:00")
+
+def parse_events(xml_response, window_start=None, window_end=None):
+    """
+    Parse ICS events from XML response (full body or streamed chunks)
+    """
+    events = list(iter_events(xml_response, window_start, window_end))
+
+    # Sort by real start time (all-day events first on their day)
+    events.sort(key=occurrence_key)
 
     return events
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Test reading events from iCloud Calendar")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--sync", action="store_true",
+                      help="use incremental sync-collection and answer from the local store")
+    mode.add_argument("--all", action="store_true",
+                      help="read every calendar in CALENDARS and merge the results")
+    parser.add_argument("--days", type=int, default=2,
+                        help="days to read, starting today (default: 2 = today and tomorrow)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
     print("=" * 60)
     print("iCloud CalDAV - Read Test")
     print("=" * 60)
@@ -125,18 +209,26 @@ def main():
         print("  - CALENDAR_ID: From step 2")
         return
 
-    # Date range: today and tomorrow
+    # Date range: today and tomorrow (or --days)
     today = datetime.date.today()
-    tomorrow = today + datetime.timedelta(days=1)
+    last_day = today + datetime.timedelta(days=max(1, args.days) - 1)
 
     today_str = today.strftime("%Y%m%d")
-    tomorrow_str = tomorrow.strftime("%Y%m%d")
+    last_str = last_day.strftime("%Y%m%d")
 
     print(f"\nToday: {today}")
-    print(f"Tomorrow: {tomorrow}")
+    print(f"{'Tomorrow' if args.days == 2 else 'Until'}: {last_day}")
     print(f"CALENDAR_ID: {CALENDAR_ID[:8]}...")
 
-    events = get_events(today_str, tomorrow_str)
+    if args.sync:
+        events = get_events_synced(today_str, last_str)
+    elif args.all:
+        if not CALENDARS:
+            print("\nERROR: Add your calendars to the CALENDARS dict to use --all")
+            return
+        events = get_events_all_calendars(today_str, last_str)
+    else:
+        events = get_events(today_str, last_str)
 
     print("\n" + "=" * 60)
     if events is not None:
@@ -144,7 +236,8 @@ def main():
             print(f"SUCCESS! Found {len(events)} event(s):")
             print("=" * 60)
             for event in events:
-                print(f"  {event['time']} - {event['title']}")
+                tag = f" [{event['calendar']}]" if "calendar" in event else ""
+                print(f"  {event['start']:%Y-%m-%d} {event['time']} - {event['title']}{tag}")
         else:
             print("SUCCESS! No events in this time range.")
             print("=" * 60)
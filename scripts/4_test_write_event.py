@@ -4,11 +4,29 @@ iCloud CalDAV Write Test
 Step 4: Test creating events in your calendar
 
 Usage: python3 4_test_write_event.py
+       python3 4_test_write_event.py --bulk events.csv [--report results.jsonl]
+       python3 4_test_write_event.py --update UID --start 2024-01-15T14:00:00Z [--title ...]
+       python3 4_test_write_event.py --delete UID
+
+--bulk imports many events from a CSV/JSON/JSONL file (see bulk_write.py for
+the fields). PUTs run concurrently and are idempotent, so an interrupted
+import can simply be re-run.
+
+--update / --delete change an existing event by UID with If-Match, so an
+edit made meanwhile in Calendar.app is never overwritten (see event_update.py).
 """
 
+import argparse
 import requests
-from requests.auth import HTTPBasicAuth
 import datetime
+import time
+from collections import Counter
+
+import instrumentation
+from bulk_write import DEFAULT_CONCURRENCY, ResultReport, load_events, write_events
+from caldav_client import DEFAULT_POOL_MAXSIZE, CalDAVClient
+from discovery import account_base_url, account_client
+from event_update import delete_event, update_event
 
 # ============================================
 # CONFIGURATION - REPLACE WITH YOUR VALUES!
@@ -59,7 +77,7 @@ DESCRIPTION:This is a test event created by n8n-icloud-calendar setup script. Yo
 END:VEVENT
 END:VCALENDAR"""
 
-    url = f"https://caldav.icloud.com/{USER_ID}/calendars/{CALENDAR_ID}/{event_uid}.ics"
+    path = f"/{USER_ID}/calendars/{CALENDAR_ID}/{event_uid}.ics"
 
     print(f"\nCreating test event...")
     print(f"Event: 'n8n Test Event - DELETE ME'")
@@ -68,12 +86,8 @@ END:VCALENDAR"""
     print("-" * 50)
 
     try:
-        response = requests.put(
-            url,
-            data=ics_content,
-            auth=HTTPBasicAuth(EMAIL, PASSWORD),
-            headers={"Content-Type": "text/calendar; charset=utf-8"}
-        )
+        client = account_client(EMAIL, PASSWORD)
+        response = client.put(path, ics_content)
 
         print(f"Status: {response.status_code}")
 
@@ -138,7 +152,115 @@ END:VCALENDAR"""
         return False
 
 
+def bulk_create(path, report_path=None, concurrency=DEFAULT_CONCURRENCY):
+    """Import all events from a file; returns True if none failed"""
+    print("iCloud CalDAV - Bulk Write")
+    print("=" * 50)
+    print(f"Source: {path}")
+    print(f"Calendar: {CALENDAR_ID[:8]}...")
+    print(f"Concurrency: {concurrency}")
+    print("-" * 50)
+
+    client = CalDAVClient(EMAIL, PASSWORD, base_url=account_base_url(EMAIL),
+                          pool_maxsize=max(concurrency, DEFAULT_POOL_MAXSIZE))
+    calendar_path = f"/{USER_ID}/calendars/{CALENDAR_ID}/"
+    report = ResultReport(report_path) if report_path else None
+    counts = Counter()
+    started = time.perf_counter()
+
+    try:
+        for result in write_events(client, calendar_path, load_events(path), concurrency):
+            counts[result["status"]] += 1
+            if report is not None:
+                report.write(result)
+            if result["status"] in ("failed", "invalid"):
+                print(f"  #{result['index'] + 1} {result['title'][:40]}: "
+                      f"{result['status'].upper()} ({result['error']})")
+    finally:
+        if report is not None:
+            report.close()
+        client.close()
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print("-" * 50)
+    print(f"{total} event(s) in {elapsed:.1f}s: "
+          + ", ".join(f"{counts[k]} {k}" for k in ("created", "exists", "failed", "invalid")))
+    if report_path:
+        print(f"Report: {report_path}")
+    return counts["failed"] == 0 and counts["invalid"] == 0
+
+
+def change_event(uid, changes=None):
+    """Update (changes given) or delete (changes None) one event; returns True on success"""
+    action = "Update" if changes is not None else "Delete"
+    print(f"iCloud CalDAV - {action} Event")
+    print("=" * 50)
+    print(f"UID: {uid}")
+    print(f"Calendar: {CALENDAR_ID[:8]}...")
+    print("-" * 50)
+
+    client = account_client(EMAIL, PASSWORD)
+    calendar_path = f"/{USER_ID}/calendars/{CALENDAR_ID}/"
+    if changes is not None:
+        result = update_event(client, calendar_path, uid, changes)
+    else:
+        result = delete_event(client, calendar_path, uid)
+
+    print(f"Status: {result['http_status']}")
+    if result["conflicts"]:
+        print(f"Changed elsewhere meanwhile; re-fetched and retried {result['conflicts']} time(s)")
+    if result["status"] in ("updated", "deleted"):
+        print(f"\nSUCCESS! Event {result['status']}.")
+        return True
+    if result["status"] == "not_found":
+        print("\nERROR: No event with this UID in the calendar.")
+    else:
+        print(f"\nERROR: {result['status']} ({result['error']})")
+    return False
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test creating events in iCloud Calendar")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--bulk", metavar="FILE",
+                      help="import events from a .csv, .json or .jsonl file")
+    mode.add_argument("--update", metavar="UID", help="change an existing event")
+    mode.add_argument("--delete", metavar="UID", help="delete an existing event")
+    parser.add_argument("--report", metavar="FILE",
+                        help="write per-event results (.csv or JSON Lines)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"PUTs in flight at once (default: {DEFAULT_CONCURRENCY})")
+    for field in ("title", "start", "end", "location", "description"):
+        parser.add_argument(f"--{field}", help=f"new {field} for --update")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    if args.bulk:
+        if "YOUR_" in EMAIL or "xxxx" in PASSWORD or "YOUR_" in USER_ID or "YOUR_" in CALENDAR_ID:
+            print("ERROR: Please configure your credentials first!")
+            raise SystemExit(1)
+        success = bulk_create(args.bulk, args.report, args.concurrency)
+        print("\n" + "=" * 50)
+        print("BULK WRITE COMPLETE!" if success else "BULK WRITE FINISHED WITH ERRORS!")
+        print("=" * 50)
+        raise SystemExit(0 if success else 1)
+
+    if args.update or args.delete:
+        if "YOUR_" in EMAIL or "xxxx" in PASSWORD or "YOUR_" in USER_ID or "YOUR_" in CALENDAR_ID:
+            print("ERROR: Please configure your credentials first!")
+            raise SystemExit(1)
+        changes = None
+        if args.update:
+            changes = {field: getattr(args, field) for field in
+                       ("title", "start", "end", "location", "description")
+                       if getattr(args, field) is not None}
+            if not changes:
+                print("ERROR: --update needs at least one of --title/--start/--end/--location/--description")
+                raise SystemExit(2)
+        raise SystemExit(0 if change_event(args.update or args.delete, changes) else 1)
+
     success = create_test_event()
 
     print("\n" + "=" * 50)
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the CalDAV scripts
+Runs against the local stand-in server, so numbers are reproducible offline
+
+Scenarios:
+    discovery    /.well-known -> principal -> home -> calendar list
+    read-day     calendar-query REPORT for one day, streamed and parsed
+    read-month   calendar-query REPORT for 30 days
+    read-summary 30 days with partial retrieval (SUMMARY + times, expanded)
+    read-year    one calendar-query REPORT for 365 days
+    read-range   the same 365 days in parallel adaptive windows (range_read)
+    bulk-write   concurrent If-None-Match PUTs (bulk_write.write_events)
+    parse        streaming multistatus + ICS parse of a captured body (no network)
+    parse-table  the same body parsed into an EventTable, sorted and range-filtered
+    multiget     refresh every known event of the calendar with batched calendar-multiget
+    startup      cold `icloud_caldav.py probe` in a new interpreter (stdlib only)
+    startup-read cold `icloud_caldav.py read` (imports requests, cached discovery)
+
+For each scenario it prints p50/p99 latency, throughput, KiB received per run
+and the peak Python memory of one extra traced run (tracemalloc). The server runs in its own
+process, so its allocations don't count towards the peak.
+
+--gzip makes the server compress its responses and --bandwidth caps its link
+speed; KiB in is what crossed the wire. Repeat --transport to run every
+scenario once per HTTP transport (see http_transport.py) and compare.
+
+Usage: python3 benchmark.py [--events 2000] [--latency 20] [--iterations 20]
+                            [--scenario read-day] [--json results.json]
+       python3 benchmark.py --gzip --bandwidth 50 --transport requests --transport httpx
+"""
+
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import instrumentation
+from bulk_write import write_events
+from calendar_read import (EXPAND, MULTIGET_BATCH_SIZE, SUMMARY_PROPS, calendar_path,
+                           calendar_query, fetch_occurrences, list_etags, multiget,
+                           occurrence_key)
+from caldav_client import CalDAVClient
+from discovery import run_discovery
+from http_transport import DEFAULT_TRANSPORT, TRANSPORTS
+from event_table import table_from_response
+from ics_parser import iter_occurrences
+from local_caldav_server import DEFAULT_EMAIL, DEFAULT_PASSWORD
+from multistatus import iter_calendar_data
+from range_read import read_range
+from search_index import SearchIndex, set_shared_index, shared_index
+
+SCENARIOS = ["discovery", "read-day", "read-month", "read-summary", "read-year", "read-range",
+             "bulk-write", "parse", "parse-table", "multiget", "search", "startup",
+             "startup-read"]
+
+DEFAULT_ITERATIONS = 20
+BULK_EVENTS = 200
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_caldav_server.py")
+CLI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icloud_caldav.py")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(calendars, events, latency, rate=None, compress=False, bandwidth=None):
+    """Start local_caldav_server.py in a subprocess; returns (process, base_url)"""
+    port = _free_port()
+    command = [sys.executable, SERVER_SCRIPT, "--port", str(port),
+               "--calendars", str(calendars), "--events", str(events),
+               "--latency", str(latency)]
+    if rate:
+        command += ["--rate", str(rate)]
+    if compress:
+        command += ["--gzip"]
+    if bandwidth:
+        command += ["--bandwidth", str(bandwidth)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("stand-in server exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("stand-in server did not start in time")
+
+
+# Response bytes received by the benchmark client (wire size, from Content-Length)
+received = {"bytes": 0}
+
+
+def _count_bytes(response, *args, **kwargs):
+    received["bytes"] += int(response.headers.get("Content-Length") or 0)
+
+
+def measure(name, run, iterations, warmup=1):
+    """
+    Call run() `iterations` times; run() returns the number of items it handled
+
+    Returns a result dict with latencies in ms, items/s, KiB received per run
+    and peak memory.
+    """
+    for _ in range(warmup):
+        run()
+
+    latencies = []
+    items = 0
+    bytes_before = received["bytes"]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        items += run()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    total = time.perf_counter() - started
+    kib_in = (received["bytes"] - bytes_before) / 1024 / iterations
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "ops_per_s": round(iterations / total, 2) if total else 0.0,
+        "items_per_s": round(items / total, 1) if total else 0.0,
+        "kib_in": round(kib_in, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def bench_discovery(client, info, args):
+    return measure("discovery", lambda: len(run_discovery(client)["calendars"]), args.iterations)
+
+
+def _read(client, path, days, props=None, recurrence=None):
+    window_start = datetime.datetime.now(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    window_end = window_start + datetime.timedelta(days=days)
+    return lambda: len(fetch_occurrences(client, path, window_start, window_end,
+                                         props, recurrence))
+
+
+def bench_read_day(client, info, args):
+    return measure("read-day", _read(client, info["path"], 1), args.iterations)
+
+
+def bench_read_month(client, info, args):
+    return measure("read-month", _read(client, info["path"], 30), args.iterations)
+
+
+def bench_read_summary(client, info, args):
+    return measure("read-summary", _read(client, info["path"], 30, SUMMARY_PROPS, EXPAND),
+                   args.iterations)
+
+
+def bench_read_year(client, info, args):
+    return measure("read-year", _read(client, info["path"], 365), args.iterations)
+
+
+def bench_read_range(client, info, args):
+    """365 days in windows; also reports when the first occurrence arrived"""
+    window_start = datetime.datetime.now(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    window_end = window_start + datetime.timedelta(days=365)
+    first = []
+
+    def run():
+        started = time.perf_counter()
+        count = 0
+        for _ in read_range(client, info["path"], window_start, window_end):
+            if not count:
+                first.append((time.perf_counter() - started) * 1000)
+            count += 1
+        return count
+
+    result = measure("read-range", run, args.iterations)
+    result["first_ms"] = round(percentile(first, 50), 2)
+    return result
+
+
+def bench_bulk_write(client, info, args):
+    """Each iteration imports a fresh batch; latency figures are per PUT"""
+    batch = [0]
+    put_latencies = []
+
+    def run():
+        batch[0] += 1
+        start = datetime.datetime(2031, 1, 1, 8, tzinfo=datetime.timezone.utc)
+        events = ({"title": f"Bench {batch[0]}-{i}",
+                   "start": start + datetime.timedelta(minutes=30 * i)}
+                  for i in range(args.bulk_events))
+        count = 0
+        for result in write_events(client, info["path"], events, concurrency=args.concurrency):
+            put_latencies.append(result["elapsed"] * 1000)
+            count += 1
+        return count
+
+    iterations = max(1, args.iterations // 5)
+    result = measure("bulk-write", run, iterations)
+    result["p50_ms"] = round(percentile(put_latencies, 50), 2)
+    result["p99_ms"] = round(percentile(put_latencies, 99), 2)
+    result["latency_unit"] = "per PUT"
+    return result
+
+
+def _captured_month(client, info):
+    """A month-long multistatus body, fetched once"""
+    window_start = datetime.datetime.now(datetime.timezone.utc)
+    window_end = window_start + datetime.timedelta(days=30)
+    response = client.report(info["path"], calendar_query(window_start, window_end), depth="1")
+    return response.content, window_start, window_end
+
+
+def _chunks(body, size=64 * 1024):
+    return (body[i:i + size] for i in range(0, len(body), size))
+
+
+def bench_parse(client, info, args):
+    """Parse a captured month-long multistatus body from memory into a sorted list"""
+    body, window_start, window_end = _captured_month(client, info)
+
+    def run():
+        events = []
+        for resource in iter_calendar_data(_chunks(body)):
+            events.extend(iter_occurrences(resource["calendar_data"], window_start, window_end))
+        events.sort(key=occurrence_key)
+        return len(events)
+
+    result = measure("parse", run, args.iterations)
+    result["body_kib"] = round(len(body) / 1024, 1)
+    return result
+
+
+def bench_parse_table(client, info, args):
+    """Same body into an EventTable, plus one range filter per run"""
+    body, window_start, window_end = _captured_month(client, info)
+    week_end = window_start + datetime.timedelta(days=7)
+
+    def run():
+        table = table_from_response(_chunks(body), window_start, window_end)
+        table.count_between(window_start, week_end)
+        return len(table)
+
+    result = measure("parse-table", run, args.iterations)
+    result["body_kib"] = round(len(body) / 1024, 1)
+    return result
+
+
+def bench_multiget(client, info, args):
+    """All hrefs from one ETag listing, fetched again per run (4 batches in flight)"""
+    hrefs = list(list_etags(client, info["path"]))
+
+    def run():
+        return sum(1 for record in multiget(client, info["path"], hrefs)
+                   if record["status"] == 200)
+
+    result = measure("multiget", run, args.iterations)
+    result["requests_per_run"] = -(-len(hrefs) // MULTIGET_BATCH_SIZE)
+    return result
+
+
+def bench_search(client, info, args):
+    """Keyword lookup in the local index; scan_p50_ms is reading the year and scanning titles"""
+    window_start = datetime.datetime.now(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    window_end = window_start + datetime.timedelta(days=365)
+    # Reads fill the index as a side effect
+    fetch_occurrences(client, info["path"], window_start, window_end)
+    index = shared_index()
+
+    result = measure("search", lambda: len(index.search("dentist", window_start, window_end)),
+                     args.iterations)
+    scan = measure("scan", lambda: sum(
+        1 for occ in fetch_occurrences(client, info["path"], window_start, window_end)
+        if "dentist" in occ["title"].lower()), min(args.iterations, 5))
+    result["scan_p50_ms"] = scan["p50_ms"]
+    result["indexed_events"] = len(index)
+    return result
+
+
+def _cli(info, command):
+    """Run icloud_caldav.py in a fresh interpreter against the stand-in server"""
+    env = dict(os.environ, CALDAV_BASE_URL=info["base_url"], CALDAV_EMAIL=DEFAULT_EMAIL,
+               CALDAV_PASSWORD=DEFAULT_PASSWORD, CALDAV_CACHE_DIR=info["cache_dir"],
+               CALDAV_TRANSPORT=info["transport"])
+    env.pop("CALDAV_CONFIG", None)
+
+    def run():
+        subprocess.run([sys.executable, CLI_SCRIPT] + command, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        return 1
+    return run
+
+
+def bench_startup(client, info, args):
+    """Wall time of a cron-style health check, including interpreter startup"""
+    result = measure("startup", _cli(info, ["probe"]), args.iterations)
+    # What an empty interpreter costs on this machine, for comparison
+    def bare_run():
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        return 1
+    bare = measure("python", bare_run, args.iterations)
+    result["interpreter_p50_ms"] = bare["p50_ms"]
+    return result
+
+
+def bench_startup_read(client, info, args):
+    return measure("startup-read", _cli(info, ["read"]), args.iterations)
+
+
+BENCHMARKS = {
+    "discovery": bench_discovery,
+    "read-day": bench_read_day,
+    "read-month": bench_read_month,
+    "read-summary": bench_read_summary,
+    "read-year": bench_read_year,
+    "read-range": bench_read_range,
+    "bulk-write": bench_bulk_write,
+    "parse": bench_parse,
+    "parse-table": bench_parse_table,
+    "multiget": bench_multiget,
+    "search": bench_search,
+    "startup": bench_startup,
+    "startup-read": bench_startup_read,
+}
+
+
+def print_results(results):
+    print(f"{'scenario':<12} {'transport':<9} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>9} "
+          f"{'items/s':>10} {'KiB in':>9} {'peak KiB':>10}")
+    print("-" * 84)
+    for r in results:
+        print(f"{r['scenario']:<12} {r['transport']:<9} {r['p50_ms']:>9} {r['p99_ms']:>9} "
+              f"{r['ops_per_s']:>9} {r['items_per_s']:>10} {r['kib_in']:>9} {r['peak_kib']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CalDAV scripts against the local stand-in")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="run only this scenario (repeatable; default: all)")
+    parser.add_argument("--calendars", type=int, default=3, help="synthetic calendars (default: 3)")
+    parser.add_argument("--events", type=int, default=2000, help="events per calendar (default: 2000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="server latency per request in ms")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS,
+                        help=f"timed runs per scenario (default: {DEFAULT_ITERATIONS})")
+    parser.add_argument("--bulk-events", type=int, default=BULK_EVENTS,
+                        help=f"events per bulk-write run (default: {BULK_EVENTS})")
+    parser.add_argument("--concurrency", type=int, default=8, help="bulk-write concurrency (default: 8)")
+    parser.add_argument("--limiter", action="store_true",
+                        help="keep the client's adaptive rate limiter on (default: off, to time the code)")
+    parser.add_argument("--gzip", action="store_true",
+                        help="server gzips responses for clients that accept it")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="server link speed in Mbit/s (default: unlimited)")
+    parser.add_argument("--transport", action="append", choices=TRANSPORTS,
+                        help=f"HTTP transport (repeatable; default: {DEFAULT_TRANSPORT})")
+    parser.add_argument("--url", default=None,
+                        help="use an already running stand-in server instead of starting one")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write results to this file")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+    # Keep the synthetic events out of the user's saved search index
+    set_shared_index(SearchIndex())
+
+    print("CalDAV Benchmark")
+    print("=" * 84)
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        print(f"Starting stand-in server ({args.calendars} calendars x {args.events} events, "
+              f"{args.latency:g} ms latency, gzip {'on' if args.gzip else 'off'}, "
+              f"{f'{args.bandwidth:g} Mbit/s' if args.bandwidth else 'unlimited bandwidth'})...")
+        process, base_url = start_server(args.calendars, args.events, args.latency,
+                                         compress=args.gzip, bandwidth=args.bandwidth)
+
+    try:
+        results = []
+        for transport in args.transport or [DEFAULT_TRANSPORT]:
+            client = CalDAVClient(DEFAULT_EMAIL, DEFAULT_PASSWORD, base_url=base_url,
+                                  rate_limiter=None if args.limiter else False,
+                                  transport=transport)
+            client.session.hooks["response"].append(_count_bytes)
+            discovered = run_discovery(client)
+            calendar_id = discovered["calendars"][0]["id"]
+            info = {"path": calendar_path(discovered["user_id"], calendar_id),
+                    "base_url": base_url, "cache_dir": tempfile.mkdtemp(prefix="caldav-bench-"),
+                    "transport": transport}
+            response = client.propfind(info["path"])
+            print(f"Server: {base_url}  calendar: {calendar_id}  transport: {transport} "
+                  f"({getattr(response, 'http_version', 'HTTP/1.1')}, "
+                  f"Accept-Encoding: {response.request.headers.get('Accept-Encoding')})")
+
+            for name in args.scenario or SCENARIOS:
+                result = BENCHMARKS[name](client, info, args)
+                result["transport"] = transport
+                results.append(result)
+            client.close()
+        print()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_results(results)
+    if args.json_path:
+        meta = {"calendars": args.calendars, "events": args.events, "latency_ms": args.latency,
+                "gzip": args.gzip, "bandwidth_mbit": args.bandwidth,
+                "python": sys.version.split()[0], "results": results}
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Bulk event creation for iCloud CalDAV
+
+Takes a stream of event dicts (e.g. from a CSV or JSON file), renders each
+one with a shared ICS template and PUTs them concurrently with a bounded
+number of requests in flight. Creation is idempotent: every PUT carries
+If-None-Match: * and events without an explicit uid get a deterministic one,
+so re-running an import reports "exists" instead of creating duplicates.
+
+Usage:
+    from bulk_write import load_events, write_events
+
+    for result in write_events(client, calendar_path, load_events("shifts.csv")):
+        print(result["uid"], result["status"])
+
+Event fields:
+    title (or summary), start, end         ISO 8601 ("2024-01-15T10:00:00Z",
+                                           "2024-01-15 10:00"; no offset = UTC,
+                                           or normalize_event's tz)
+    date, startTime, endTime               workflow style alternative
+    description, location, uid             optional
+    A date-only start ("2024-01-15") creates an all-day event.
+"""
+
+import csv
+import datetime
+import hashlib
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+from caldav_client import DEFAULT_ATTEMPTS
+from etag_cache import shared_etags
+
+# Max PUTs in flight at once
+DEFAULT_CONCURRENCY = 8
+
+PRODID = "-//n8n iCloud Calendar//EN"
+
+EVENT_TEMPLATE = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+PRODID:{prodid}\r
+CALSCALE:GREGORIAN\r
+BEGIN:VEVENT\r
+UID:{uid}\r
+DTSTAMP:{dtstamp}\r
+{dtstart}\r
+{dtend}\r
+{extra}END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+class EventError(ValueError):
+    """Raised when an input event can't be rendered"""
+
+
+def escape_text(value):
+    """RFC 5545 TEXT escaping"""
+    return (str(value).replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def fold_line(line):
+    """Fold a content line at 75 octets"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        # Don't split inside a UTF-8 sequence
+        while cut > 0 and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+
+def parse_when(value, tz=None):
+    """ISO 8601 date/datetime string -> date or aware datetime (tz, default UTC, if no offset)"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        parsed = value
+    else:
+        text = str(value).strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            if len(text) == 10:
+                return datetime.date.fromisoformat(text)
+            parsed = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            raise EventError(f"Invalid date/time: {value!r}")
+    if isinstance(parsed, datetime.datetime) and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz or datetime.timezone.utc)
+    return parsed
+
+
+def format_when(name, value):
+    """DTSTART/DTEND content line for a date (VALUE=DATE) or datetime (UTC)"""
+    if isinstance(value, datetime.datetime):
+        utc = value.astimezone(datetime.timezone.utc)
+        return f"{name}:{utc.strftime('%Y%m%dT%H%M%SZ')}"
+    return f"{name};VALUE=DATE:{value.strftime('%Y%m%d')}"
+
+
+def normalize_event(event, tz=None):
+    """
+    Validate an input dict and return {"uid", "title", "start", "end", ...}
+
+    Times without an offset are in tz (a tzinfo; default: UTC).
+    """
+    if not isinstance(event, dict):
+        raise EventError(f"Not an object: {event!r}")
+    title = event.get("title") or event.get("summary")
+    if not title:
+        raise EventError("Missing title")
+
+    if event.get("start"):
+        start = parse_when(event["start"], tz)
+        end = parse_when(event["end"], tz) if event.get("end") else None
+    elif event.get("date") and event.get("startTime"):
+        start = parse_when(f"{event['date']}T{event['startTime']}", tz)
+        end = (parse_when(f"{event['date']}T{event['endTime']}", tz)
+               if event.get("endTime") else None)
+    elif event.get("date"):
+        start = parse_when(event["date"])
+        end = None
+    else:
+        raise EventError("Missing start")
+
+    if end is None:
+        if isinstance(start, datetime.datetime):
+            end = start + datetime.timedelta(hours=1)
+        else:
+            end = start + datetime.timedelta(days=1)
+    if isinstance(start, datetime.datetime) != isinstance(end, datetime.datetime):
+        raise EventError("start and end must both be dates or both be date-times")
+    if end < start:
+        raise EventError("end is before start")
+
+    uid = str(event.get("uid") or "").strip()
+    if any(c in uid for c in "\r\n"):
+        raise EventError("uid must be one line")
+    if not uid:
+        # Deterministic, so re-importing the same file doesn't duplicate events
+        key = f"{title}|{start.isoformat()}|{end.isoformat()}"
+        uid = "n8n-bulk-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+    return {
+        "uid": uid,
+        "title": title,
+        "start": start,
+        "end": end,
+        "description": event.get("description") or "",
+        "location": event.get("location") or "",
+    }
+
+
+def render_event(event, dtstamp=None):
+    """Render a normalized event with the shared template"""
+    dtstamp = dtstamp or datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    extra = [f"SUMMARY:{escape_text(event['title'])}"]
+    if event["description"]:
+        extra.append(f"DESCRIPTION:{escape_text(event['description'])}")
+    if event["location"]:
+        extra.append(f"LOCATION:{escape_text(event['location'])}")
+    return EVENT_TEMPLATE.format(
+        prodid=PRODID,
+        uid=event["uid"],
+        dtstamp=dtstamp,
+        dtstart=format_when("DTSTART", event["start"]),
+        dtend=format_when("DTEND", event["end"]),
+        extra="".join(fold_line(line) + "\r\n" for line in extra),
+    )
+
+
+def load_events(path):
+    """
+    Stream event dicts from a .csv (header row) or .json / .jsonl file
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from (data if isinstance(data, list) else data.get("events", []))
+
+
+def event_href(calendar_path, uid):
+    """
+    Where put_event() stores an event: {calendar}/{uid}.ics
+
+    The UID is percent-encoded, so "/", "?", "#" or "%" in it can't change
+    the URL; the ICS keeps the real UID.
+    """
+    return calendar_path.rstrip("/") + f"/{quote(uid, safe='@')}.ics"
+
+
+def put_event(client, calendar_path, event, attempts=DEFAULT_ATTEMPTS, dtstamp=None):
+    """
+    Create one event (If-None-Match: *)
+
+    Throttling and transient failures are retried by the client (adaptive
+    rate limit + jittered backoff). Returns a result dict: {"uid", "title",
+    "status", "http_status", "attempts", "error", "elapsed"}. status is
+    "created", "exists" or "failed".
+    """
+    started = time.perf_counter()
+    result = {"uid": event["uid"], "title": event["title"], "status": "failed",
+              "http_status": None, "attempts": attempts, "error": ""}
+    ics_content = render_event(event, dtstamp)
+    path = event_href(calendar_path, event["uid"])
+
+    try:
+        response = client.put(path, ics_content, headers={"If-None-Match": "*"},
+                              attempts=attempts)
+    except Exception as e:
+        result["error"] = str(e)
+    else:
+        result["attempts"] = getattr(response, "attempts", 1)
+        result["http_status"] = response.status_code
+        if response.status_code in (201, 204):
+            result["status"] = "created"
+            # Remember what we wrote, so a later update can go straight to If-Match
+            shared_etags().remember(client.email, path, response.headers.get("ETag", ""),
+                                    event["uid"], ics_content)
+        elif response.status_code == 412:
+            # Already there (e.g. from an earlier run, or a retried PUT that succeeded)
+            result["status"] = "exists"
+        else:
+            result["error"] = f"HTTP {response.status_code}"
+
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def write_events(client, calendar_path, events, concurrency=DEFAULT_CONCURRENCY,
+                 attempts=DEFAULT_ATTEMPTS):
+    """
+    PUT a stream of event dicts with at most `concurrency` requests in flight
+
+    Yields one result dict per input event (plus "index") as each finishes.
+    The input is consumed lazily, so very large imports don't sit in memory.
+    """
+    dtstamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    events = iter(enumerate(events))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    index, raw = next(events)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    event = normalize_event(raw)
+                except EventError as e:
+                    raw = raw if isinstance(raw, dict) else {}
+                    yield {"index": index, "uid": raw.get("uid", ""),
+                           "title": raw.get("title") or raw.get("summary") or "",
+                           "status": "invalid", "http_status": None, "attempts": 0,
+                           "error": str(e), "elapsed": 0.0}
+                    continue
+                future = pool.submit(put_event, client, calendar_path, event, attempts, dtstamp)
+                pending[future] = index
+
+            if not pending:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                result = future.result()
+                result["index"] = index
+                yield result
+
+
+REPORT_FIELDS = ["index", "uid", "title", "status", "http_status", "attempts", "error", "elapsed"]
+
+
+class ResultReport:
+    """Writes per-event results as .csv or JSON Lines (any other extension)"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.csv = None
+        if path.endswith(".csv"):
+            self.csv = csv.DictWriter(self.file, fieldnames=REPORT_FIELDS)
+            self.csv.writeheader()
+
+    def write(self, result):
+        if self.csv is not None:
+            self.csv.writerow({k: result.get(k) for k in REPORT_FIELDS})
+        else:
+            self.file.write(json.dumps({k: result.get(k) for k in REPORT_FIELDS}) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
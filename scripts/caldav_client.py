@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV Client
+Shared HTTP client used by all scripts in this directory
+
+Each CalDAVClient owns one keep-alive requests.Session per Apple ID, so
+repeated PROPFIND/REPORT/PUT calls reuse warm TLS connections instead of
+opening a new one for every request. Requests are paced by an adaptive
+per-account, per-host token bucket and retried with jittered backoff when
+iCloud throttles (403/429/503) or the connection drops.
+
+The session sends over requests' own HTTP/1.1 pool by default; with
+CALDAV_TRANSPORT=httpx (or transport="httpx") it goes through httpx instead,
+multiplexing concurrent requests over one HTTP/2 connection per host when the
+h2 package is installed (see http_transport.py).
+
+Usage:
+    from caldav_client import CalDAVClient
+
+    client = CalDAVClient(EMAIL, PASSWORD)
+    response = client.propfind("/.well-known/caldav", depth="0")
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+from http_transport import DEFAULT_TRANSPORT, make_adapter
+from instrumentation import recorder
+
+# Override with CALDAV_BASE_URL to point the scripts at another server
+# (e.g. the local stand-in: CALDAV_BASE_URL=http://127.0.0.1:8843)
+BASE_URL = os.environ.get("CALDAV_BASE_URL", "https://caldav.icloud.com")
+
+# (connect timeout, read timeout) in seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+# Number of distinct hosts to keep pools for (caldav.icloud.com + partition hosts)
+DEFAULT_POOL_CONNECTIONS = 4
+# Number of keep-alive connections per host
+DEFAULT_POOL_MAXSIZE = 10
+
+# Local caches (sync state, discovery, event store) live here
+CACHE_DIR = os.environ.get(
+    "CALDAV_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "n8n-icloud-calendar")
+)
+
+XML_CONTENT_TYPE = "application/xml; charset=utf-8"
+ICS_CONTENT_TYPE = "text/calendar; charset=utf-8"
+
+# Methods that modify a calendar; write listeners are told about each one
+WRITE_METHODS = ["PUT", "DELETE", "MOVE", "PROPPATCH"]
+
+_write_listeners = []
+
+
+def collection_path(path_or_url):
+    """'/123/calendars/ABC/event.ics' or a full URL -> '/123/calendars/ABC/'"""
+    path = urlsplit(path_or_url).path
+    if not path.endswith("/"):
+        path = path.rsplit("/", 1)[0] + "/"
+    return path
+
+
+def add_write_listener(listener):
+    """
+    Call listener(client, url, response) after every write request
+
+    response is None if the request raised. Used by caches to drop data of
+    calendars that were just written to.
+    """
+    _write_listeners.append(listener)
+
+
+# Adaptive rate limit per (account, host): start, ceiling and floor in req/s
+DEFAULT_RATE = 10.0
+DEFAULT_MAX_RATE = 40.0
+DEFAULT_MIN_RATE = 0.2
+# Requests that may go out back-to-back before the rate applies
+DEFAULT_BURST = 20
+# AIMD: +RATE_INCREASE req/s per second of successes, x RATE_DECREASE on throttling
+RATE_INCREASE = 1.0
+RATE_DECREASE = 0.5
+
+# Attempts per request (first try + retries)
+DEFAULT_ATTEMPTS = 4
+# Backoff: BASE * 2^attempt seconds (+ jitter), capped at MAX
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Transient failures worth retrying
+RETRY_STATUSES = [408, 429, 500, 502, 503, 504]
+# Methods that only read; iCloud answers a burst of these with 403
+READ_METHODS = ["GET", "PROPFIND", "REPORT"]
+# Precondition errors in a 403 body that mean "not allowed", not "slow down"
+# (RFC 6578 expired sync token, RFC 3253 REPORT the server doesn't support)
+FORBIDDEN_ERRORS = [b"valid-sync-token", b"supported-report"]
+
+
+def retry_after_seconds(response):
+    """Retry-After header (seconds or HTTP date) -> seconds, or None"""
+    value = response.headers.get("Retry-After", "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def is_throttled(method, response):
+    """
+    True if the response means "slow down"
+
+    429 and 503 always do. iCloud throttles with a bare 403, so a 403 on a read
+    counts too, except the RFC 6578 invalid sync-token error and the
+    DAV:supported-report error of a server without the requested REPORT. A 403
+    on a write usually means a read-only calendar, so it only counts when the
+    server also sends Retry-After.
+    """
+    if response.status_code in (429, 503):
+        return True
+    if response.status_code == 403:
+        if method in READ_METHODS:
+            return not any(error in response.content for error in FORBIDDEN_ERRORS)
+        return "Retry-After" in response.headers
+    return False
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket per (account, host) whose rate adapts to throttling (AIMD)
+
+    Every success adds to the rate until DEFAULT_MAX_RATE; a throttled
+    response halves it (at most once per second, so one burst of 403s counts
+    once) and honours Retry-After by pausing the bucket. Thread-safe; one
+    instance is shared by all clients in the process by default.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=DEFAULT_MAX_RATE,
+                 min_rate=DEFAULT_MIN_RATE, burst=DEFAULT_BURST):
+        self.initial_rate = rate
+        self.max_rate = max(max_rate, rate)
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {"rate": self.initial_rate, "tokens": float(self.burst),
+                                           "updated": now, "decreased": 0.0}
+        elif now > bucket["updated"]:
+            bucket["tokens"] = min(self.burst, bucket["tokens"] +
+                                   (now - bucket["updated"]) * bucket["rate"])
+            bucket["updated"] = now
+        return bucket
+
+    def wait(self, key):
+        """Block until a request for key may be sent"""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(key, now)
+            bucket["tokens"] -= 1
+            # Waiting for a paused bucket, then for the tokens we're short
+            delay = max(0.0, bucket["updated"] - now)
+            if bucket["tokens"] < 0:
+                delay += -bucket["tokens"] / bucket["rate"]
+        if delay > 0:
+            time.sleep(delay)
+
+    def observe(self, key, throttled, retry_after=None):
+        """Feed back the outcome of a request"""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(key, now)
+            if not throttled:
+                bucket["rate"] = min(self.max_rate,
+                                     bucket["rate"] + RATE_INCREASE / bucket["rate"])
+                return
+            if now - bucket["decreased"] >= 1.0:
+                bucket["rate"] = max(self.min_rate, bucket["rate"] * RATE_DECREASE)
+                bucket["decreased"] = now
+            bucket["tokens"] = min(bucket["tokens"], 0.0)
+            if retry_after:
+                bucket["updated"] = max(bucket["updated"], now + retry_after)
+
+    def rate(self, key):
+        """Current rate for key (req/s)"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            return bucket["rate"] if bucket else self.initial_rate
+
+
+class RetryPolicy:
+    """
+    Jittered exponential backoff that honours Retry-After
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, base=BACKOFF_BASE, max_delay=BACKOFF_MAX):
+        self.attempts = attempts
+        self.base = base
+        self.max_delay = max_delay
+
+    def delay(self, attempt, response=None):
+        """Seconds to wait after failed attempt number `attempt` (0-based)"""
+        if response is not None:
+            retry_after = retry_after_seconds(response)
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+        delay = min(self.base * (2 ** attempt), self.max_delay)
+        return delay * (0.5 + random.random() / 2)
+
+
+# Shared by every client unless one is passed explicitly
+default_rate_limiter = AdaptiveRateLimiter()
+
+
+class CalDAVClient:
+    """
+    Pooled CalDAV client for one Apple ID
+
+    Every request goes through an adaptive rate limiter and is retried on
+    throttling (403 on reads, 429, 503), other transient statuses and
+    connection errors. rate_limiter / retry default to the shared limiter and
+    a RetryPolicy(); pass False to turn either off. transport is "requests"
+    or "httpx" (default: http_transport.DEFAULT_TRANSPORT).
+    """
+
+    def __init__(self, email, password, base_url=BASE_URL,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 timeout=DEFAULT_TIMEOUT,
+                 rate_limiter=None,
+                 retry=None,
+                 transport=None):
+        self.email = email
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        if rate_limiter is None:
+            rate_limiter = default_rate_limiter
+        self.rate_limiter = rate_limiter or None
+        if retry is None:
+            retry = RetryPolicy()
+        self.retry = retry or RetryPolicy(attempts=1)
+
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(email, password)
+        adapter = make_adapter(transport, pool_connections, pool_maxsize)
+        self.transport = transport or DEFAULT_TRANSPORT
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path):
+        """Build an absolute URL from a path (absolute URLs pass through)"""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        if not path.startswith("/"):
+            path = "/" + path
+        return self.base_url + path
+
+    def _send(self, method, url, body, headers, **kwargs):
+        if method not in WRITE_METHODS:
+            return self.session.request(method, url, data=body, headers=headers or {}, **kwargs)
+
+        response = None
+        try:
+            response = self.session.request(method, url, data=body, headers=headers or {}, **kwargs)
+            return response
+        finally:
+            for listener in _write_listeners:
+                listener(self, url, response)
+
+    def request(self, method, path, body=None, headers=None, attempts=None, **kwargs):
+        """
+        Send a request over the pooled session, rate limited and retried
+
+        The returned response has an `attempts` attribute. Connection errors
+        are re-raised after the last attempt. Timings go to
+        instrumentation.recorder when it is enabled.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        event = recorder.begin(method, url, body)
+        try:
+            response = self._request(method, url, body, headers, attempts, event, **kwargs)
+        except Exception as e:
+            recorder.end(event, error=e)
+            raise
+        recorder.end(event, response)
+        return response
+
+    def _request(self, method, url, body, headers, attempts, event, **kwargs):
+        key = (self.email.lower(), urlsplit(url).netloc)
+        attempts = attempts or self.retry.attempts
+
+        for attempt in range(attempts):
+            if self.rate_limiter is not None:
+                started = time.perf_counter()
+                self.rate_limiter.wait(key)
+                recorder.add(event, "wait", time.perf_counter() - started)
+            response = None
+            mark = recorder.mark(event)
+            try:
+                response = self._send(method, url, body, headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt + 1 >= attempts:
+                    raise
+            else:
+                recorder.sent(event, mark, response, kwargs.get("stream", False))
+                throttled = is_throttled(method, response)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.observe(
+                        key, throttled, retry_after_seconds(response) if throttled else None)
+                retry = throttled or response.status_code in RETRY_STATUSES
+                if not retry or attempt + 1 >= attempts:
+                    response.attempts = attempt + 1
+                    return response
+                response.close()
+            delay = self.retry.delay(attempt, response)
+            recorder.add(event, "backoff", delay)
+            time.sleep(delay)
+
+    def propfind(self, path, body=None, depth="0", **kwargs):
+        headers = {"Depth": depth}
+        if body is not None:
+            headers["Content-Type"] = XML_CONTENT_TYPE
+        return self.request("PROPFIND", path, body=body, headers=headers, **kwargs)
+
+    def report(self, path, body, depth="1", **kwargs):
+        headers = {
+            "Content-Type": XML_CONTENT_TYPE,
+            "Depth": depth
+        }
+        return self.request("REPORT", path, body=body, headers=headers, **kwargs)
+
+    def get(self, path, headers=None, **kwargs):
+        return self.request("GET", path, headers=headers, **kwargs)
+
+    def put(self, path, ics_content, headers=None, **kwargs):
+        all_headers = {"Content-Type": ICS_CONTENT_TYPE}
+        all_headers.update(headers or {})
+        return self.request("PUT", path, body=ics_content.encode("utf-8"),
+                            headers=all_headers, **kwargs)
+
+    def delete(self, path, headers=None, **kwargs):
+        return self.request("DELETE", path, headers=headers, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# One client per (account, base URL), shared across calls in the same process;
+# key -> {"client", "secret" (password hash), "options" (kwargs it was built with)}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(email, password, base_url=BASE_URL, **kwargs):
+    """
+    Return the shared CalDAVClient for an account, creating it on first use
+
+    A different password replaces the client (the old one is closed, it can
+    only get 401 now). So do explicitly passed options that differ from the
+    ones it was built with; without options any existing client is returned.
+    """
+    key = (email, base_url)
+    secret = hashlib.sha256(password.encode("utf-8")).hexdigest()
+    options = sorted((name, repr(value)) for name, value in kwargs.items())
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry is not None and entry["secret"] != secret:
+            entry["client"].close()
+            entry = None
+        if entry is None or (options and entry["options"] != options):
+            # Replaced clients stay usable by whoever already holds them
+            entry = _clients[key] = {
+                "client": CalDAVClient(email, password, base_url=base_url, **kwargs),
+                "secret": secret, "options": options}
+        return entry["client"]
+
+
+def close_all():
+    """Close every shared client (call at interpreter shutdown in long runs)"""
+    with _clients_lock:
+        for entry in _clients.values():
+            entry["client"].close()
+        _clients.clear()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Calendar read helpers: calendar-query REPORTs and multi-calendar fan-out
+
+read_calendars() queries every configured calendar concurrently over one
+pooled client and merges the per-calendar results with a k-way heap merge on
+real (UTC-normalized) start times, returning one ordered timeline in which
+every occurrence is tagged with its calendar name.
+
+Reads can ask the server for a projection (RFC 4791 partial retrieval): only
+the VEVENT properties that are needed, and optionally recurrence sets
+expanded or limited to the window. Pass props=SUMMARY_PROPS when only titles
+and times are used.
+
+Events whose hrefs are already known (from an ETag listing, a sync diff or
+stored UIDs) are fetched with calendar-multiget REPORTs instead: multiget()
+splits the hrefs into size-bounded batches, runs a few batches at a time and
+yields resources as each batch arrives, so 1,000 events take about ten
+round-trips instead of 1,000 GETs.
+
+Usage:
+    from calendar_read import read_calendars
+
+    timeline, errors = read_calendars(client, USER_ID,
+                                      {"personal": "...", "work": "..."},
+                                      window_start, window_end)
+
+    for occ in multiget_events(client, path, hrefs, window_start, window_end):
+        print(occ["start"], occ["title"])
+"""
+
+import heapq
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+from etag_cache import ics_uid, shared_etags
+from ics_parser import UTC, iter_occurrences, parse_calendar, to_utc
+from multistatus import iter_calendar_data, iter_responses, response_chunks, status_code
+from search_index import index_entry, shared_index
+
+CALENDAR_QUERY_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:prop>
+    <d:getetag/>
+    {calendar_data}
+  </d:prop>
+  <c:filter>
+    <c:comp-filter name="VCALENDAR">
+      <c:comp-filter name="VEVENT">
+        <c:time-range start="{start}" end="{end}"/>
+      </c:comp-filter>
+    </c:comp-filter>
+  </c:filter>
+</c:calendar-query>"""
+
+MULTIGET_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:prop>
+    <d:getetag/>
+    {calendar_data}
+  </d:prop>
+{hrefs}
+</c:calendar-multiget>"""
+
+ETAG_LISTING_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:">
+  <d:prop>
+    <d:getetag/>
+  </d:prop>
+</d:propfind>"""
+
+# Max hrefs per calendar-multiget REPORT
+MULTIGET_BATCH_SIZE = 100
+# Max size of the hrefs in one multiget request body (bytes)
+MULTIGET_MAX_HREF_BYTES = 32 * 1024
+# multiget REPORTs in flight at once per call
+MULTIGET_CONCURRENCY = 4
+
+# Properties the parser needs for times and recurrence; always requested
+# when a projection is used
+REQUIRED_PROPS = ["UID", "DTSTART", "DTEND", "DURATION", "RECURRENCE-ID",
+                  "RRULE", "RDATE", "EXDATE", "STATUS", "TRANSP"]
+# What an agent listing a day needs on top of REQUIRED_PROPS
+SUMMARY_PROPS = ["SUMMARY"]
+
+# recurrence= values for calendar_query()
+EXPAND = "expand"                       # server returns each instance in the window
+LIMIT_RECURRENCE_SET = "limit"          # master + only the overrides in the window
+
+# Status codes meaning "the server didn't understand the partial-retrieval request"
+PARTIAL_REJECTED_STATUSES = [400, 415, 422, 501]
+
+# Per host: what the server did with partial-retrieval hints
+# {"partial": True/False, "expand": True/False}, filled in by fetch_occurrences()
+server_features = {}
+
+
+class ReadError(Exception):
+    """Raised when a calendar REPORT does not return 207 Multi-Status"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def format_utc(value):
+    """datetime -> CalDAV UTC timestamp (20240115T000000Z)"""
+    return to_utc(value).strftime("%Y%m%dT%H%M%SZ")
+
+
+def calendar_data_element(window_start, window_end, props=None, recurrence=None):
+    """
+    <c:calendar-data> request element (RFC 4791 section 9.6)
+
+    props limits VEVENT properties to REQUIRED_PROPS plus these names; time
+    zones are always returned in full. recurrence is EXPAND or
+    LIMIT_RECURRENCE_SET to let the server trim recurrence sets to the window.
+    """
+    if not props and not recurrence:
+        return "<c:calendar-data/>"
+    lines = ["<c:calendar-data>"]
+    if recurrence:
+        element = "expand" if recurrence == EXPAND else "limit-recurrence-set"
+        lines.append(f'  <c:{element} start="{format_utc(window_start)}" end="{format_utc(window_end)}"/>')
+    if props:
+        names = list(REQUIRED_PROPS) + [p.upper() for p in props if p.upper() not in REQUIRED_PROPS]
+        lines.append('  <c:comp name="VCALENDAR">')
+        lines.append('    <c:prop name="VERSION"/>')
+        lines.append('    <c:comp name="VEVENT">')
+        lines.extend(f'      <c:prop name="{name}"/>' for name in names)
+        lines.append('    </c:comp>')
+        lines.append('    <c:comp name="VTIMEZONE"><c:allcomp/><c:allprop/></c:comp>')
+        lines.append('  </c:comp>')
+    lines.append("</c:calendar-data>")
+    return "\n    ".join(lines)
+
+
+def calendar_query(window_start, window_end, props=None, recurrence=None):
+    """calendar-query REPORT body for VEVENTs overlapping the window"""
+    return CALENDAR_QUERY_TEMPLATE.format(
+        start=format_utc(window_start), end=format_utc(window_end),
+        calendar_data=calendar_data_element(window_start, window_end, props, recurrence))
+
+
+def calendar_path(user_id, calendar_id):
+    return f"/{user_id}/calendars/{calendar_id}/"
+
+
+def occurrence_key(occurrence, tz=UTC):
+    """Sort key: real start time, all-day/floating values read in tz (default UTC)"""
+    return to_utc(occurrence["start"], tz)
+
+
+def _partial_honoured(ics_text, props):
+    """Did the server leave out the VEVENT properties that weren't asked for?"""
+    allowed = set(REQUIRED_PROPS) | {p.upper() for p in props}
+    for vevent in parse_calendar(ics_text).walk("VEVENT"):
+        if any(name not in allowed for name, _, _ in vevent.properties):
+            return False
+    return True
+
+
+def _expand_honoured(ics_text):
+    """True/False once a resource shows it, None if it can't tell (not recurring)"""
+    if "\nRRULE" in ics_text or "\nRDATE" in ics_text:
+        return False
+    if "\nRECURRENCE-ID" in ics_text:
+        return True
+    return None
+
+
+def _record(host, feature, honoured):
+    if honoured is not None:
+        server_features.setdefault(host, {})[feature] = honoured
+
+
+def fetch_occurrences(client, path, window_start, window_end, props=None, recurrence=None):
+    """
+    Run one calendar-query REPORT and return its occurrences sorted by start
+
+    props / recurrence request a server-side projection (see calendar_query).
+    The parser works on full or reduced payloads alike, so a server that
+    ignores the hints still gives correct results; what it did is recorded in
+    server_features, and hints a host is known to ignore are not sent again.
+    A request rejected because of the hints is retried without them.
+    """
+    host = urlsplit(client.url(path)).netloc
+    features = server_features.get(host, {})
+    if features.get("partial") is False:
+        props = None
+    if features.get("expand") is False and recurrence == EXPAND:
+        recurrence = None
+
+    response = client.report(path, calendar_query(window_start, window_end, props, recurrence),
+                             depth="1", stream=True)
+    if response.status_code in PARTIAL_REJECTED_STATUSES and (props or recurrence):
+        response.close()
+        _record(host, "partial", False if props else None)
+        _record(host, "expand", False if recurrence == EXPAND else None)
+        props = recurrence = None
+        response = client.report(path, calendar_query(window_start, window_end),
+                                 depth="1", stream=True)
+    if response.status_code != 207:
+        raise ReadError(f"REPORT failed: {response.status_code}", response.status_code)
+
+    # A server treats all resources alike: the first one tells whether the
+    # projection was applied, the first recurring one whether expand was
+    check_partial = bool(props)
+    check_expand = recurrence == EXPAND
+    etags = shared_etags()
+    occurrences = []
+    indexed = []
+    for resource in iter_calendar_data(response_chunks(response)):
+        data = resource["calendar_data"]
+        if check_partial and data:
+            _record(host, "partial", _partial_honoured(data, props))
+            check_partial = False
+        if check_expand and data:
+            expand = _expand_honoured(data)
+            _record(host, "expand", expand)
+            check_expand = expand is None
+        if resource["etag"]:
+            # Lets an update/delete of this event send If-Match without a lookup
+            etags.remember(client.email, resource["href"], resource["etag"], ics_uid(data))
+        resource_occurrences = list(iter_occurrences(data, window_start, window_end))
+        occurrences.extend(resource_occurrences)
+        indexed.append(index_entry(resource["href"], data, resource_occurrences))
+    occurrences.sort(key=occurrence_key)
+    # Keyword search without CalDAV traffic later (search_index.py)
+    if server_features.get(host, {}).get("partial") is False:
+        props = None
+    shared_index().update_window(client.email, path, window_start, window_end, indexed, props)
+    return occurrences
+
+
+def list_etags(client, path):
+    """
+    href -> ETag of every event resource in a calendar (PROPFIND Depth: 1)
+
+    Cheap compared to a calendar-query: no calendar-data is transferred.
+    """
+    response = client.propfind(path, body=ETAG_LISTING_REQUEST, depth="1", stream=True)
+    if response.status_code != 207:
+        raise ReadError(f"PROPFIND failed: {response.status_code}", response.status_code)
+    return {record["href"]: record["props"]["getetag"]
+            for record in iter_responses(response_chunks(response))
+            if not record["href"].endswith("/") and record["props"].get("getetag")}
+
+
+def multiget_batches(hrefs, batch_size=MULTIGET_BATCH_SIZE, max_bytes=MULTIGET_MAX_HREF_BYTES):
+    """Split an iterable of hrefs into lists bounded by count and encoded size"""
+    batch = []
+    size = 0
+    for href in hrefs:
+        href_size = len(escape(href).encode("utf-8")) + 20    # <d:href></d:href>
+        if batch and (len(batch) >= batch_size or size + href_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(href)
+        size += href_size
+    if batch:
+        yield batch
+
+
+def _multiget_batch(client, path, batch, props):
+    """One calendar-multiget REPORT -> list of records (see multiget())"""
+    host = urlsplit(client.url(path)).netloc
+    if server_features.get(host, {}).get("partial") is False:
+        props = None
+    hrefs = "\n".join(f"  <d:href>{escape(href)}</d:href>" for href in batch)
+
+    def send(props):
+        body = MULTIGET_TEMPLATE.format(calendar_data=calendar_data_element(None, None, props),
+                                        hrefs=hrefs)
+        return client.report(path, body, depth="1", stream=True)
+
+    try:
+        response = send(props)
+        if response.status_code in PARTIAL_REJECTED_STATUSES and props:
+            response.close()
+            _record(host, "partial", False)
+            props = None
+            response = send(props)
+    except Exception as e:
+        return [{"href": href, "etag": "", "calendar_data": "", "status": None,
+                 "error": str(e)} for href in batch]
+    if response.status_code != 207:
+        response.close()
+        return [{"href": href, "etag": "", "calendar_data": "", "status": response.status_code,
+                 "error": f"REPORT failed: {response.status_code}"} for href in batch]
+
+    etags = shared_etags()
+    records = []
+    for record in iter_responses(response_chunks(response)):
+        record_props = record["props"]
+        data = record_props.get("calendar-data") or ""
+        code = status_code(record["status"]) or (200 if data else 404)
+        etag = record_props.get("getetag", "")
+        if etag and data:
+            # Only a complete resource is worth keeping for an update
+            etags.remember(client.email, record["href"], etag, ics_uid(data),
+                           None if props else data)
+        records.append({"href": record["href"], "etag": etag, "calendar_data": data,
+                        "status": code, "error": "" if code == 200 else f"HTTP {code}"})
+    return records
+
+
+def multiget(client, path, hrefs, batch_size=MULTIGET_BATCH_SIZE,
+             concurrency=MULTIGET_CONCURRENCY, props=None):
+    """
+    Fetch known event resources with calendar-multiget REPORTs (RFC 4791 7.9)
+
+    hrefs may be any iterable (consumed lazily); it is split into batches of
+    at most batch_size hrefs, and up to `concurrency` batches are in flight.
+    Yields {"href", "etag", "calendar_data", "status", "error"} per resource
+    as its batch completes (not in input order). status is 200, 404 for a
+    resource that no longer exists, another HTTP status for a failed batch,
+    or None if the request itself failed. props requests a projection as in
+    calendar_query().
+    """
+    batches = multiget_batches(hrefs, batch_size)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                pending.add(pool.submit(_multiget_batch, client, path, batch, props))
+            if not pending:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def multiget_events(client, path, hrefs, window_start, window_end, props=None,
+                    concurrency=MULTIGET_CONCURRENCY):
+    """
+    Occurrences (see iter_occurrences) of the events at hrefs in the window
+
+    Streams per batch, so the output is grouped by resource rather than sorted;
+    each occurrence also carries its "href" and "etag". Missing or failed
+    resources are skipped; use multiget() to see them.
+    """
+    for record in multiget(client, path, hrefs, concurrency=concurrency, props=props):
+        if record["status"] != 200:
+            continue
+        for occ in iter_occurrences(record["calendar_data"], window_start, window_end):
+            occ["href"] = record["href"]
+            occ["etag"] = record["etag"]
+            yield occ
+
+
+def _tagged(name, occurrences):
+    for occ in occurrences:
+        occ["calendar"] = name
+        yield occ
+
+
+def read_calendars(client, user_id, calendars, window_start, window_end, concurrency=None,
+                   props=None, recurrence=None):
+    """
+    Query several calendars concurrently and merge them into one timeline
+
+    calendars maps a name to a CALENDAR_ID. Returns (timeline, errors):
+    timeline is a list of occurrences ordered by start time, each with a
+    "calendar" key; errors maps the names of failed calendars to the error.
+    props / recurrence are passed on to fetch_occurrences().
+    """
+    if not calendars:
+        return [], {}
+    concurrency = concurrency or len(calendars)
+
+    per_calendar = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(calendars))) as pool:
+        futures = {
+            name: pool.submit(fetch_occurrences, client, calendar_path(user_id, calendar_id),
+                              window_start, window_end, props, recurrence)
+            for name, calendar_id in calendars.items()
+        }
+        for name, future in futures.items():
+            try:
+                per_calendar[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+
+    timeline = list(heapq.merge(
+        *(_tagged(name, occurrences) for name, occurrences in per_calendar.items()),
+        key=occurrence_key))
+    return timeline, errors
+
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV - Calendar Service
+Long-running HTTP service for n8n (one HTTP Request node per call)
+
+Instead of a Code node that rebuilds the XML, re-authenticates and re-parses
+on every run, the service keeps one warm, pooled client per account, caches
+read results in a size-capped LRU cache (read_cache.ReadCache) and coalesces
+identical concurrent reads into one upstream REPORT. Writes through the
+service, or through any other client in the process, invalidate the cached
+ranges of the written calendar.
+
+Endpoints:
+    GET  /events?date=2024-01-15&calendar=personal    (calendar: name, "a,b" or "all")
+    POST /events  {"title", "date", "startTime", "endTime", "calendar"}
+    PATCH /events {"eventUid", "calendar", + any of title/date/startTime/endTime/location/description}
+    DELETE /events?eventUid=...&calendar=personal
+    GET  /search?q=dentist&from=2024-01-01&to=2024-12-31&calendar=all&limit=20
+    GET  /health
+    GET  /metrics   (Prometheus text format, see instrumentation.py)
+
+Responses have the same shape as the calendar-read / calendar-write
+sub-workflows, so an agent can switch without prompt changes.
+
+/search answers from the local keyword index (search_index.py) without
+contacting iCloud; without from/to it lists upcoming matches.
+
+Days and times are in --tz (default: the system's time zone), so an event
+at 09:00 Europe/Budapest is listed at 09:00 on its Budapest day. Times
+written without an offset ("startTime": "10:00") are in the same zone.
+
+Usage: python3 calendar_service.py [--host 127.0.0.1] [--port 8765] [--tz Europe/Budapest]
+"""
+
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import instrumentation
+from bulk_write import EventError, normalize_event, put_event
+from caldav_client import DEFAULT_POOL_MAXSIZE
+from calendar_read import EXPAND, SUMMARY_PROPS, calendar_path, occurrence_key
+from discovery import DiscoveryError, account_client, discover
+from event_update import delete_event, update_event
+from ics_parser import MAX_UTC_OFFSET, local_timezone, overlaps
+from read_cache import DEFAULT_MAX_BYTES, ReadCache, cache_key, cached_occurrences
+from search_index import shared_index
+
+# ============================================
+# CONFIGURATION - REPLACE WITH YOUR VALUES!
+# ============================================
+EMAIL = "YOUR_APPLE_ID@email.com"           # Your Apple ID email
+PASSWORD = "xxxx-xxxx-xxxx-xxxx"            # App-specific password
+USER_ID = "YOUR_USER_ID"                    # From step 1
+CALENDARS = {
+    'personal': 'YOUR_CALENDAR_ID',         # From step 2
+    # 'work': 'ANOTHER_CALENDAR_ID',
+}
+# ============================================
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Cached read results are served for this long (seconds)
+DEFAULT_CACHE_TTL = 60
+# Worker threads for blocking CalDAV calls
+DEFAULT_WORKERS = 16
+# Largest request body accepted (bytes)
+MAX_BODY = 1024 * 1024
+# Matches returned by /search unless ?limit= says otherwise
+DEFAULT_SEARCH_LIMIT = 20
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+               500: "Internal Server Error", 502: "Bad Gateway"}
+
+
+class HTTPError(Exception):
+    """Error answered with a JSON {"result", "error": true} body"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class CalendarService:
+    """
+    Read/write logic of the service, independent of the HTTP layer
+
+    Blocking CalDAV calls run on a thread pool over one shared client, so the
+    event loop only does cache lookups and JSON encoding. Days and times are
+    in tz (a tzinfo; default: the system's zone).
+    """
+
+    def __init__(self, email, password, user_id, calendars,
+                 cache_ttl=DEFAULT_CACHE_TTL, cache_bytes=DEFAULT_MAX_BYTES,
+                 workers=DEFAULT_WORKERS, tz=None):
+        self.email = email
+        self.password = password
+        self.user_id = user_id
+        self.tz = tz or local_timezone()
+        self.calendars = {name.lower(): cal_id for name, cal_id in calendars.items()}
+        self.cache = ReadCache(ttl=cache_ttl, max_bytes=cache_bytes)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pool_maxsize = max(workers, DEFAULT_POOL_MAXSIZE)
+        self.client = account_client(email, password, pool_maxsize=self.pool_maxsize)
+        self._inflight = {}    # cache key -> asyncio.Future
+        self.stats = {"reads": 0, "coalesced": 0, "writes": 0}
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def warm_up(self):
+        """Resolve (cached) discovery so the first request finds a warm connection"""
+        info = await self._run(discover, self.email, self.password)
+        # Discovery may have just learned the partition host
+        self.client = account_client(self.email, self.password, pool_maxsize=self.pool_maxsize)
+        return info
+
+    def resolve_calendars(self, value):
+        """'personal', 'personal,work' or 'all' -> list of names (like the workflow)"""
+        value = (value or "personal").lower()
+        if value == "all":
+            return list(self.calendars)
+        names = []
+        for name in (n.strip() for n in value.split(",")):
+            if not name:
+                continue
+            if name not in self.calendars:
+                name = "personal" if "personal" in self.calendars else next(iter(self.calendars))
+            if name not in names:
+                names.append(name)
+        return names or [next(iter(self.calendars))]
+
+    async def _day_occurrences(self, calendar_id, date):
+        """Occurrences of one calendar on one day in the service's time zone"""
+        day_start = datetime.datetime.combine(date, datetime.time(), tzinfo=self.tz)
+        day_end = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time(),
+                                            tzinfo=self.tz)
+        occurrences = await self._window_occurrences(
+            calendar_path(self.user_id, calendar_id),
+            day_start - MAX_UTC_OFFSET, day_end + MAX_UTC_OFFSET)
+        return [occ for occ in occurrences if overlaps(occ, day_start, day_end, self.tz)]
+
+    async def _window_occurrences(self, path, window_start, window_end):
+        """
+        Occurrences of one calendar in [window_start, window_end)
+
+        Served from the cache while fresh. Concurrent misses for the same key
+        wait on one future here instead of each holding a worker thread.
+        """
+        key = cache_key(self.client, path, window_start, window_end, SUMMARY_PROPS, EXPAND)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            # Responses only carry titles and times, so fetch just those
+            occurrences = await self._run(cached_occurrences, self.client, path,
+                                          window_start, window_end, self.cache,
+                                          SUMMARY_PROPS, EXPAND)
+            future.set_result(occurrences)
+            return occurrences
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def read(self, date_text, calendar):
+        self.stats["reads"] += 1
+        date_text = date_text or datetime.datetime.now(self.tz).date().isoformat()
+        try:
+            date = datetime.date.fromisoformat(date_text)
+        except ValueError:
+            raise HTTPError(400, f"Invalid date: {date_text!r} (expected YYYY-MM-DD)")
+        names = self.resolve_calendars(calendar)
+        calendar_name = ",".join(names)
+
+        results = await asyncio.gather(
+            *(self._day_occurrences(self.calendars[name], date) for name in names),
+            return_exceptions=True)
+
+        # One failing calendar doesn't discard the others (like the workflow)
+        events = []
+        errors = {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                errors[name] = str(getattr(result, "status_code", None) or result)
+                continue
+            for occ in result:
+                events.append((occurrence_key(occ, self.tz), name, occ))
+        if len(errors) == len(names):
+            raise HTTPError(502, "; ".join(f"Error reading {name}: {error}"
+                                           for name, error in errors.items()))
+        events.sort(key=lambda item: item[0])
+
+        multi = len(names) > 1
+        rows = []
+        for key, name, occ in events:
+            rows.append({
+                "time": "All day" if occ["all_day"] else f"{key.astimezone(self.tz):%H:%M}",
+                "title": occ["title"],
+                "calendar": name,
+                "start": int(key.timestamp() * 1000),
+            })
+        if rows:
+            result = f"Events for {date_text} ({calendar_name}):\n" + "\n".join(
+                f"- {row['time']}: {row['title']}" + (f" [{row['calendar']}]" if multi else "")
+                for row in rows)
+        else:
+            result = f"No events on {date_text} in {calendar_name} calendar."
+        if errors:
+            result += "\n" + "\n".join(f"Could not read {name} calendar: {error}"
+                                        for name, error in errors.items())
+        response = {"result": result, "events": rows, "calendar": calendar_name, "date": date_text}
+        if errors:
+            response["errors"] = errors
+        return response
+
+    def search(self, query):
+        """Keyword search in the local index; fast enough to run on the event loop"""
+        text = (query.get("q") or "").strip()
+        if not text:
+            raise HTTPError(400, "Missing q")
+        bounds = {}
+        for name in ("from", "to"):
+            if query.get(name):
+                try:
+                    bounds[name] = datetime.date.fromisoformat(query[name])
+                except ValueError:
+                    raise HTTPError(400, f"Invalid {name}: {query[name]!r} (expected YYYY-MM-DD)")
+        if not bounds:
+            bounds["from"] = datetime.datetime.now(self.tz).date()
+        try:
+            limit = int(query.get("limit") or DEFAULT_SEARCH_LIMIT)
+        except ValueError:
+            raise HTTPError(400, f"Invalid limit: {query['limit']!r}")
+        names = self.resolve_calendars(query.get("calendar") or "all")
+        by_path = {calendar_path(self.user_id, self.calendars[name]): name for name in names}
+        calendar_name = ",".join(names)
+
+        # The index keeps all-day dates at UTC midnight: search a little wider,
+        # then keep the hits that fall on the requested local days
+        wide = {name: datetime.datetime.combine(day, datetime.time(), tzinfo=self.tz)
+                for name, day in bounds.items()}
+        hits = shared_index().search(
+            text,
+            start=wide["from"] - MAX_UTC_OFFSET if "from" in wide else None,
+            end=wide["to"] + datetime.timedelta(days=1) + MAX_UTC_OFFSET if "to" in wide else None,
+            account=self.email, calendars=list(by_path))
+        rows = []
+        for hit in hits:
+            start = hit["start"] if hit["all_day"] else hit["start"].astimezone(self.tz)
+            day = start if hit["all_day"] else start.date()
+            if not bounds.get("from", day) <= day <= bounds.get("to", day):
+                continue
+            if len(rows) == limit:
+                break
+            rows.append({
+                "date": f"{start:%Y-%m-%d}",
+                "time": "All day" if hit["all_day"] else f"{start:%H:%M}",
+                "title": hit["title"],
+                "location": hit["location"],
+                "calendar": by_path.get(hit["calendar"], ""),
+                "eventUid": hit["uid"],
+            })
+        if rows:
+            result = f"Events matching {text!r} ({calendar_name}):\n" + "\n".join(
+                f"- {row['date']} {row['time']}: {row['title']}"
+                + (f" ({row['location']})" if row["location"] else "") for row in rows)
+        else:
+            result = f"No events matching {text!r} in {calendar_name} calendar."
+        return {"result": result, "events": rows, "calendar": calendar_name, "query": text}
+
+    async def write(self, payload):
+        self.stats["writes"] += 1
+        names = self.resolve_calendars(payload.get("calendar"))
+        name = names[0]
+        calendar_id = self.calendars[name]
+        try:
+            event = normalize_event(payload, self.tz)
+        except EventError as e:
+            raise HTTPError(400, f"Invalid event: {e}")
+
+        # The PUT invalidates this calendar's cached reads (read_cache write listener)
+        result = await self._run(put_event, self.client,
+                                 calendar_path(self.user_id, calendar_id), event)
+
+        if result["status"] == "failed":
+            return {"result": f"Error creating event: {result['error']}", "success": False}
+        when = event["start"]
+        if isinstance(when, datetime.datetime):
+            when = when.astimezone(self.tz)
+            time_range = f"{when:%H:%M} - {event['end'].astimezone(self.tz):%H:%M}"
+            date_text = f"{when:%Y-%m-%d}"
+        else:
+            time_range = "All day"
+            date_text = when.isoformat()
+        verb = "created" if result["status"] == "created" else "already exists"
+        return {
+            "result": f"Event {verb} in {name} calendar:\n- Title: {event['title']}\n"
+                      f"- Date: {date_text}\n- Time: {time_range}",
+            "success": True,
+            "calendar": name,
+            "eventUid": event["uid"],
+        }
+
+    async def change(self, payload, delete=False):
+        """Update (PATCH) or delete (DELETE) an event by UID, with If-Match"""
+        self.stats["writes"] += 1
+        uid = payload.get("eventUid") or payload.get("uid")
+        if not uid:
+            raise HTTPError(400, "Missing eventUid")
+        name = self.resolve_calendars(payload.get("calendar"))[0]
+        path = calendar_path(self.user_id, self.calendars[name])
+        if delete:
+            result = await self._run(delete_event, self.client, path, uid)
+        else:
+            changes = {k: v for k, v in payload.items()
+                       if k not in ("eventUid", "uid", "calendar")}
+            if not changes:
+                raise HTTPError(400, "Nothing to change")
+            result = await self._run(functools.partial(update_event, tz=self.tz),
+                                     self.client, path, uid, changes)
+
+        if result["status"] == "invalid":
+            raise HTTPError(400, f"Invalid event: {result['error']}")
+        if result["status"] == "not_found":
+            return {"result": f"No event {uid} in {name} calendar.", "success": False,
+                    "calendar": name, "eventUid": uid}
+        if result["status"] not in ("updated", "deleted"):
+            return {"result": f"Error changing event: {result['error'] or result['status']}",
+                    "success": False, "status": result["status"]}
+        return {"result": f"Event {result['status']} in {name} calendar.", "success": True,
+                "calendar": name, "eventUid": uid, "conflicts": result["conflicts"]}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# ============================================
+# HTTP layer (asyncio streams, HTTP/1.1 keep-alive)
+# ============================================
+
+async def _read_request(reader):
+    """-> (method, target, headers, body) or None on EOF"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def _write_response(writer, status, payload, keep_alive):
+    """payload is a JSON-able object, or a str sent as plain text (/metrics)"""
+    if isinstance(payload, str):
+        data = payload.encode("utf-8")
+        content_type = "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        content_type = "application/json; charset=utf-8"
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + data)
+
+
+def _json_body(body):
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Body must be JSON")
+    if not isinstance(payload, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    return payload
+
+
+async def _dispatch(service, method, target, body):
+    url = urlsplit(target)
+    if url.path == "/health":
+        return 200, {"ok": True, "stats": service.stats,
+                     "cache": dict(service.cache.stats, entries=len(service.cache),
+                                   bytes=service.cache.size)}
+    if url.path == "/metrics":
+        return 200, instrumentation.recorder.prometheus()
+    if url.path == "/search":
+        if method != "GET":
+            raise HTTPError(405, f"Method not allowed: {method}")
+        return 200, service.search({k: v[-1] for k, v in parse_qs(url.query).items()})
+    if url.path != "/events":
+        raise HTTPError(404, f"Unknown path: {url.path}")
+    if method == "GET":
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        return 200, await service.read(query.get("date"), query.get("calendar"))
+    if method == "POST":
+        response = await service.write(_json_body(body))
+        return (200 if response["success"] else 502), response
+    if method in ("PATCH", "DELETE"):
+        if method == "DELETE":
+            payload = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        else:
+            payload = _json_body(body)
+        response = await service.change(payload, delete=method == "DELETE")
+        if response["success"]:
+            return 200, response
+        if "eventUid" in response:
+            return 404, response
+        # Still 412 after the conflict retries: someone else keeps changing it
+        return (409 if response["status"] == "conflict" else 502), response
+    raise HTTPError(405, f"Method not allowed: {method}")
+
+
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            keep_alive = True
+            try:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await _dispatch(service, method, target, body)
+            except HTTPError as e:
+                status, payload = e.status, {"result": f"Error: {e}", "error": True}
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            except Exception as e:
+                status, payload = 500, {"result": f"Error: {e}", "error": True}
+            _write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+    """Run the HTTP server until cancelled"""
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(service, r, w), host, port)
+    if ready is not None:
+        ready(server)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service for n8n: read/write iCloud events")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"bind address (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port (default: {DEFAULT_PORT})")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL,
+                        help=f"seconds to serve cached reads (default: {DEFAULT_CACHE_TTL})")
+    parser.add_argument("--tz", default=None,
+                        help="IANA time zone of days and times (default: system local)")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="memory cap of the read cache in MB (default: %(default)s)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+    # Always record, so /metrics has data
+    instrumentation.recorder.enable()
+
+    print("iCloud CalDAV - Calendar Service")
+    print("=" * 60)
+
+    if "YOUR_" in EMAIL or "xxxx" in PASSWORD or "YOUR_" in USER_ID or \
+            any("YOUR_" in cal_id for cal_id in CALENDARS.values()):
+        print("\nERROR: Please configure your credentials first!")
+        return
+
+    try:
+        tz = local_timezone(args.tz)
+    except ValueError as e:
+        print(f"\nERROR: {e}")
+        return
+    service = CalendarService(EMAIL, PASSWORD, USER_ID, CALENDARS, cache_ttl=args.cache_ttl,
+                              cache_bytes=args.cache_mb * 1024 * 1024, tz=tz)
+
+    async def run():
+        try:
+            info = await service.warm_up()
+            print(f"Connected to {info['host']} ({len(info['calendars'])} calendar(s))")
+        except DiscoveryError as e:
+            print(f"Warning: discovery failed ({e}); continuing without warm-up")
+        await serve(service, args.host, args.port,
+                    ready=lambda server: print(f"Listening on http://{args.host}:{args.port}"))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Incremental calendar sync (RFC 6578 sync-collection)
+
+Keeps a local copy of every event resource in a calendar, keyed by href:
+href -> (etag, ics). The server's sync-token is persisted next to it, so
+each sync only transfers resources that changed or were deleted since the
+previous run. Range queries are then answered from the local copy.
+
+Usage:
+    from calendar_sync import SyncStore, sync_calendar, query_local
+
+    store = SyncStore.for_calendar(EMAIL, path)
+    sync_calendar(client, path, store)
+    for occ in query_local(store, window_start, window_end):
+        print(occ["start"], occ["title"])
+"""
+
+import hashlib
+import heapq
+import json
+import os
+from xml.sax.saxutils import escape
+
+from caldav_client import CACHE_DIR
+from calendar_read import MULTIGET_BATCH_SIZE, multiget
+from ics_parser import iter_occurrences, to_utc
+from multistatus import iter_responses, response_chunks, status_code
+from search_index import shared_index
+
+# Max sync-collection round-trips per sync (the server may truncate with 507)
+MAX_SYNC_ROUNDS = 20
+
+SYNC_COLLECTION_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<d:sync-collection xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:sync-token>{token}</d:sync-token>
+  <d:sync-level>1</d:sync-level>
+  <d:prop>
+    <d:getetag/>
+    <c:calendar-data/>
+  </d:prop>
+</d:sync-collection>"""
+
+
+class SyncError(Exception):
+    """Raised when the server rejects a sync request"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SyncStore:
+    """
+    Persisted sync state for one calendar: sync-token + href -> {etag, ics}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sync_token = ""
+        self.resources = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.sync_token = data.get("sync_token", "")
+            self.resources = data.get("resources", {})
+
+    @classmethod
+    def for_calendar(cls, email, calendar_path, cache_dir=CACHE_DIR):
+        key = hashlib.sha1(f"{email}|{calendar_path}".encode("utf-8")).hexdigest()[:16]
+        return cls(os.path.join(cache_dir, "sync", f"{key}.json"))
+
+    def reset(self):
+        self.sync_token = ""
+        self.resources = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sync_token": self.sync_token, "resources": self.resources}, f)
+        os.replace(tmp_path, self.path)
+
+
+def fetch_hrefs(client, calendar_path, hrefs, batch_size=MULTIGET_BATCH_SIZE):
+    """
+    Fetch calendar-data for known hrefs with calendar-multiget REPORTs
+
+    Yields {"href", "etag", "calendar_data"} records; hrefs that no longer
+    exist are skipped. Batches run concurrently (calendar_read.multiget).
+    """
+    for record in multiget(client, calendar_path, hrefs, batch_size=batch_size):
+        if record["status"] == 200:
+            yield record
+        elif record["status"] != 404:
+            raise SyncError(f"calendar-multiget failed: {record['error']}", record["status"])
+
+
+def sync_calendar(client, calendar_path, store, save=True):
+    """
+    Bring store up to date with the calendar at calendar_path
+
+    Returns {"changed": [...hrefs], "deleted": [...hrefs], "full": bool}; each
+    href is listed once, changed ones are in store.resources and deleted ones
+    aren't. A full resync is done on first use or when the server no longer
+    accepts the stored sync-token.
+    """
+    changed = []
+    deleted = []
+    full = not store.sync_token
+
+    for _ in range(MAX_SYNC_ROUNDS):
+        body = SYNC_COLLECTION_TEMPLATE.format(token=escape(store.sync_token))
+        response = client.report(calendar_path, body, depth="0", stream=True)
+
+        if (response.status_code in (403, 409) and store.sync_token
+                and b"valid-sync-token" in response.content):
+            # valid-sync-token precondition failed: start over. Any other 403
+            # (e.g. still throttled) is raised below and the token is kept.
+            response.close()
+            store.reset()
+            changed, deleted, full = [], [], True
+            continue
+        if response.status_code != 207:
+            raise SyncError(f"sync-collection failed: {response.status_code}",
+                            response.status_code)
+
+        meta = {}
+        missing = []
+        truncated = False
+        for record in iter_responses(response_chunks(response), meta):
+            href = record["href"]
+            code = status_code(record["status"])
+            if code == 404:
+                if store.resources.pop(href, None) is not None:
+                    deleted.append(href)
+                continue
+            if code == 507:
+                truncated = True
+                continue
+            props = record["props"]
+            etag = props.get("getetag")
+            if not etag:
+                continue
+            data = props.get("calendar-data")
+            if data:
+                store.resources[href] = {"etag": etag, "ics": data}
+                changed.append(href)
+            elif store.resources.get(href, {}).get("etag") != etag:
+                missing.append(href)
+
+        # Servers that don't return calendar-data in sync-collection
+        for record in fetch_hrefs(client, calendar_path, missing):
+            store.resources[record["href"]] = {
+                "etag": record["etag"],
+                "ics": record["calendar_data"],
+            }
+            changed.append(record["href"])
+
+        store.sync_token = meta.get("sync_token", store.sync_token)
+        if not truncated:
+            break
+
+    # Truncated (507) rounds can report an href more than once, or change
+    # and then delete it
+    changed = [href for href in dict.fromkeys(changed) if href in store.resources]
+    deleted = [href for href in dict.fromkeys(deleted) if href not in store.resources]
+
+    if save:
+        store.save()
+
+    index = shared_index()
+    if full:
+        index.remove_calendar(client.email, calendar_path)
+    for href in deleted:
+        index.remove_href(client.email, href)
+    for href in changed:
+        index.put_resource(client.email, href, store.resources[href]["ics"])
+    return {"changed": changed, "deleted": deleted, "full": full}
+
+
+def query_local(store, window_start, window_end):
+    """
+    Yield occurrences from the local copy that overlap [window_start, window_end),
+    sorted by start time
+    """
+    streams = [iter_occurrences(resource["ics"], window_start, window_end)
+               for resource in store.resources.values()]
+    yield from heapq.merge(*streams, key=lambda occ: to_utc(occ["start"]))
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV - Calendar Watcher
+Polls calendars cheaply and tells n8n what changed
+
+Instead of re-reading calendars on a timer, each calendar is checked with a
+single Depth: 0 PROPFIND for its getctag/sync-token. Only when that value
+changes is an incremental sync-collection run (calendar_sync.py), and the
+difference - UIDs added, changed and removed - is POSTed as JSON to an n8n
+Webhook node:
+
+    {"account": "anna@example.com", "calendar": "work", "calendar_id": "...",
+     "added": ["UID1"], "changed": ["UID2"], "removed": ["UID3"],
+     "full_resync": false, "detected_at": "2024-01-15T10:00:03+00:00"}
+
+Every calendar has its own poll interval: it drops to --min-interval after a
+change and grows by BACKOFF_FACTOR with every unchanged poll up to
+--max-interval, so quiet calendars cost one small PROPFIND every few minutes.
+Diffs that can't be delivered are kept (also across restarts) and merged
+with later ones until the webhook accepts them.
+
+Usage: python3 calendar_watch.py --webhook https://n8n.example.com/webhook/calendar
+       python3 calendar_watch.py --accounts staff.json --workers 16
+       python3 calendar_watch.py --once          # one round, e.g. from cron
+
+--accounts takes the same file as multi_account.py (default: the
+configuration below).
+"""
+
+import argparse
+import datetime
+import hashlib
+import heapq
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import instrumentation
+from caldav_client import CACHE_DIR
+from calendar_read import calendar_path
+from calendar_sync import SyncError, SyncStore, sync_calendar
+from discovery import DiscoveryError, account_client, collection_ctag, discover
+from etag_cache import ics_uid
+from multi_account import AccountError, load_accounts
+
+# ============================================
+# CONFIGURATION - REPLACE WITH YOUR VALUES!
+# ============================================
+EMAIL = "YOUR_APPLE_ID@email.com"           # Your Apple ID email
+PASSWORD = "xxxx-xxxx-xxxx-xxxx"            # App-specific password
+CALENDARS = {                               # From step 2 (empty: watch all calendars)
+    'personal': 'YOUR_CALENDAR_ID',
+}
+WEBHOOK_URL = "https://YOUR_N8N_HOST/webhook/calendar-changed"   # n8n Webhook node (POST)
+# ============================================
+
+# Poll interval bounds per calendar (seconds)
+DEFAULT_MIN_INTERVAL = 30
+DEFAULT_MAX_INTERVAL = 600
+# Interval growth per unchanged poll
+BACKOFF_FACTOR = 1.5
+# Random spread of each interval, so many calendars don't poll in lockstep
+INTERVAL_JITTER = 0.1
+# Calendars polled at the same time
+DEFAULT_WORKERS = 8
+
+# Webhook delivery
+WEBHOOK_ATTEMPTS = 3
+WEBHOOK_TIMEOUT = 10
+
+UTC = datetime.timezone.utc
+
+
+class CalendarWatch:
+    """
+    Watch state of one calendar
+
+    ctag and undelivered changes are persisted in CACHE_DIR/watch; the
+    watcher keeps its own SyncStore, so another script syncing the same
+    calendar can't make it miss a change.
+    """
+
+    def __init__(self, account, name, calendar_id, path, min_interval, cache_dir=CACHE_DIR):
+        self.account = account
+        self.name = name
+        self.calendar_id = calendar_id
+        self.path = path
+        self.interval = min_interval
+        key = hashlib.sha1(f"{account['email']}|{path}".encode("utf-8")).hexdigest()[:16]
+        self.state_path = os.path.join(cache_dir, "watch", f"{key}.json")
+        self.store = SyncStore(os.path.join(cache_dir, "watch", f"{key}.sync.json"))
+        self.uids = None      # href -> UID, built on first use
+        self.ctag = None
+        self.pending = {}     # UID -> "added" / "changed" / "removed"
+        self.full_resync = False
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, encoding="utf-8") as f:
+                    state = json.load(f)
+                self.ctag = state.get("ctag")
+                self.pending = state.get("pending", {})
+            except (OSError, ValueError):
+                pass
+
+    @property
+    def label(self):
+        return f"{self.account['name']}/{self.name}"
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ctag": self.ctag, "pending": self.pending}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def merge(self, uid, kind):
+        """Fold a change into the undelivered ones (added+removed cancel out)"""
+        previous = self.pending.get(uid)
+        if kind == "removed" and previous == "added":
+            del self.pending[uid]
+        elif kind == "added" and previous == "removed":
+            self.pending[uid] = "changed"
+        elif kind == "changed" and previous == "added":
+            pass
+        else:
+            self.pending[uid] = kind
+
+    def payload(self):
+        diff = {"added": [], "changed": [], "removed": []}
+        for uid, kind in sorted(self.pending.items()):
+            diff[kind].append(uid)
+        return {"account": self.account["email"], "calendar": self.name,
+                "calendar_id": self.calendar_id, "ctag": self.ctag, **diff,
+                "full_resync": self.full_resync,
+                "detected_at": datetime.datetime.now(UTC).isoformat(timespec="seconds")}
+
+
+def sync_diff(client, watch):
+    """
+    Incremental sync of one calendar -> number of changes merged into pending
+
+    Returns None for the very first sync (nothing to compare against).
+    """
+    if watch.uids is None:
+        watch.uids = {href: ics_uid(res["ics"]) for href, res in watch.store.resources.items()}
+    baseline = not watch.store.sync_token
+    before = {href: res["etag"] for href, res in watch.store.resources.items()}
+
+    result = sync_calendar(client, watch.path, watch.store)
+
+    count = 0
+    for href in result["changed"]:
+        resource = watch.store.resources.get(href)
+        if resource is None:
+            continue
+        watch.uids[href] = ics_uid(resource["ics"])
+        if href not in before:
+            kind = "added"
+        elif before[href] != resource["etag"]:
+            kind = "changed"
+        else:
+            # Re-sent by a full resync, but not modified
+            continue
+        if not baseline:
+            watch.merge(watch.uids[href], kind)
+            count += 1
+    # Deleted resources (also those a full resync no longer lists)
+    for href in set(before) - set(watch.store.resources):
+        uid = watch.uids.pop(href, "")
+        if uid and not baseline:
+            watch.merge(uid, "removed")
+            count += 1
+    if result["full"] and not baseline:
+        watch.full_resync = True
+    return None if baseline else count
+
+
+class Watcher:
+    """Schedules polls of many calendars and delivers their diffs"""
+
+    def __init__(self, webhook_url, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, workers=DEFAULT_WORKERS):
+        self.webhook_url = webhook_url
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.workers = workers
+        self.session = requests.Session()
+        self.watches = []
+        self.stats = {"polls": 0, "unchanged": 0, "syncs": 0, "posted": 0,
+                      "post_failures": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def add_account(self, account):
+        """Watch an account's configured (or, if none, all discovered) calendars"""
+        info = discover(account["email"], account["password"], revalidate=False)
+        calendars = account["calendars"] or {cal["name"]: cal["id"] for cal in info["calendars"]}
+        for name, calendar_id in calendars.items():
+            self.watches.append(CalendarWatch(
+                account, name, calendar_id, calendar_path(info["user_id"], calendar_id),
+                self.min_interval))
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def post(self, watch):
+        """POST the pending diff; returns True once the webhook accepted it"""
+        payload = watch.payload()
+        for attempt in range(WEBHOOK_ATTEMPTS):
+            try:
+                response = self.session.post(self.webhook_url, json=payload,
+                                             timeout=WEBHOOK_TIMEOUT)
+                if response.status_code < 300:
+                    self._count("posted")
+                    return True
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+            except requests.exceptions.RequestException:
+                pass
+            if attempt + 1 < WEBHOOK_ATTEMPTS:
+                time.sleep(2 ** attempt)
+        self._count("post_failures")
+        return False
+
+    def poll(self, watch):
+        """
+        One poll: ctag check, and sync + webhook only if it changed
+
+        Returns a short status string and adapts watch.interval.
+        """
+        self._count("polls")
+        client = account_client(watch.account["email"], watch.account["password"])
+        try:
+            ctag = collection_ctag(client, watch.path)
+            changed = ctag != watch.ctag or not watch.store.sync_token
+            status = "unchanged"
+            if changed:
+                self._count("syncs")
+                count = sync_diff(client, watch)
+                watch.ctag = ctag
+                status = "baseline" if count is None else f"{count} change(s)"
+        except (DiscoveryError, SyncError, requests.exceptions.RequestException) as e:
+            self._count("errors")
+            watch.interval = min(self.max_interval, watch.interval * 2)
+            return f"error: {e}"
+
+        if watch.pending:
+            if self.post(watch):
+                status += f", posted {len(watch.pending)} UID(s)"
+                watch.pending = {}
+                watch.full_resync = False
+            else:
+                status += f", webhook failed ({len(watch.pending)} UID(s) kept)"
+        if changed or status != "unchanged":
+            watch.save_state()
+
+        if changed and status != "baseline":
+            watch.interval = self.min_interval
+        else:
+            if not changed:
+                self._count("unchanged")
+            watch.interval = min(self.max_interval, watch.interval * BACKOFF_FACTOR)
+        return status
+
+    def _next_due(self, watch):
+        spread = 1 + random.uniform(-INTERVAL_JITTER, INTERVAL_JITTER)
+        return time.monotonic() + watch.interval * spread
+
+    def run(self, once=False, log=print):
+        """Poll until stop() (or one round with once=True)"""
+        now = time.monotonic()
+        # Spread the first round a little, so startup isn't one burst per host
+        schedule = [(now + i * 0.05, i) for i in range(len(self.watches))]
+        heapq.heapify(schedule)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while (schedule or pending) and not self._stop.is_set():
+                now = time.monotonic()
+                while schedule and schedule[0][0] <= now and len(pending) < self.workers * 2:
+                    _, index = heapq.heappop(schedule)
+                    pending[pool.submit(self.poll, self.watches[index])] = index
+                timeout = max(0.0, schedule[0][0] - now) if schedule else None
+                if not pending:
+                    self._stop.wait(timeout)
+                    continue
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    watch = self.watches[index]
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        self._count("errors")
+                        status = f"error: {e}"
+                    if status != "unchanged":
+                        log(f"{datetime.datetime.now():%H:%M:%S} {watch.label}: {status} "
+                            f"(next poll in {watch.interval:.0f}s)")
+                    if not once:
+                        heapq.heappush(schedule, (self._next_due(watch), index))
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch iCloud calendars and POST changes to n8n")
+    parser.add_argument("--webhook", default=os.environ.get("CALDAV_WEBHOOK_URL") or WEBHOOK_URL,
+                        help="n8n webhook URL (default: $CALDAV_WEBHOOK_URL or WEBHOOK_URL)")
+    parser.add_argument("--accounts", metavar="FILE",
+                        help="accounts file as for multi_account.py (default: configuration)")
+    parser.add_argument("--min-interval", type=float, default=DEFAULT_MIN_INTERVAL,
+                        help=f"seconds between polls after a change (default: {DEFAULT_MIN_INTERVAL})")
+    parser.add_argument("--max-interval", type=float, default=DEFAULT_MAX_INTERVAL,
+                        help=f"longest interval for quiet calendars (default: {DEFAULT_MAX_INTERVAL})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"calendars polled at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--once", action="store_true", help="poll every calendar once and exit")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    print("iCloud CalDAV - Calendar Watcher")
+    print("=" * 60)
+
+    if "YOUR_" in args.webhook:
+        print("\nERROR: Set WEBHOOK_URL (or use --webhook) to your n8n Webhook node URL")
+        return
+    if args.accounts:
+        try:
+            accounts = load_accounts(args.accounts)
+        except (AccountError, OSError, ValueError) as e:
+            print(f"\nERROR: {e}")
+            return
+    else:
+        if "YOUR_APPLE_ID" in EMAIL or "xxxx" in PASSWORD or \
+                any("YOUR_" in cal_id for cal_id in CALENDARS.values()):
+            print("\nERROR: Please configure your credentials first!")
+            return
+        accounts = [{"name": EMAIL, "email": EMAIL, "password": PASSWORD,
+                     "calendars": dict(CALENDARS)}]
+
+    watcher = Watcher(args.webhook, args.min_interval, args.max_interval, args.workers)
+    for account in accounts:
+        try:
+            watcher.add_account(account)
+        except (DiscoveryError, requests.exceptions.RequestException) as e:
+            print(f"Skipping {account['name']}: {e}")
+    if not watcher.watches:
+        print("\nNothing to watch.")
+        return
+    print(f"Watching {len(watcher.watches)} calendar(s) of {len(accounts)} account(s); "
+          f"interval {args.min_interval:g}-{args.max_interval:g}s")
+    print(f"Webhook: {args.webhook}\n")
+
+    started = time.perf_counter()
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        watcher.stop()
+    elapsed = time.perf_counter() - started
+    stats = watcher.stats
+    print(f"\n{stats['polls']} poll(s) in {elapsed:.0f}s: {stats['unchanged']} unchanged, "
+          f"{stats['syncs']} sync(s), {stats['posted']} webhook POST(s), "
+          f"{stats['post_failures']} failed POST(s), {stats['errors']} error(s)")
+
+
+if __name__ == "__main__":
+    main()
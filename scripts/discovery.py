@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV - Cached Account Discovery
+Resolves principal -> calendar-home-set -> calendar list once and caches it
+
+iCloud serves each account from a partition host (pXX-caldav.icloud.com)
+that caldav.icloud.com redirects to. The full discovery chain, including
+that host, is cached on disk per Apple ID. Until the TTL expires, later reads
+and writes go straight to the partition host with no discovery round-trips.
+A cheap Depth: 0 PROPFIND on the calendar home compares its getctag/sync-token
+with the cached value, so the calendar list is refreshed only when it changed.
+
+Usage: python3 discovery.py [--refresh]
+
+    from discovery import account_client, discover
+
+    info = discover(EMAIL, PASSWORD)       # cached after the first call
+    client = account_client(EMAIL, PASSWORD)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import instrumentation
+from caldav_client import BASE_URL, CACHE_DIR, get_client
+from multistatus import iter_calendars, iter_responses, response_chunks
+
+# ============================================
+# CONFIGURATION - REPLACE WITH YOUR VALUES!
+# ============================================
+EMAIL = "YOUR_APPLE_ID@email.com"           # Your Apple ID email
+PASSWORD = "xxxx-xxxx-xxxx-xxxx"            # App-specific password
+# ============================================
+
+# Cached discovery results are trusted for this long (seconds)
+DEFAULT_DISCOVERY_TTL = 24 * 60 * 60
+
+PRINCIPAL_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:">
+  <d:prop>
+    <d:current-user-principal/>
+  </d:prop>
+</d:propfind>"""
+
+HOME_SET_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:prop>
+    <c:calendar-home-set/>
+  </d:prop>
+</d:propfind>"""
+
+CALENDAR_LIST_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:" xmlns:cs="http://calendarserver.org/ns/" xmlns:ical="http://apple.com/ns/ical/">
+  <d:prop>
+    <d:resourcetype/>
+    <d:displayname/>
+    <ical:calendar-color/>
+    <cs:getctag/>
+    <d:sync-token/>
+  </d:prop>
+</d:propfind>"""
+
+HOME_CTAG_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:" xmlns:cs="http://calendarserver.org/ns/">
+  <d:prop>
+    <cs:getctag/>
+    <d:sync-token/>
+  </d:prop>
+</d:propfind>"""
+
+
+class DiscoveryError(Exception):
+    """Raised when a discovery step fails"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def cache_path(email, cache_dir=CACHE_DIR):
+    # Keyed by entry URL too, so a local stand-in server never shares iCloud's cache
+    key = hashlib.sha1(f"{email.lower()}|{BASE_URL}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "discovery", f"{key}.json")
+
+
+def load_cached(email, cache_dir=CACHE_DIR):
+    path = cache_path(email, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached(email, info, cache_dir=CACHE_DIR):
+    path = cache_path(email, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Unique per writer, so concurrent saves for one account don't collide
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _propfind_one(client, path, body, depth="0"):
+    """PROPFIND and return (first record, final URL after redirects)"""
+    response = client.propfind(path, body=body, depth=depth, stream=True)
+    if response.status_code != 207:
+        raise DiscoveryError(f"PROPFIND {path} failed: {response.status_code}",
+                             response.status_code)
+    records = list(iter_responses(response_chunks(response)))
+    if not records:
+        raise DiscoveryError(f"PROPFIND {path} returned no properties")
+    return records[0], response.url
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    netloc = parts.netloc
+    if netloc.endswith(":443") and parts.scheme == "https":
+        netloc = netloc[:-4]
+    return f"{parts.scheme}://{netloc}"
+
+
+def collection_ctag(client, url):
+    """getctag (or sync-token) of a collection with one Depth: 0 PROPFIND"""
+    record, _ = _propfind_one(client, url, HOME_CTAG_REQUEST)
+    props = record["props"]
+    return props.get("getctag") or props.get("sync-token") or ""
+
+
+def _list_calendars(client, home_url):
+    response = client.propfind(home_url, body=CALENDAR_LIST_REQUEST, depth="1", stream=True)
+    if response.status_code != 207:
+        raise DiscoveryError(f"Calendar list failed: {response.status_code}",
+                             response.status_code)
+    return list(iter_calendars(response_chunks(response)))
+
+
+def run_discovery(client):
+    """
+    Walk the full chain: /.well-known/caldav -> principal -> home -> calendars
+    """
+    record, final_url = _propfind_one(client, "/.well-known/caldav", PRINCIPAL_REQUEST)
+    principal = record["props"].get("current-user-principal")
+    if not principal:
+        raise DiscoveryError("current-user-principal not found")
+    principal_url = principal if "://" in principal else _origin(final_url) + principal
+
+    record, final_url = _propfind_one(client, principal_url, HOME_SET_REQUEST)
+    home = record["props"].get("calendar-home-set")
+    if not home:
+        raise DiscoveryError("calendar-home-set not found")
+    home_url = home if "://" in home else _origin(final_url) + home
+
+    host = _origin(home_url)
+    home_path = urlsplit(home_url).path
+    user_id = principal.strip("/").split("/")[-2] if principal.rstrip("/").endswith("principal") else ""
+
+    return {
+        "principal": principal,
+        "user_id": user_id,
+        "host": host,
+        "calendar_home": home_path,
+        "home_ctag": collection_ctag(client, home_url),
+        "calendars": _list_calendars(client, home_url),
+        "discovered_at": time.time(),
+    }
+
+
+def discover(email, password, ttl=DEFAULT_DISCOVERY_TTL, refresh=False,
+             revalidate=True, cache_dir=CACHE_DIR):
+    """
+    Return cached discovery info for an account, refreshing when needed
+
+    - No cache, expired TTL, or refresh=True: full discovery.
+    - Otherwise, with revalidate=True, one Depth: 0 PROPFIND on the calendar
+      home checks its ctag; the calendar list is re-read only if it changed.
+    """
+    cached = None if refresh else load_cached(email, cache_dir)
+    if cached and time.time() - cached.get("discovered_at", 0) <= ttl:
+        if not revalidate:
+            return cached
+        client = get_client(email, password, base_url=cached["host"])
+        home_url = cached["host"] + cached["calendar_home"]
+        ctag = collection_ctag(client, home_url)
+        if ctag and ctag == cached.get("home_ctag"):
+            return cached
+        cached["calendars"] = _list_calendars(client, home_url)
+        cached["home_ctag"] = ctag
+        save_cached(email, cached, cache_dir)
+        return cached
+
+    info = run_discovery(get_client(email, password))
+    save_cached(email, info, cache_dir)
+    return info
+
+
+def account_base_url(email, cache_dir=CACHE_DIR):
+    """
+    The account's partition host if it is known from the cache (no network
+    access), else caldav.icloud.com
+    """
+    cached = load_cached(email, cache_dir)
+    return cached["host"] if cached and cached.get("host") else BASE_URL
+
+
+def account_client(email, password, cache_dir=CACHE_DIR, **kwargs):
+    """Shared client for an account, pointed at its partition host"""
+    return get_client(email, password, base_url=account_base_url(email, cache_dir), **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discover and cache iCloud CalDAV account details")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cache")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_DISCOVERY_TTL,
+                        help=f"cache lifetime in seconds (default: {DEFAULT_DISCOVERY_TTL})")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    print("iCloud CalDAV - Account Discovery")
+    print("=" * 60)
+
+    if "YOUR_APPLE_ID" in EMAIL or "xxxx" in PASSWORD:
+        print("\nERROR: Please configure your credentials first!")
+        return
+
+    started = time.perf_counter()
+    try:
+        info = discover(EMAIL, PASSWORD, ttl=args.ttl, refresh=args.refresh)
+    except DiscoveryError as e:
+        print(f"\nERROR: {e}")
+        if e.status_code == 401:
+            print("Check your EMAIL and app-specific PASSWORD.")
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+
+    print(f"USER_ID:       {info['user_id']}")
+    print(f"Host:          {info['host']}")
+    print(f"Calendar home: {info['calendar_home']}")
+    print(f"\n{len(info['calendars'])} calendar(s):")
+    for cal in info["calendars"]:
+        print(f"  {cal['name']}: {cal['id']}")
+    print(f"\nDone in {elapsed:.0f} ms (cache: {cache_path(EMAIL)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Known event resources: UID -> href + ETag (+ full ICS when we have it)
+
+Reads (calendar_read.fetch_occurrences) and our own PUTs (bulk_write,
+event_update) record what they saw, so an update or delete can send
+If-Match straight away instead of re-querying the calendar for the event
+first. Entries may go stale; a stale ETag just costs one 412 and one GET
+of that resource (see event_update.py).
+
+Usage:
+    from etag_cache import shared_etags
+
+    known = shared_etags().lookup(client.email, calendar_path, uid)
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from caldav_client import collection_path
+
+# Resources remembered per process (least recently used are dropped)
+MAX_ENTRIES = 20000
+
+_FOLD_RE = re.compile(r"\r?\n[ \t]")
+_UID_RE = re.compile(r"^UID(?:;[^:\r\n]*)?:(.*?)\r?$", re.MULTILINE)
+
+
+def ics_uid(ics):
+    """UID of the first component in an ICS text ('' if none)"""
+    match = _UID_RE.search(ics)
+    if match and ics[match.end():match.end() + 2] in ("\n ", "\n\t"):
+        # Folded UID line; unfold and search again
+        match = _UID_RE.search(_FOLD_RE.sub("", ics))
+    return match.group(1).strip() if match else ""
+
+
+class EtagCache:
+    """
+    Thread-safe LRU map (account, calendar, uid) -> {"href", "etag", "ics"}
+
+    "ics" is only kept when it's the complete resource (not a partial or
+    expanded calendar-data), otherwise it is None.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(account, href_or_calendar, uid):
+        return account.lower(), collection_path(href_or_calendar), uid
+
+    def remember(self, account, href, etag, uid, ics=None):
+        if not uid:
+            return
+        key = self._key(account, href, uid)
+        with self._lock:
+            self._entries[key] = {"href": href, "etag": etag or "", "ics": ics}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, account, calendar, uid):
+        """Copy of the entry for uid in calendar, or None"""
+        key = self._key(account, calendar, uid)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry)
+
+    def forget(self, account, calendar, uid):
+        with self._lock:
+            self._entries.pop(self._key(account, calendar, uid), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_shared = EtagCache()
+
+
+def shared_etags():
+    """The process-wide EtagCache"""
+    return _shared
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV - Local Event Store
+Persistent SQLite store of events with a time-range index
+
+The store is filled by `sync` (incremental sync-collection, see
+calendar_sync.py). Recurring events are expanded once, within the stored
+window, into an occurrences table indexed on (calendar_id, start_ts), so a
+range query like "events on 2024-01-15" is a single indexed lookup with no
+network traffic. Reads fall back to the network when the cached data is
+older than the TTL or the range is outside the stored window.
+
+Usage:
+    python3 event_store.py sync [--days-back 30] [--days-ahead 365]
+    python3 event_store.py query 2024-01-15 [--ttl 900]
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+import instrumentation
+from caldav_client import CACHE_DIR, get_client
+from calendar_sync import sync_calendar
+from ics_parser import UTC, iter_occurrences, to_utc
+
+# ============================================
+# CONFIGURATION - REPLACE WITH YOUR VALUES!
+# ============================================
+EMAIL = "YOUR_APPLE_ID@email.com"           # Your Apple ID email
+PASSWORD = "xxxx-xxxx-xxxx-xxxx"            # App-specific password
+USER_ID = "YOUR_USER_ID"                    # From step 1
+
+# Calendars to keep in the store (from step 2)
+CALENDARS = [
+    "YOUR_CALENDAR_ID",
+]
+# ============================================
+
+DEFAULT_DB_PATH = os.path.join(CACHE_DIR, "events.sqlite3")
+
+# Cached data older than this (seconds) is refreshed from iCloud before reading
+DEFAULT_TTL = 15 * 60
+
+# Window of occurrences materialized by a sync, relative to today
+DEFAULT_DAYS_BACK = 30
+DEFAULT_DAYS_AHEAD = 365
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendars (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT NOT NULL DEFAULT '',
+    fetched_at REAL NOT NULL DEFAULT 0,
+    window_start INTEGER NOT NULL DEFAULT 0,
+    window_end INTEGER NOT NULL DEFAULT 0,
+    max_duration INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS resources (
+    calendar_id TEXT NOT NULL,
+    href TEXT NOT NULL,
+    uid TEXT NOT NULL DEFAULT '',
+    etag TEXT NOT NULL DEFAULT '',
+    ics TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, href)
+);
+CREATE INDEX IF NOT EXISTS resources_uid ON resources (calendar_id, uid);
+CREATE TABLE IF NOT EXISTS occurrences (
+    calendar_id TEXT NOT NULL,
+    href TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    all_day INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    title TEXT NOT NULL,
+    location TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    recurrence_id TEXT
+);
+CREATE INDEX IF NOT EXISTS occurrences_start ON occurrences (calendar_id, start_ts);
+CREATE INDEX IF NOT EXISTS occurrences_href ON occurrences (calendar_id, href);
+"""
+
+
+def _ts(value):
+    return int(to_utc(value).timestamp())
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _from_iso(text, all_day):
+    if text is None:
+        return None
+    if all_day:
+        return datetime.date.fromisoformat(text)
+    return datetime.datetime.fromisoformat(text)
+
+
+class _SyncState:
+    """Adapter giving sync_calendar() the sync_token/resources view of one calendar"""
+
+    def __init__(self, sync_token, resources):
+        self.sync_token = sync_token
+        self.resources = resources
+
+    def reset(self):
+        self.sync_token = ""
+        self.resources = {}
+
+
+class EventStore:
+    """
+    SQLite-backed event store keyed by calendar ID and UID
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # ---------- state ----------
+
+    def calendar_state(self, calendar_id):
+        row = self.db.execute("SELECT * FROM calendars WHERE calendar_id = ?",
+                              (calendar_id,)).fetchone()
+        return dict(row) if row else None
+
+    def is_fresh(self, calendar_id, window_start, window_end, ttl=DEFAULT_TTL):
+        """True if the stored data covers the window and is younger than ttl"""
+        state = self.calendar_state(calendar_id)
+        if state is None or not state["fetched_at"]:
+            return False
+        if time.time() - state["fetched_at"] > ttl:
+            return False
+        return (state["window_start"] <= _ts(window_start)
+                and _ts(window_end) <= state["window_end"])
+
+    # ---------- writes ----------
+
+    def _index_resource(self, calendar_id, href, ics, window_start, window_end):
+        """Expand one resource into occurrences; returns (uid, longest duration)"""
+        uid = ""
+        max_duration = 0
+        rows = []
+        for occ in iter_occurrences(ics, window_start, window_end):
+            uid = uid or occ["uid"]
+            start_ts, end_ts = _ts(occ["start"]), _ts(occ["end"])
+            max_duration = max(max_duration, end_ts - start_ts)
+            rows.append((
+                calendar_id, href, occ["uid"], start_ts, end_ts, int(occ["all_day"]),
+                _iso(occ["start"]), _iso(occ["end"]), occ["title"],
+                occ["location"], occ["description"], _iso(occ["recurrence_id"]),
+            ))
+        self.db.executemany(
+            "INSERT INTO occurrences VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return uid, max_duration
+
+    def sync(self, client, calendar_id, calendar_path, window_start, window_end):
+        """
+        Refresh one calendar from iCloud and re-index what changed
+
+        Returns the sync_calendar() summary.
+        """
+        state = self.calendar_state(calendar_id)
+        resources = {
+            row["href"]: {"etag": row["etag"], "ics": row["ics"]}
+            for row in self.db.execute(
+                "SELECT href, etag, ics FROM resources WHERE calendar_id = ?", (calendar_id,))
+        }
+        sync_state = _SyncState(state["sync_token"] if state else "", resources)
+        result = sync_calendar(client, calendar_path, sync_state, save=False)
+
+        same_window = (state is not None
+                       and state["window_start"] == _ts(window_start)
+                       and state["window_end"] == _ts(window_end))
+        reindex_all = result["full"] or not same_window
+
+        with self.db:
+            if reindex_all:
+                self.db.execute("DELETE FROM resources WHERE calendar_id = ?", (calendar_id,))
+                self.db.execute("DELETE FROM occurrences WHERE calendar_id = ?", (calendar_id,))
+                hrefs = list(sync_state.resources)
+                max_duration = 0
+            else:
+                hrefs = list(dict.fromkeys(result["changed"]))
+                max_duration = state["max_duration"]
+                for href in result["deleted"] + hrefs:
+                    self.db.execute("DELETE FROM resources WHERE calendar_id = ? AND href = ?",
+                                    (calendar_id, href))
+                    self.db.execute("DELETE FROM occurrences WHERE calendar_id = ? AND href = ?",
+                                    (calendar_id, href))
+
+            for href in hrefs:
+                resource = sync_state.resources.get(href)
+                if resource is None:
+                    continue
+                uid, duration = self._index_resource(
+                    calendar_id, href, resource["ics"], window_start, window_end)
+                max_duration = max(max_duration, duration)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO resources (calendar_id, href, uid, etag, ics) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (calendar_id, href, uid, resource["etag"], resource["ics"]))
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?, ?)",
+                (calendar_id, sync_state.sync_token, time.time(),
+                 _ts(window_start), _ts(window_end), max_duration))
+        return result
+
+    # ---------- reads ----------
+
+    def query(self, calendar_id, window_start, window_end):
+        """
+        Occurrences overlapping [window_start, window_end), sorted by start
+
+        Uses the (calendar_id, start_ts) index: only rows starting after
+        window_start - longest event duration need to be checked.
+        """
+        state = self.calendar_state(calendar_id)
+        max_duration = state["max_duration"] if state else 0
+        start_ts, end_ts = _ts(window_start), _ts(window_end)
+        rows = self.db.execute(
+            """SELECT * FROM occurrences
+               WHERE calendar_id = ?
+                 AND start_ts < ? AND start_ts >= ?
+                 AND (end_ts > ? OR (end_ts = start_ts AND start_ts >= ?))
+               ORDER BY start_ts""",
+            (calendar_id, end_ts, start_ts - max_duration, start_ts, start_ts))
+        for row in rows:
+            all_day = bool(row["all_day"])
+            yield {
+                "uid": row["uid"],
+                "title": row["title"],
+                "start": _from_iso(row["start"], all_day),
+                "end": _from_iso(row["end"], all_day),
+                "all_day": all_day,
+                "location": row["location"],
+                "description": row["description"],
+                "recurrence_id": row["recurrence_id"],
+                "calendar_id": calendar_id,
+            }
+
+    def find_uid(self, calendar_id, uid):
+        """Return {"href", "etag", "ics"} for an event UID, or None"""
+        row = self.db.execute(
+            "SELECT href, etag, ics FROM resources WHERE calendar_id = ? AND uid = ?",
+            (calendar_id, uid)).fetchone()
+        return dict(row) if row else None
+
+
+def default_window(days_back=DEFAULT_DAYS_BACK, days_ahead=DEFAULT_DAYS_AHEAD):
+    today = datetime.datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - datetime.timedelta(days=days_back), today + datetime.timedelta(days=days_ahead)
+
+
+def read_events(store, client, calendar_id, calendar_path, window_start, window_end,
+                ttl=DEFAULT_TTL):
+    """
+    Read-through range query
+
+    Answers from the store when it is fresh and covers the window; otherwise
+    syncs first (widening the stored window to include the request). If the
+    network fails, stale local data is returned rather than nothing.
+    Returns (events, source) where source is "cache", "network" or "stale".
+    """
+    if store.is_fresh(calendar_id, window_start, window_end, ttl):
+        return list(store.query(calendar_id, window_start, window_end)), "cache"
+
+    sync_start, sync_end = default_window()
+    state = store.calendar_state(calendar_id)
+    if state and state["window_end"]:
+        sync_start = min(sync_start, datetime.datetime.fromtimestamp(state["window_start"], UTC))
+        sync_end = max(sync_end, datetime.datetime.fromtimestamp(state["window_end"], UTC))
+    sync_start = min(sync_start, to_utc(window_start))
+    sync_end = max(sync_end, to_utc(window_end))
+
+    try:
+        store.sync(client, calendar_id, calendar_path, sync_start, sync_end)
+        source = "network"
+    except Exception as e:
+        if state is None:
+            raise
+        print(f"Refresh failed ({e}), serving cached data", file=sys.stderr)
+        source = "stale"
+    return list(store.query(calendar_id, window_start, window_end)), source
+
+
+def _configured():
+    return not ("YOUR_" in EMAIL or "xxxx" in PASSWORD or "YOUR_" in USER_ID
+                or not CALENDARS or "YOUR_" in CALENDARS[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local iCloud event store")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = sub.add_parser("sync", help="fetch/sync all configured calendars")
+    sync_parser.add_argument("--days-back", type=int, default=DEFAULT_DAYS_BACK)
+    sync_parser.add_argument("--days-ahead", type=int, default=DEFAULT_DAYS_AHEAD)
+
+    query_parser = sub.add_parser("query", help="list events on a date (YYYY-MM-DD)")
+    query_parser.add_argument("date")
+    query_parser.add_argument("--ttl", type=int, default=DEFAULT_TTL,
+                              help=f"max cache age in seconds (default: {DEFAULT_TTL})")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    if not _configured():
+        print("ERROR: Please configure your credentials first!")
+        print("Edit the CONFIGURATION section of this file.")
+        return
+
+    store = EventStore(args.db)
+    client = get_client(EMAIL, PASSWORD)
+
+    if args.command == "sync":
+        window_start, window_end = default_window(args.days_back, args.days_ahead)
+        for calendar_id in CALENDARS:
+            path = f"/{USER_ID}/calendars/{calendar_id}/"
+            started = time.perf_counter()
+            result = store.sync(client, calendar_id, path, window_start, window_end)
+            elapsed = time.perf_counter() - started
+            print(f"{calendar_id[:8]}...: {len(result['changed'])} changed, "
+                  f"{len(result['deleted'])} deleted ({elapsed:.2f}s)")
+
+    elif args.command == "query":
+        day = datetime.datetime.strptime(args.date, "%Y-%m-%d").replace(tzinfo=UTC)
+        for calendar_id in CALENDARS:
+            path = f"/{USER_ID}/calendars/{calendar_id}/"
+            started = time.perf_counter()
+            events, source = read_events(store, client, calendar_id, path,
+                                         day, day + datetime.timedelta(days=1), args.ttl)
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"\n{calendar_id[:8]}... ({len(events)} event(s), {source}, {elapsed:.1f} ms)")
+            for event in events:
+                time_str = "All day" if event["all_day"] else event["start"].strftime("%H:%M")
+                print(f"  {time_str} - {event['title']}")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
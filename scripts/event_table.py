@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Compact, column-oriented container for large sets of event occurrences
+
+A list of occurrence dicts costs roughly 1 KB per event (dict, datetimes,
+strings). EventTable stores the same data in typed arrays instead: start and
+end as UTC epoch seconds, a calendar index, an all-day flag, and indexes into
+interned string pools for uid, title and location. Tens of thousands of
+occurrences then fit in a few MB, sort in one pass over a float array and
+range-filter with a binary search.
+
+The familiar dict form is still available, lazily, one row at a time.
+
+Usage:
+    from event_table import EventTable, read_table
+
+    table = read_table(client, USER_ID, {"work": "...", "home": "..."},
+                       window_start, window_end)
+    for row in table.between(day_start, day_end).rows():
+        print(row["title"], row["start"])
+"""
+
+import bisect
+import datetime
+import json
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from calendar_read import calendar_path, fetch_occurrences
+from ics_parser import iter_occurrences, to_utc
+from multistatus import iter_calendar_data
+
+UTC = datetime.timezone.utc
+
+
+class StringPool:
+    """Interns strings; each distinct value is stored once and referenced by index"""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def add(self, value):
+        index = self._index.get(value)
+        if index is None:
+            index = self._index[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class EventRow:
+    """Lazy view of one table row; attributes are decoded on access"""
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def start(self):
+        return self.table._decode_time(self.table.start_ts[self.index], self.table.all_day[self.index])
+
+    @property
+    def end(self):
+        return self.table._decode_time(self.table.end_ts[self.index], self.table.all_day[self.index])
+
+    @property
+    def title(self):
+        return self.table.titles[self.table.title_ids[self.index]]
+
+    @property
+    def uid(self):
+        return self.table.uids[self.table.uid_ids[self.index]]
+
+    @property
+    def location(self):
+        return self.table.locations[self.table.location_ids[self.index]]
+
+    @property
+    def calendar(self):
+        return self.table.calendars[self.table.calendar_ids[self.index]]
+
+    @property
+    def all_day(self):
+        return bool(self.table.all_day[self.index])
+
+    def to_dict(self):
+        return {
+            "uid": self.uid,
+            "title": self.title,
+            "start": self.start,
+            "end": self.end,
+            "all_day": self.all_day,
+            "location": self.location,
+            "calendar": self.calendar,
+        }
+
+    def __repr__(self):
+        return f"EventRow({self.to_dict()!r})"
+
+
+class EventTable:
+    """
+    Column store of occurrences: typed arrays + interned strings
+
+    Rows keep insertion order until sort() is called; between() needs a
+    sorted table (it sorts on first use).
+    """
+
+    def __init__(self):
+        self.start_ts = array("d")
+        self.end_ts = array("d")
+        self.all_day = array("b")
+        self.calendar_ids = array("H")
+        self.uid_ids = array("I")
+        self.title_ids = array("I")
+        self.location_ids = array("I")
+        self.calendars = StringPool()
+        self.uids = StringPool()
+        self.titles = StringPool()
+        self.locations = StringPool()
+        # Longest event, so an overlap search can start early enough
+        self.max_duration = 0.0
+        self.sorted = True
+
+    def __len__(self):
+        return len(self.start_ts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return EventRow(self, index)
+
+    def __iter__(self):
+        return (EventRow(self, i) for i in range(len(self)))
+
+    @staticmethod
+    def _decode_time(timestamp, all_day):
+        value = datetime.datetime.fromtimestamp(timestamp, UTC)
+        return value.date() if all_day else value
+
+    def append(self, occurrence, calendar=""):
+        """Add one occurrence dict (as yielded by ics_parser.iter_occurrences)"""
+        start = to_utc(occurrence["start"]).timestamp()
+        end = to_utc(occurrence["end"]).timestamp()
+        if self.sorted and self.start_ts and start < self.start_ts[-1]:
+            self.sorted = False
+        self.start_ts.append(start)
+        self.end_ts.append(end)
+        self.all_day.append(1 if occurrence["all_day"] else 0)
+        self.calendar_ids.append(self.calendars.add(calendar or occurrence.get("calendar", "")))
+        self.uid_ids.append(self.uids.add(occurrence["uid"]))
+        self.title_ids.append(self.titles.add(occurrence["title"]))
+        self.location_ids.append(self.locations.add(occurrence.get("location") or ""))
+        self.max_duration = max(self.max_duration, end - start)
+
+    def extend(self, occurrences, calendar=""):
+        for occurrence in occurrences:
+            self.append(occurrence, calendar)
+        return self
+
+    @classmethod
+    def from_occurrences(cls, occurrences, calendar=""):
+        return cls().extend(occurrences, calendar)
+
+    def _take(self, indexes):
+        """New table with the given rows (shares the string pools)"""
+        table = EventTable.__new__(EventTable)
+        for name in ("start_ts", "end_ts", "all_day", "calendar_ids",
+                     "uid_ids", "title_ids", "location_ids"):
+            column = getattr(self, name)
+            setattr(table, name, array(column.typecode, [column[i] for i in indexes]))
+        table.calendars = self.calendars
+        table.uids = self.uids
+        table.titles = self.titles
+        table.locations = self.locations
+        table.max_duration = self.max_duration
+        table.sorted = self.sorted
+        return table
+
+    def sort(self):
+        """Sort rows by start time (stable), in place"""
+        if self.sorted:
+            return self
+        starts = self.start_ts
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        sorted_table = self._take(order)
+        sorted_table.sorted = True
+        self.__dict__.update(sorted_table.__dict__)
+        return self
+
+    def _span(self, window_start, window_end):
+        self.sort()
+        start = to_utc(window_start).timestamp()
+        end = to_utc(window_end).timestamp()
+        # Events starting before the window can only overlap it if they started
+        # at most max_duration earlier
+        low = bisect.bisect_left(self.start_ts, start - self.max_duration)
+        high = bisect.bisect_left(self.start_ts, end)
+        return start, low, high
+
+    def between(self, window_start, window_end):
+        """Rows overlapping [window_start, window_end), as a new (sorted) table"""
+        start, low, high = self._span(window_start, window_end)
+        end_ts = self.end_ts
+        start_ts = self.start_ts
+        return self._take([i for i in range(low, high)
+                           if end_ts[i] > start or (end_ts[i] == start_ts[i] == start)])
+
+    def count_between(self, window_start, window_end):
+        start, low, high = self._span(window_start, window_end)
+        end_ts = self.end_ts
+        start_ts = self.start_ts
+        return sum(1 for i in range(low, high)
+                   if end_ts[i] > start or (end_ts[i] == start_ts[i] == start))
+
+    def where_calendar(self, name):
+        """Rows of one calendar, as a new table"""
+        try:
+            wanted = self.calendars.values.index(name)
+        except ValueError:
+            return self._take([])
+        ids = self.calendar_ids
+        return self._take([i for i in range(len(ids)) if ids[i] == wanted])
+
+    def rows(self):
+        """Yield each row as a dict (created on demand)"""
+        for i in range(len(self)):
+            yield EventRow(self, i).to_dict()
+
+    def to_json_lines(self, file):
+        for row in self.rows():
+            file.write(json.dumps(row, default=str, ensure_ascii=False) + "\n")
+
+    def memory_bytes(self):
+        """Approximate size of the columns and string pools"""
+        size = sum(column.itemsize * len(column) for column in (
+            self.start_ts, self.end_ts, self.all_day, self.calendar_ids,
+            self.uid_ids, self.title_ids, self.location_ids))
+        for pool in (self.calendars, self.uids, self.titles, self.locations):
+            size += sum(len(value) + 49 for value in pool.values)
+        return size
+
+
+def table_from_response(xml_response, window_start=None, window_end=None, calendar=""):
+    """
+    Build a sorted EventTable straight from a REPORT response
+
+    xml_response may be the full body or an iterable of body chunks; no list
+    of occurrence dicts is built on the way.
+    """
+    table = EventTable()
+    for resource in iter_calendar_data(xml_response):
+        table.extend(iter_occurrences(resource["calendar_data"], window_start, window_end), calendar)
+    return table.sort()
+
+
+def read_table(client, user_id, calendars, window_start, window_end, concurrency=None):
+    """
+    Read several calendars concurrently into one sorted EventTable
+
+    calendars maps a name to a CALENDAR_ID. Raises the first ReadError if
+    any calendar fails. Times come back in UTC (dates for all-day events).
+    """
+    table = EventTable()
+    if not calendars:
+        return table
+    with ThreadPoolExecutor(max_workers=min(concurrency or len(calendars), len(calendars))) as pool:
+        futures = {
+            name: pool.submit(fetch_occurrences, client, calendar_path(user_id, calendar_id),
+                              window_start, window_end)
+            for name, calendar_id in calendars.items()
+        }
+        for name, future in futures.items():
+            # Each calendar's dicts are released as soon as they're in the table
+            table.extend(future.result(), name)
+    return table.sort()
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Update and delete events by UID with ETag concurrency control
+
+Every write is conditional (If-Match: <etag>), so a change made meanwhile
+in Calendar.app or on another device is never overwritten blindly. On
+412 Precondition Failed only the changed resource is fetched again (one
+GET), the same changes are applied to its current version and the write
+is retried.
+
+The event is found without re-querying the calendar whenever possible:
+
+    1. ETags learned by this process (reads, earlier writes: etag_cache)
+    2. the sync-collection copy of the calendar (calendar_sync.SyncStore)
+    3. an EventStore row, if one is passed in
+    4. GET {calendar}/{uid}.ics  (where our own writes put events)
+    5. a calendar-query REPORT filtered on the UID
+
+If an href from 1-3 is gone (the event was moved or re-created elsewhere),
+steps 4 and 5 are tried before reporting "not_found".
+
+Updates edit the stored ICS in place: only the given properties change,
+everything else (alarms, attendees, RRULE, ...) is kept, SEQUENCE is bumped.
+
+Usage:
+    from event_update import delete_event, update_event
+
+    result = update_event(client, calendar_path, uid, {"start": "2024-01-15T14:00:00Z"})
+    print(result["status"])        # updated / not_found / conflict / failed
+"""
+
+import datetime
+import time
+from xml.sax.saxutils import escape
+
+from bulk_write import EventError, escape_text, event_href, fold_line, format_when, parse_when
+from caldav_client import DEFAULT_ATTEMPTS
+from calendar_sync import SyncStore
+from etag_cache import ics_uid, shared_etags
+from ics_parser import (make_tz_resolver, parse_calendar, parse_datetime, parse_duration,
+                        parse_line, to_utc, unfold)
+from multistatus import iter_calendar_data, response_chunks
+
+# Writes retried after a 412 (each one after re-fetching the resource)
+MAX_CONFLICT_RETRIES = 3
+
+UID_QUERY_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<c:calendar-query xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <d:prop>
+    <d:getetag/>
+    <c:calendar-data/>
+  </d:prop>
+  <c:filter>
+    <c:comp-filter name="VCALENDAR">
+      <c:comp-filter name="VEVENT">
+        <c:prop-filter name="UID">
+          <c:text-match collation="i;octet">{uid}</c:text-match>
+        </c:prop-filter>
+      </c:comp-filter>
+    </c:comp-filter>
+  </c:filter>
+</c:calendar-query>"""
+
+# Input fields -> the ICS property they replace
+TEXT_FIELDS = {"title": "SUMMARY", "summary": "SUMMARY",
+               "description": "DESCRIPTION", "location": "LOCATION"}
+
+
+class UpdateError(Exception):
+    """Raised when the server answers a lookup with an unexpected status"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def fetch_resource(client, href):
+    """GET one resource -> {"href", "etag", "ics"}, or None if it's gone"""
+    response = client.get(href)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise UpdateError(f"GET failed: {response.status_code}", response.status_code)
+    response.encoding = response.encoding or "utf-8"
+    return {"href": href, "etag": response.headers.get("ETag", ""), "ics": response.text}
+
+
+def query_uid(client, calendar_path, uid):
+    """Find a resource by UID with one filtered calendar-query REPORT"""
+    response = client.report(calendar_path, UID_QUERY_TEMPLATE.format(uid=escape(uid)),
+                             depth="1", stream=True)
+    if response.status_code != 207:
+        raise UpdateError(f"REPORT failed: {response.status_code}", response.status_code)
+    found = None
+    for resource in iter_calendar_data(response_chunks(response)):
+        # A server that ignores the filter returns everything; check ourselves
+        if found is None and ics_uid(resource["calendar_data"]) == uid:
+            found = {"href": resource["href"], "etag": resource["etag"],
+                     "ics": resource["calendar_data"]}
+    return found
+
+
+def find_event(client, calendar_path, uid, event_store=None, calendar_id=None):
+    """
+    Locate an event by UID -> {"href", "etag", "ics"} or None
+
+    "ics" (and rarely "etag") may be empty when the event is only known from
+    a partial read; update_event() then GETs the resource before writing.
+    """
+    known = shared_etags().lookup(client.email, calendar_path, uid)
+    if known is not None:
+        return known
+
+    store = SyncStore.for_calendar(client.email, calendar_path)
+    for href, resource in store.resources.items():
+        if ics_uid(resource["ics"]) == uid:
+            return {"href": href, "etag": resource["etag"], "ics": resource["ics"]}
+
+    if event_store is not None and calendar_id is not None:
+        row = event_store.find_uid(calendar_id, uid)
+        if row is not None:
+            return row
+
+    return find_on_server(client, calendar_path, uid)
+
+
+def find_on_server(client, calendar_path, uid):
+    """Locate an event by UID on the server: GET {uid}.ics, then a UID query"""
+    found = fetch_resource(client, event_href(calendar_path, uid))
+    if found is None:
+        found = query_uid(client, calendar_path, uid)
+    return found
+
+
+def _current_times(vevent, tz_resolver):
+    """(start, end) of a VEVENT as written (end derived from DURATION if needed)"""
+    value, params = vevent.get("DTSTART")
+    start = parse_datetime(value, params, tz_resolver)
+    if vevent.get("DTEND") is not None:
+        value, params = vevent.get("DTEND")
+        return start, parse_datetime(value, params, tz_resolver)
+    if vevent.get("DURATION") is not None:
+        return start, start + parse_duration(vevent.get("DURATION")[0])
+    if isinstance(start, datetime.datetime):
+        return start, start
+    return start, start + datetime.timedelta(days=1)
+
+
+def _new_times(changes, current_start, current_end, tz=None):
+    """
+    New (start, end) from the change fields, or None if the times don't change
+
+    A new start without an end keeps the event's duration. Times without an
+    offset are in tz (default: UTC).
+    """
+    if changes.get("start"):
+        start = parse_when(changes["start"], tz)
+        end = parse_when(changes["end"], tz) if changes.get("end") else None
+    elif changes.get("date") and changes.get("startTime"):
+        start = parse_when(f"{changes['date']}T{changes['startTime']}", tz)
+        end = (parse_when(f"{changes['date']}T{changes['endTime']}", tz)
+               if changes.get("endTime") else None)
+    elif changes.get("date"):
+        start = parse_when(changes["date"])
+        end = None
+    elif changes.get("end"):
+        start = current_start
+        end = parse_when(changes["end"], tz)
+    else:
+        return None
+
+    if end is None:
+        if isinstance(start, datetime.datetime) == isinstance(current_start, datetime.datetime):
+            if isinstance(start, datetime.datetime):
+                end = start + (to_utc(current_end) - to_utc(current_start))
+            else:
+                end = start + (current_end - current_start)
+        elif isinstance(start, datetime.datetime):
+            end = start + datetime.timedelta(hours=1)
+        else:
+            end = start + datetime.timedelta(days=1)
+    if isinstance(start, datetime.datetime) != isinstance(end, datetime.datetime):
+        raise EventError("start and end must both be dates or both be date-times")
+    if to_utc(end) < to_utc(start):
+        raise EventError("end is before start")
+    return start, end
+
+
+def apply_changes(ics, changes, dtstamp=None, tz=None):
+    """
+    Return ics with the master VEVENT changed as described by changes
+
+    changes uses the bulk_write field names (title, start, end, date,
+    startTime, endTime, description, location); missing fields are kept.
+    Times without an offset are in tz (default: UTC).
+    """
+    root = parse_calendar(ics)
+    events = [e for e in root.walk("VEVENT") if e.get("RECURRENCE-ID") is None]
+    if not events:
+        raise EventError("Resource has no VEVENT")
+    tz_resolver = make_tz_resolver(root)
+    times = _new_times(changes, *_current_times(events[0], tz_resolver), tz=tz)
+
+    replace = {}
+    for field, prop in TEXT_FIELDS.items():
+        if field in changes and changes[field] is not None:
+            replace[prop] = f"{prop}:{escape_text(changes[field])}" if changes[field] != "" else None
+    if times is not None:
+        tzid = events[0].get("DTSTART")[1].get("TZID")
+        for name, value in zip(("DTSTART", "DTEND"), times):
+            if tzid and isinstance(value, datetime.datetime) and tz_resolver(tzid) is not None:
+                # Stay in the event's time zone so a series keeps following its DST rules
+                local = value.astimezone(tz_resolver(tzid))
+                replace[name] = f"{name};TZID={tzid}:{local:%Y%m%dT%H%M%S}"
+            else:
+                replace[name] = format_when(name, value)
+        replace["DURATION"] = None
+    replace["DTSTAMP"] = "DTSTAMP:" + (
+        dtstamp or datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+
+    lines = unfold(ics)
+    first, last = _master_range(lines)
+    out = lines[:first + 1]
+    properties_end = None
+    sequence = 0
+    depth = 0
+    for line in lines[first + 1:last]:
+        name, _, value = parse_line(line)
+        if name == "BEGIN":
+            depth += 1
+            if properties_end is None:
+                properties_end = len(out)
+        elif name == "END":
+            depth -= 1
+        elif depth == 0:
+            # A property of the master itself (not of a VALARM inside it)
+            if name == "SEQUENCE":
+                sequence = int(value) if value.strip().isdigit() else 0
+                continue
+            if name in replace:
+                prop_line = replace.pop(name)
+                if prop_line is not None:
+                    out.append(prop_line)
+                continue
+        out.append(line)
+    # Properties the event didn't have yet go before its sub-components
+    added = [prop_line for prop_line in replace.values() if prop_line is not None]
+    added.append(f"SEQUENCE:{sequence + 1}")
+    if properties_end is None:
+        properties_end = len(out)
+    out[properties_end:properties_end] = added
+    out.extend(lines[last:])
+    return "".join(fold_line(line) + "\r\n" for line in out)
+
+
+def _master_range(lines):
+    """(BEGIN, END) line indexes of the first VEVENT without RECURRENCE-ID"""
+    depth = 0
+    event_depth = None
+    for i, line in enumerate(lines):
+        name, _, value = parse_line(line)
+        if name == "BEGIN":
+            depth += 1
+            if value.strip().upper() == "VEVENT":
+                begin, event_depth, overridden = i, depth, False
+        elif name == "END":
+            if value.strip().upper() == "VEVENT" and depth == event_depth and not overridden:
+                return begin, i
+            depth -= 1
+        elif name == "RECURRENCE-ID" and depth == event_depth:
+            overridden = True
+    raise EventError("Resource has no VEVENT")
+
+
+def _result(uid, status="failed"):
+    return {"uid": uid, "status": status, "http_status": None, "etag": "",
+            "conflicts": 0, "attempts": 0, "error": ""}
+
+
+def _write_conditionally(client, calendar_path, uid, known, write, need_ics=False):
+    """
+    Shared 412 loop of update_event / delete_event
+
+    write(known) sends the conditional request and returns the response.
+    On 412 the resource is fetched again and write() is repeated. If a cached
+    href turns out to be gone, the UID is looked up on the server once more,
+    since the event may live at another href.
+    """
+    etags = shared_etags()
+    result = _result(uid)
+    # find_event() has already asked the server if it found nothing
+    looked_up = known is None
+    for _ in range(MAX_CONFLICT_RETRIES + 1):
+        if known is not None and need_ics and not (known.get("ics") and known.get("etag")):
+            # Only known from a partial read: get the full resource first
+            known = fetch_resource(client, known["href"])
+        if known is None and not looked_up:
+            etags.forget(client.email, calendar_path, uid)
+            known = find_on_server(client, calendar_path, uid)
+            looked_up = True
+        if known is None:
+            etags.forget(client.email, calendar_path, uid)
+            result["status"] = "not_found"
+            return result, None
+        response = write(known)
+        result["http_status"] = response.status_code
+        result["attempts"] += getattr(response, "attempts", 1)
+        if response.status_code == 404 and not looked_up:
+            known = None
+            continue
+        if response.status_code != 412:
+            return result, response
+        # Someone else changed the event: look at just that resource again
+        result["conflicts"] += 1
+        known = fetch_resource(client, known["href"])
+    result["status"] = "conflict"
+    result["error"] = f"still changing after {MAX_CONFLICT_RETRIES} retries"
+    return result, None
+
+
+def update_event(client, calendar_path, uid, changes, attempts=DEFAULT_ATTEMPTS,
+                 event_store=None, calendar_id=None, tz=None):
+    """
+    Change an existing event (If-Match), re-applying the changes after a 412
+
+    Times in changes without an offset are in tz (default: UTC).
+
+    Returns {"uid", "status", "http_status", "etag", "conflicts", "attempts",
+    "error", "elapsed"}; status is "updated", "not_found", "conflict",
+    "invalid" or "failed". Never raises.
+    """
+    started = time.perf_counter()
+    dtstamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    written = {}
+
+    def write(known):
+        written["ics"] = apply_changes(known["ics"], changes, dtstamp, tz)
+        written["href"] = known["href"]
+        return client.put(known["href"], written["ics"], headers={"If-Match": known["etag"]},
+                          attempts=attempts)
+
+    try:
+        known = find_event(client, calendar_path, uid, event_store, calendar_id)
+        result, response = _write_conditionally(client, calendar_path, uid, known, write,
+                                                need_ics=True)
+        if response is not None:
+            if response.status_code in (200, 201, 204):
+                result["status"] = "updated"
+                result["etag"] = response.headers.get("ETag", "")
+                shared_etags().remember(client.email, written["href"], result["etag"],
+                                        uid, written["ics"])
+            elif response.status_code == 404:
+                shared_etags().forget(client.email, calendar_path, uid)
+                result["status"] = "not_found"
+            else:
+                result["error"] = f"HTTP {response.status_code}"
+    except EventError as e:
+        result = _result(uid, "invalid")
+        result["error"] = str(e)
+    except Exception as e:
+        result = _result(uid)
+        result["error"] = str(e)
+        result["http_status"] = getattr(e, "status_code", None)
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def delete_event(client, calendar_path, uid, attempts=DEFAULT_ATTEMPTS,
+                 event_store=None, calendar_id=None):
+    """
+    Delete an event by UID (If-Match); a 412 re-fetches it and deletes the new version
+
+    Returns the same dict as update_event(); status is "deleted", "not_found",
+    "conflict" or "failed". Never raises.
+    """
+    started = time.perf_counter()
+
+    def write(known):
+        headers = {"If-Match": known["etag"]} if known.get("etag") else None
+        return client.delete(known["href"], headers=headers, attempts=attempts)
+
+    try:
+        known = find_event(client, calendar_path, uid, event_store, calendar_id)
+        result, response = _write_conditionally(client, calendar_path, uid, known, write)
+        if response is not None:
+            if response.status_code in (200, 204):
+                result["status"] = "deleted"
+            elif response.status_code == 404:
+                result["status"] = "not_found"
+            else:
+                result["error"] = f"HTTP {response.status_code}"
+            if result["status"] != "failed":
+                shared_etags().forget(client.email, calendar_path, uid)
+    except Exception as e:
+        result = _result(uid)
+        result["error"] = str(e)
+        result["http_status"] = getattr(e, "status_code", None)
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    return result
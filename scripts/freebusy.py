@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV - Free/Busy
+Find free slots across several calendars
+
+Busy time is taken from a CalDAV free-busy-query REPORT where the server
+supports it; otherwise it is computed locally from the parsed events
+(DTSTART/DTEND, ignoring cancelled and transparent events). Busy intervals
+of all calendars are merged with one sorted sweep, and the gaps inside the
+requested hours are returned as free slots of a minimum length. All-day and
+floating events block time in --tz (default: the system's time zone).
+
+Usage: python3 freebusy.py 2024-01-16 [--days 5] [--from 09:00] [--to 18:00]
+                           [--min 30] [--tz Europe/Budapest]
+"""
+
+import argparse
+import datetime
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import instrumentation
+from caldav_client import is_throttled
+from calendar_read import REQUIRED_PROPS, calendar_path, fetch_occurrences, format_utc
+from discovery import account_client
+from ics_parser import (MAX_UTC_OFFSET, local_timezone, parse_calendar, parse_datetime,
+                        parse_duration, to_utc)
+
+# ============================================
+# CONFIGURATION - REPLACE WITH YOUR VALUES!
+# ============================================
+EMAIL = "YOUR_APPLE_ID@email.com"           # Your Apple ID email
+PASSWORD = "xxxx-xxxx-xxxx-xxxx"            # App-specific password
+USER_ID = "YOUR_USER_ID"                    # From step 1
+CALENDARS = {
+    'personal': 'YOUR_CALENDAR_ID',         # From step 2
+    # 'work': 'ANOTHER_CALENDAR_ID',
+}
+# ============================================
+
+UTC = datetime.timezone.utc
+
+FREE_BUSY_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<c:free-busy-query xmlns:c="urn:ietf:params:xml:ns:caldav">
+  <c:time-range start="{start}" end="{end}"/>
+</c:free-busy-query>"""
+
+# FBTYPE values that block time
+BUSY_TYPES = ["BUSY", "BUSY-UNAVAILABLE", "BUSY-TENTATIVE"]
+
+
+# Hosts known not to support free-busy-query, filled in by free_busy_query()
+unsupported_hosts = set()
+
+
+class FreeBusyUnsupported(Exception):
+    """The server did not answer free-busy-query with a VFREEBUSY"""
+
+
+def free_busy_query(client, path, window_start, window_end):
+    """
+    Busy intervals from a CalDAV free-busy-query REPORT, sorted by start
+
+    Raises FreeBusyUnsupported if the server doesn't support the report (or is
+    throttling it; the caller falls back to reading events either way). A host
+    that answers without a VFREEBUSY, for example with 403 DAV:supported-report,
+    is remembered and not asked again.
+    """
+    host = urlsplit(client.url(path)).netloc
+    if host in unsupported_hosts:
+        raise FreeBusyUnsupported(f"{host} doesn't support free-busy-query")
+    body = FREE_BUSY_TEMPLATE.format(start=format_utc(window_start), end=format_utc(window_end))
+    # One attempt: the fallback read retries on its own if this was throttling
+    response = client.report(path, body, depth="1", attempts=1)
+    if response.status_code != 200 or "BEGIN:VFREEBUSY" not in response.text:
+        if not is_throttled("REPORT", response):
+            unsupported_hosts.add(host)
+        raise FreeBusyUnsupported(f"free-busy-query returned {response.status_code}")
+
+    intervals = []
+    for vfreebusy in parse_calendar(response.text).walk("VFREEBUSY"):
+        for value, params in vfreebusy.get_all("FREEBUSY"):
+            if params.get("FBTYPE", "BUSY").upper() not in BUSY_TYPES:
+                continue
+            for period in value.split(","):
+                start_text, _, end_text = period.strip().partition("/")
+                start = to_utc(parse_datetime(start_text))
+                if end_text.startswith(("P", "+P", "-P")):
+                    end = start + parse_duration(end_text)
+                else:
+                    end = to_utc(parse_datetime(end_text))
+                intervals.append((start, end))
+    intervals.sort()
+    return intervals
+
+
+def busy_from_occurrences(occurrences, tz=UTC):
+    """
+    Busy intervals (UTC) from parsed occurrences, sorted by start
+
+    All-day dates and floating times are read in tz.
+    """
+    intervals = []
+    for occ in occurrences:
+        if (occ.get("status") or "").upper() == "CANCELLED":
+            continue
+        if (occ.get("transp") or "").upper() == "TRANSPARENT":
+            continue
+        start, end = to_utc(occ["start"], tz), to_utc(occ["end"], tz)
+        if end > start:
+            intervals.append((start, end))
+    intervals.sort()
+    return intervals
+
+
+def merge_intervals(*sorted_lists):
+    """
+    Merge sorted interval lists into non-overlapping busy blocks
+
+    One sweep over a heap merge, so N calendars cost O(total * log N).
+    """
+    merged = []
+    for start, end in heapq.merge(*sorted_lists):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def daily_windows(window_start, window_end, day_start=None, day_end=None, tz=UTC):
+    """
+    Split [window_start, window_end) into per-day hour ranges
+
+    day_start/day_end are datetime.time values in tz (e.g. 09:00-18:00);
+    without them the whole window is one range.
+    """
+    if day_start is None or day_end is None:
+        return [(window_start, window_end)]
+    windows = []
+    day = window_start.astimezone(tz).date()
+    last = window_end.astimezone(tz).date()
+    while day <= last:
+        start = to_utc(datetime.datetime.combine(day, day_start).replace(tzinfo=tz))
+        end = to_utc(datetime.datetime.combine(day, day_end).replace(tzinfo=tz))
+        start, end = max(start, window_start), min(end, window_end)
+        if end > start:
+            windows.append((start, end))
+        day += datetime.timedelta(days=1)
+    return windows
+
+
+def free_slots(busy, windows, min_length=datetime.timedelta(minutes=30)):
+    """
+    Free slots of at least min_length inside windows, given merged busy blocks
+
+    busy and windows must both be sorted; this is a single two-pointer sweep.
+    """
+    slots = []
+    i = 0
+    for window_start, window_end in windows:
+        cursor = window_start
+        while i < len(busy) and busy[i][1] <= window_start:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < window_end:
+            busy_start, busy_end = busy[j]
+            if busy_start - cursor >= min_length:
+                slots.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            j += 1
+        if window_end - cursor >= min_length:
+            slots.append((cursor, window_end))
+    return slots
+
+
+def calendar_busy(client, path, window_start, window_end, prefer_server=True, tz=UTC):
+    """
+    Busy intervals for one calendar; returns (intervals, source)
+    where source is "server" or "local". Locally, all-day and floating events
+    are placed in tz.
+    """
+    if prefer_server:
+        try:
+            return free_busy_query(client, path, window_start, window_end), "server"
+        except FreeBusyUnsupported:
+            pass
+    # Times, STATUS and TRANSP are all that's needed. The server places all-day
+    # and floating events in UTC, so ask for a wider window.
+    occurrences = fetch_occurrences(client, path, window_start - MAX_UTC_OFFSET,
+                                    window_end + MAX_UTC_OFFSET, props=REQUIRED_PROPS)
+    return busy_from_occurrences(occurrences, tz), "local"
+
+
+def find_free_slots(client, user_id, calendars, window_start, window_end,
+                    day_start=None, day_end=None, tz=UTC,
+                    min_length=datetime.timedelta(minutes=30), prefer_server=True):
+    """
+    Free slots across all calendars
+
+    Returns (slots, sources, errors): sources maps calendar name ->
+    "server"/"local", errors maps the names of calendars that couldn't be
+    read to the error. Slots only account for the calendars that were read.
+    """
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(calendars))) as pool:
+        futures = {
+            name: pool.submit(calendar_busy, client, calendar_path(user_id, calendar_id),
+                              window_start, window_end, prefer_server, tz)
+            for name, calendar_id in calendars.items()
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+
+    busy = merge_intervals(*(intervals for intervals, _ in results.values()))
+    windows = daily_windows(window_start, window_end, day_start, day_end, tz)
+    sources = {name: source for name, (_, source) in results.items()}
+    return free_slots(busy, windows, min_length), sources, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find free time across iCloud calendars")
+    parser.add_argument("date", help="first day (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=1, help="number of days (default: 1)")
+    parser.add_argument("--from", dest="day_start", default="09:00", help="day start (default: 09:00)")
+    parser.add_argument("--to", dest="day_end", default="18:00", help="day end (default: 18:00)")
+    parser.add_argument("--min", type=int, default=30, help="minimum slot in minutes (default: 30)")
+    parser.add_argument("--tz", default=None, help="IANA time zone (default: system local)")
+    parser.add_argument("--local", action="store_true",
+                        help="always compute busy time from events (skip free-busy-query)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    print("iCloud CalDAV - Free/Busy")
+    print("=" * 60)
+
+    if "YOUR_" in EMAIL or "xxxx" in PASSWORD or "YOUR_" in USER_ID or \
+            any("YOUR_" in cal_id for cal_id in CALENDARS.values()):
+        print("\nERROR: Please configure your credentials first!")
+        return
+
+    try:
+        tz = local_timezone(args.tz)
+    except ValueError as e:
+        print(f"\nERROR: {e}")
+        return
+    day_start = datetime.time.fromisoformat(args.day_start)
+    day_end = datetime.time.fromisoformat(args.day_end)
+    first_day = datetime.date.fromisoformat(args.date)
+    window_start = to_utc(datetime.datetime.combine(first_day, datetime.time()).replace(tzinfo=tz))
+    window_end = to_utc(datetime.datetime.combine(
+        first_day + datetime.timedelta(days=args.days), datetime.time()).replace(tzinfo=tz))
+
+    client = account_client(EMAIL, PASSWORD)
+    slots, sources, errors = find_free_slots(
+        client, USER_ID, CALENDARS, window_start, window_end,
+        day_start, day_end, tz, datetime.timedelta(minutes=args.min),
+        prefer_server=not args.local)
+
+    for name, source in sources.items():
+        print(f"{name}: busy time from {'free-busy-query' if source == 'server' else 'events'}")
+    for name, error in errors.items():
+        print(f"Error ({name}): {getattr(error, 'status_code', None) or error}")
+    if errors and len(errors) == len(CALENDARS):
+        return
+    if errors:
+        print("Warning: the slots below ignore the calendars that failed")
+    print("-" * 60)
+    if not slots:
+        print("No free slots found.")
+    for start, end in slots:
+        start, end = start.astimezone(tz), end.astimezone(tz)
+        minutes = int((end - start).total_seconds() // 60)
+        print(f"  {start:%Y-%m-%d %H:%M} - {end:%H:%M}  ({minutes} min)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+HTTP transports for CalDAVClient: requests/urllib3 (default) or httpx
+
+The default transport speaks HTTP/1.1, so every request in flight needs a
+connection of its own: four concurrent range windows or eight bulk PUTs mean
+four or eight TLS connections to the same partition host. The httpx transport
+sends over an httpx.Client instead:
+
+- with the optional `h2` package, HTTPS requests to one host are multiplexed
+  as streams over a single HTTP/2 connection (negotiated via ALPN; plain
+  http:// and servers without h2 stay on HTTP/1.1);
+- it asks for every content coding it can decode - gzip and deflate, plus br
+  with `brotli` and zstd with `zstandard` installed - and decodes the
+  multistatus/ICS bodies transparently.
+
+HttpxAdapter plugs in below requests.Session, so the rest of the scripts keep
+getting requests.Response objects and requests exceptions: auth, hooks,
+streaming (iter_content), write listeners and retries work unchanged, and the
+session's verify / cert / proxies settings (including REQUESTS_CA_BUNDLE and
+HTTPS_PROXY) are applied to the httpx client. Only --profile sees less: httpx
+doesn't report new connections, so their connect and TLS time is counted
+under `server`.
+
+Select it per process with CALDAV_TRANSPORT=httpx, or per client with
+CalDAVClient(..., transport="httpx"). Install with:
+
+    pip install "httpx[http2,brotli]"
+"""
+
+import datetime
+import os
+import ssl
+import threading
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, get_encoding_from_headers, select_proxy
+
+from instrumentation import TimedHTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401 - enables httpx's HTTP/2 support
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+TRANSPORTS = ["requests", "httpx"]
+# Transport used when a client doesn't ask for one
+DEFAULT_TRANSPORT = os.environ.get("CALDAV_TRANSPORT", "requests").strip().lower()
+
+# Connection-level headers requests adds that must not be sent over HTTP/2;
+# Content-Length is recomputed by httpx from the body it actually sends
+DROPPED_HEADERS = ["connection", "keep-alive", "proxy-connection", "transfer-encoding",
+                   "upgrade", "content-length"]
+
+
+class TransportError(ValueError):
+    """Raised for an unknown transport, or one whose package isn't installed"""
+
+
+def make_adapter(transport=None, pool_connections=10, pool_maxsize=10):
+    """A requests transport adapter for `transport` ("requests" or "httpx")"""
+    transport = (transport or DEFAULT_TRANSPORT).lower()
+    if transport == "requests":
+        return TimedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                pool_block=False)
+    if transport == "httpx":
+        if httpx is None:
+            raise TransportError('The httpx transport needs httpx: pip install "httpx[http2]"')
+        return HttpxAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    raise TransportError(f"Unknown transport {transport!r} (choose from {', '.join(TRANSPORTS)})")
+
+
+def _ssl_context(verify, cert):
+    """requests' verify (bool or CA bundle/dir path) and cert -> httpx verify"""
+    if verify is True and not cert:
+        return True
+    if verify is False:
+        if not cert:
+            return False
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        ca = DEFAULT_CA_BUNDLE_PATH if verify is True else verify
+        if os.path.isdir(ca):
+            context = ssl.create_default_context(capath=ca)
+        else:
+            context = ssl.create_default_context(cafile=ca)
+    if cert:
+        # A client certificate: "cert.pem" or ("cert.pem", "key.pem")
+        context.load_cert_chain(*((cert,) if isinstance(cert, str) else cert))
+    return context
+
+
+def _is_ssl_error(error):
+    """Did an httpx error start as a TLS failure (e.g. an unknown CA)?"""
+    while error is not None:
+        if isinstance(error, ssl.SSLError):
+            return True
+        error = error.__context__
+    return False
+
+
+def _timeout(timeout):
+    """requests timeout (seconds or (connect, read)) -> httpx.Timeout"""
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+    else:
+        connect = read = timeout
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+
+class _Body:
+    """
+    requests reads a response body through response.raw.stream(); this one
+    reads an httpx stream (already decompressed) and raises requests errors
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def stream(self, chunk_size=None, decode_content=True):
+        try:
+            yield from self.response.iter_bytes(chunk_size)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+        finally:
+            self.response.close()
+
+    def close(self):
+        self.response.close()
+
+    def release_conn(self):
+        self.response.close()
+
+
+class HttpxAdapter(BaseAdapter):
+    """
+    requests adapter sending through one pooled (HTTP/2 if available) httpx.Client
+
+    Like requests' own adapter with pool_block=False, it never waits for a
+    free connection; up to pool_connections * pool_maxsize idle ones are kept.
+    httpx fixes TLS and proxy settings per client, so there is one client per
+    (verify, cert, proxy) combination the session sends with; usually just one.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, http2=None):
+        super().__init__()
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self.limits = httpx.Limits(max_connections=None,
+                                   max_keepalive_connections=pool_connections * pool_maxsize)
+        self.clients = {}
+        self._lock = threading.Lock()
+        self.client = self._client(True, None, None)
+        # What httpx can decode (gzip, deflate, br/zstd with their packages)
+        self.accept_encoding = self.client.headers["Accept-Encoding"]
+
+    def _client(self, verify, cert, proxy):
+        key = (verify, tuple(cert) if isinstance(cert, list) else cert, proxy)
+        with self._lock:
+            client = self.clients.get(key)
+            if client is None:
+                # Proxies and CA bundles come resolved from requests (environment
+                # included), so httpx must not apply its own environment on top
+                client = self.clients[key] = httpx.Client(
+                    http2=self.http2, limits=self.limits, follow_redirects=False,
+                    verify=_ssl_context(verify, cert), proxy=proxy, trust_env=False)
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        client = self._client(verify, cert, select_proxy(request.url, proxies or {}))
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() not in DROPPED_HEADERS}
+        if headers.get("Accept-Encoding") == requests.utils.DEFAULT_ACCEPT_ENCODING:
+            headers["Accept-Encoding"] = self.accept_encoding
+        outgoing = client.build_request(request.method, request.url, headers=headers,
+                                        content=request.body, timeout=_timeout(timeout))
+        started = time.perf_counter()
+        try:
+            response = client.send(outgoing, stream=True)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.TransportError as e:
+            if _is_ssl_error(e):
+                raise requests.exceptions.SSLError(e, request=request)
+            raise requests.exceptions.ConnectionError(e, request=request)
+        return self.build_response(request, response, time.perf_counter() - started)
+
+    def build_response(self, request, response, elapsed):
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers.items())
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.reason = response.reason_phrase
+        result.raw = _Body(response)
+        result.url = request.url
+        result.request = request
+        result.connection = self
+        result.elapsed = datetime.timedelta(seconds=elapsed)
+        # "HTTP/1.1" or "HTTP/2"
+        result.http_version = response.http_version
+        return result
+
+    def close(self):
+        with self._lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+icloud-caldav - one command for the everyday CalDAV tasks
+
+Replaces running the numbered scripts one by one. Configuration is read once
+(from a JSON file and/or the environment) and each subcommand imports only
+what it needs: `probe` uses nothing but the standard library, so a cron
+health check starts in a fraction of the time a script importing `requests`
+does.
+
+Usage:
+    python3 icloud_caldav.py probe                      # credentials + reachability
+    python3 icloud_caldav.py discover [--refresh]       # USER_ID, host, calendars (step 1)
+    python3 icloud_caldav.py calendars                  # calendar names and IDs (step 2)
+    python3 icloud_caldav.py read [--date 2024-01-15] [--days 7] [--calendar work] [--tz ...]
+    python3 icloud_caldav.py write --title "Meeting" --start 2024-01-15T10:00:00Z [--end ...]
+    python3 icloud_caldav.py write --events shifts.csv --calendar work
+    python3 icloud_caldav.py index [--years-back 5] [--days-ahead 365]
+    python3 icloud_caldav.py search dentist [--from 2024-01-01] [--to ...] [--calendar work]
+
+Add --json (before the subcommand) for machine-readable output. `scripts/icloud-caldav`
+is the same command without the .py, for symlinking into your PATH. read and search
+use local days and times in --tz (default: the system's zone); --json keeps the
+events' own times.
+
+Configuration (environment wins over the file):
+    file   --config PATH, CALDAV_CONFIG, or ~/.config/icloud-caldav.json
+           {"email": "...", "password": "..." or "password_env": "VAR",
+            "user_id": "...", "calendars": {"work": "CALENDAR_ID"}}
+    env    CALDAV_EMAIL, CALDAV_PASSWORD, CALDAV_USER_ID,
+           CALDAV_CALENDARS ("work=ID1;home=ID2")
+
+Without user_id / calendars, the cached discovery result is used.
+
+Exit status: 0 ok, 1 CalDAV/authentication error, 2 configuration error,
+3 network error.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Same default as caldav_client.BASE_URL (not imported: probe must not load requests)
+BASE_URL = os.environ.get("CALDAV_BASE_URL", "https://caldav.icloud.com")
+DEFAULT_CONFIG = os.path.join(os.path.expanduser("~"), ".config", "icloud-caldav.json")
+
+# Seconds before probe gives up on the server
+PROBE_TIMEOUT = 10
+# Redirects probe follows (caldav.icloud.com -> partition host)
+PROBE_REDIRECTS = 5
+
+EXIT_OK = 0
+EXIT_CALDAV = 1
+EXIT_CONFIG = 2
+EXIT_NETWORK = 3
+
+PRINCIPAL_REQUEST = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:">
+  <d:prop>
+    <d:current-user-principal/>
+  </d:prop>
+</d:propfind>"""
+
+
+class ConfigError(ValueError):
+    """Raised for missing or invalid configuration"""
+
+
+class CommandError(Exception):
+    """Raised by a subcommand; carries the exit status"""
+
+    def __init__(self, message, exit_status=EXIT_CALDAV):
+        super().__init__(message)
+        self.exit_status = exit_status
+
+
+# ============================================
+# Configuration
+# ============================================
+
+def _parse_calendars(value):
+    """{"name": "id"} dict, or "name=ID;name=ID" (as in multi_account CSV files)"""
+    if isinstance(value, dict):
+        return {str(k): str(v) for k, v in value.items()}
+    if not value:
+        return {}
+    calendars = {}
+    for part in str(value).split(";"):
+        if "=" not in part:
+            raise ConfigError(f"Invalid calendar entry {part!r} (expected name=CALENDAR_ID)")
+        name, calendar_id = part.split("=", 1)
+        calendars[name.strip()] = calendar_id.strip()
+    return calendars
+
+
+def load_config(path=None, environ=os.environ):
+    """
+    Read and validate the configuration once
+
+    Returns {"email", "password", "user_id", "calendars"}. Raises
+    ConfigError when credentials are missing or still the placeholders.
+    """
+    path = path or environ.get("CALDAV_CONFIG")
+    explicit = bool(path)
+    path = path or DEFAULT_CONFIG
+    entry = {}
+    if os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"Can't read {path}: {e}")
+        if not isinstance(entry, dict):
+            raise ConfigError(f"{path} must contain a JSON object")
+    elif explicit:
+        raise ConfigError(f"Config file not found: {path}")
+
+    password = entry.get("password") or ""
+    if entry.get("password_env"):
+        password = environ.get(entry["password_env"], "")
+    config = {
+        "email": (environ.get("CALDAV_EMAIL") or entry.get("email") or "").strip(),
+        "password": environ.get("CALDAV_PASSWORD") or password,
+        "user_id": str(environ.get("CALDAV_USER_ID") or entry.get("user_id") or ""),
+        "calendars": _parse_calendars(environ.get("CALDAV_CALENDARS") or entry.get("calendars")),
+    }
+    if not config["email"] or "YOUR_APPLE_ID" in config["email"]:
+        raise ConfigError("No Apple ID: set CALDAV_EMAIL or \"email\" in the config file")
+    if not config["password"] or "xxxx" in config["password"]:
+        raise ConfigError("No app-specific password: set CALDAV_PASSWORD or \"password\" "
+                          "in the config file")
+    if "YOUR_" in config["user_id"]:
+        config["user_id"] = ""
+    return config
+
+
+def _account(config, refresh=False):
+    """(client, user_id, calendars) with user_id/calendars discovered if not configured"""
+    from discovery import DiscoveryError, account_client, discover
+
+    user_id = config["user_id"]
+    calendars = config["calendars"]
+    if refresh or not user_id or not calendars:
+        try:
+            info = discover(config["email"], config["password"], refresh=refresh,
+                            revalidate=False)
+        except DiscoveryError as e:
+            raise CommandError(f"Discovery failed: {e}")
+        user_id = user_id or info["user_id"]
+        calendars = calendars or {cal["name"]: cal["id"] for cal in info["calendars"]}
+    return account_client(config["email"], config["password"]), user_id, calendars
+
+
+def _select(calendars, name):
+    """Calendars matching a name (case-insensitive); all of them for None/"all" """
+    if not name or name.lower() == "all":
+        return dict(calendars)
+    selected = {k: v for k, v in calendars.items() if k.lower() == name.lower()}
+    if not selected:
+        raise CommandError(f"Unknown calendar {name!r} (known: {', '.join(calendars)})",
+                           EXIT_CONFIG)
+    return selected
+
+
+# ============================================
+# Subcommands - each returns a result dict and prints nothing;
+# output() renders it as text or JSON
+# ============================================
+
+def cmd_probe(config, args):
+    """One PROPFIND for the principal over the standard library only"""
+    import base64
+    import http.client
+    import re
+    from urllib.parse import urljoin, urlsplit
+
+    auth = base64.b64encode(f"{config['email']}:{config['password']}".encode()).decode()
+    url = BASE_URL.rstrip("/") + "/.well-known/caldav"
+    started = time.perf_counter()
+    for _ in range(PROBE_REDIRECTS + 1):
+        parts = urlsplit(url)
+        connection_class = (http.client.HTTPSConnection if parts.scheme == "https"
+                            else http.client.HTTPConnection)
+        connection = connection_class(parts.netloc, timeout=args.timeout)
+        try:
+            connection.request("PROPFIND", parts.path or "/", body=PRINCIPAL_REQUEST.encode(),
+                               headers={"Authorization": f"Basic {auth}", "Depth": "0",
+                                        "Content-Type": "application/xml; charset=utf-8"})
+            response = connection.getresponse()
+            body = response.read()
+        except OSError as e:
+            raise CommandError(f"Can't reach {parts.netloc}: {e}", EXIT_NETWORK)
+        finally:
+            connection.close()
+        if response.status in (301, 302, 307, 308) and response.getheader("Location"):
+            url = urljoin(url, response.getheader("Location"))
+            continue
+        break
+    elapsed = (time.perf_counter() - started) * 1000
+
+    result = {"ok": response.status == 207, "status": response.status,
+              "host": f"{parts.scheme}://{parts.netloc}", "elapsed_ms": round(elapsed, 1)}
+    match = re.search(rb"/(\d+)/principal/", body)
+    if match:
+        result["user_id"] = match.group(1).decode()
+    if response.status in (401, 403):
+        result["error"] = "authentication failed (check email / app-specific password)"
+    elif response.status != 207:
+        result["error"] = f"unexpected HTTP {response.status}"
+    return result
+
+
+def cmd_discover(config, args):
+    from discovery import DiscoveryError, cache_path, discover
+
+    try:
+        info = discover(config["email"], config["password"], refresh=args.refresh)
+    except DiscoveryError as e:
+        raise CommandError(f"Discovery failed: {e}")
+    return {"user_id": info["user_id"], "host": info["host"],
+            "calendar_home": info["calendar_home"], "cache": cache_path(config["email"]),
+            "calendars": [{"name": c["name"], "id": c["id"]} for c in info["calendars"]]}
+
+
+def cmd_calendars(config, args):
+    _, _, calendars = _account(config, refresh=args.refresh)
+    return {"calendars": [{"name": name, "id": calendar_id}
+                          for name, calendar_id in calendars.items()]}
+
+
+def _timezone(name):
+    from ics_parser import local_timezone
+
+    try:
+        return local_timezone(name)
+    except ValueError as e:
+        raise CommandError(str(e), EXIT_CONFIG)
+
+
+def cmd_read(config, args):
+    import datetime
+    from calendar_read import EXPAND, SUMMARY_PROPS, occurrence_key, read_calendars
+    from ics_parser import MAX_UTC_OFFSET, overlaps
+
+    tz = _timezone(args.tz)
+    first_day = _date_arg(args.date, "--date") or datetime.datetime.now(tz).date()
+    client, user_id, calendars = _account(config)
+    calendars = _select(calendars, args.calendar)
+    window_start = datetime.datetime.combine(first_day, datetime.time(), tzinfo=tz)
+    window_end = datetime.datetime.combine(first_day + datetime.timedelta(days=args.days),
+                                           datetime.time(), tzinfo=tz)
+    # The server places all-day and floating events in UTC: read wider, keep the local days
+    timeline, errors = read_calendars(client, user_id, calendars, window_start - MAX_UTC_OFFSET,
+                                      window_end + MAX_UTC_OFFSET,
+                                      props=SUMMARY_PROPS, recurrence=EXPAND)
+    if errors and len(errors) == len(calendars):
+        raise CommandError("; ".join(f"{name}: {e}" for name, e in errors.items()))
+    timeline = sorted((occ for occ in timeline if overlaps(occ, window_start, window_end, tz)),
+                      key=lambda occ: occurrence_key(occ, tz))
+    result = {"start": window_start, "end": window_end, "timezone": tz,
+              "events": [{"calendar": occ["calendar"], "title": occ["title"],
+                          "start": occ["start"], "end": occ["end"], "all_day": occ["all_day"]}
+                         for occ in timeline]}
+    if errors:
+        result["errors"] = {name: str(e) for name, e in errors.items()}
+    return result
+
+
+def cmd_write(config, args):
+    from bulk_write import EventError, load_events, normalize_event, put_event, write_events
+    from calendar_read import calendar_path
+
+    client, user_id, calendars = _account(config)
+    if not args.calendar and len(calendars) > 1:
+        raise CommandError(f"Several calendars configured; pick one with --calendar "
+                           f"({', '.join(calendars)})", EXIT_CONFIG)
+    name, calendar_id = next(iter(_select(calendars, args.calendar).items()))
+    path = calendar_path(user_id, calendar_id)
+
+    if args.events:
+        results = sorted(write_events(client, path, load_events(args.events),
+                                      concurrency=args.concurrency),
+                         key=lambda r: r["index"])
+    else:
+        if not args.title or not args.start:
+            raise CommandError("write needs --title and --start (or --events FILE)", EXIT_CONFIG)
+        try:
+            event = normalize_event({"title": args.title, "start": args.start, "end": args.end,
+                                     "location": args.location,
+                                     "description": args.description})
+        except EventError as e:
+            raise CommandError(f"Invalid event: {e}", EXIT_CONFIG)
+        results = [put_event(client, path, event)]
+    failed = [r for r in results if r["status"] in ("failed", "invalid")]
+    return {"calendar": name, "results": results, "ok": not failed}
+
+
+def _date_arg(value, option):
+    import datetime
+
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        raise CommandError(f"Invalid {option} {value!r} (expected YYYY-MM-DD)", EXIT_CONFIG)
+
+
+def cmd_index(config, args):
+    """Read a long span of every calendar once; the reads fill the search index"""
+    import datetime
+    from calendar_read import calendar_path
+    from range_read import read_range
+    from search_index import shared_index
+
+    client, user_id, calendars = _account(config)
+    calendars = _select(calendars, args.calendar)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time(),
+                                      tzinfo=datetime.timezone.utc)
+    window_start = today - datetime.timedelta(days=round(args.years_back * 365.25))
+    window_end = today + datetime.timedelta(days=args.days_ahead)
+    counts = {}
+    for name, calendar_id in calendars.items():
+        # Full calendar-data, so descriptions and attendees get indexed too
+        counts[name] = sum(1 for _ in read_range(client, calendar_path(user_id, calendar_id),
+                                                 window_start, window_end))
+    index = shared_index()
+    index.save()
+    return {"start": window_start, "end": window_end, "calendars": counts,
+            "index": index.stats(), "path": index.path}
+
+
+def cmd_search(config, args):
+    """Keyword search in the local index; no CalDAV traffic"""
+    import datetime
+    from ics_parser import MAX_UTC_OFFSET
+    from search_index import shared_index
+
+    tz = _timezone(args.tz)
+    first_day = _date_arg(args.date_from, "--from")
+    last_day = _date_arg(args.date_to, "--to")
+    paths = None
+    if args.calendar:
+        from calendar_read import calendar_path
+
+        _, user_id, calendars = _account(config)
+        paths = [calendar_path(user_id, calendar_id)
+                 for calendar_id in _select(calendars, args.calendar).values()]
+    # The index keeps all-day dates at UTC midnight: search a little wider,
+    # then keep the hits on the requested local days
+    start = end = None
+    if first_day:
+        start = datetime.datetime.combine(first_day, datetime.time(), tzinfo=tz) - MAX_UTC_OFFSET
+    if last_day:
+        end = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time(),
+                                        tzinfo=tz) + MAX_UTC_OFFSET
+    hits = []
+    for hit in shared_index().search(" ".join(args.query), start=start, end=end,
+                                     account=config["email"], calendars=paths,
+                                     prefix=not args.exact):
+        day = hit["start"] if hit["all_day"] else hit["start"].astimezone(tz).date()
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        if len(hits) == args.limit:
+            break
+        hits.append(hit)
+    return {"query": " ".join(args.query), "timezone": tz, "events": hits}
+
+
+COMMANDS = {
+    "probe": cmd_probe,
+    "discover": cmd_discover,
+    "calendars": cmd_calendars,
+    "read": cmd_read,
+    "write": cmd_write,
+    "index": cmd_index,
+    "search": cmd_search,
+}
+
+
+# ============================================
+# Output
+# ============================================
+
+def _json_default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _local(value, tz):
+    """A start/end in tz for display; floating times are already local"""
+    from ics_parser import to_utc
+
+    return to_utc(value, tz).astimezone(tz)
+
+
+def _print_text(command, result):
+    if command == "probe":
+        state = "OK" if result["ok"] else "FAILED"
+        print(f"{state}: {result['host']} HTTP {result['status']} in {result['elapsed_ms']} ms")
+        if result.get("user_id"):
+            print(f"USER_ID: {result['user_id']}")
+        if result.get("error"):
+            print(f"Error: {result['error']}")
+    elif command in ("discover", "calendars"):
+        if command == "discover":
+            print(f"USER_ID:       {result['user_id']}")
+            print(f"Host:          {result['host']}")
+            print(f"Calendar home: {result['calendar_home']}")
+            print()
+        for cal in result["calendars"]:
+            print(f"{cal['name']}: {cal['id']}")
+    elif command == "read":
+        tz = result["timezone"]
+        for event in result["events"]:
+            start = event["start"] if event["all_day"] else _local(event["start"], tz)
+            when = "all day" if event["all_day"] else \
+                f"{start:%H:%M}-{_local(event['end'], tz):%H:%M}"
+            print(f"{start:%Y-%m-%d} {when:<11} {event['title']} [{event['calendar']}]")
+        print(f"{len(result['events'])} event(s)")
+        for name, error in result.get("errors", {}).items():
+            print(f"Error in {name}: {error}")
+    elif command == "write":
+        for r in result["results"]:
+            detail = f" ({r['error']})" if r["error"] else ""
+            print(f"{r['status']:<8} {r['uid']}  {r['title']}{detail}")
+    elif command == "index":
+        for name, count in result["calendars"].items():
+            print(f"{name}: {count} occurrence(s)")
+        stats = result["index"]
+        print(f"Index: {stats['events']} event(s), {stats['words']} word(s) -> {result['path']}")
+    elif command == "search":
+        tz = result["timezone"]
+        for event in result["events"]:
+            start = event["start"] if event["all_day"] else _local(event["start"], tz)
+            when = "all day" if event["all_day"] else f"{start:%H:%M}"
+            where = f" ({event['location']})" if event["location"] else ""
+            print(f"{start:%Y-%m-%d} {when:<7} {event['title']}{where}")
+        print(f"{len(result['events'])} match(es) for {result['query']!r}")
+
+
+def output(command, result, as_json=False):
+    if as_json:
+        print(json.dumps(result, default=_json_default))
+    else:
+        _print_text(command, result)
+
+
+# ============================================
+# Entry point
+# ============================================
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="icloud-caldav", description="iCloud CalDAV: probe, discover, read and write")
+    parser.add_argument("--config", metavar="FILE",
+                        help=f"JSON config file (default: $CALDAV_CONFIG or {DEFAULT_CONFIG})")
+    parser.add_argument("--json", action="store_true", help="print one JSON document")
+    # Same options as instrumentation.add_arguments(); that module is only
+    # imported when they're used
+    parser.add_argument("--profile", action="store_true",
+                        help="print a per-request timing breakdown at exit")
+    parser.add_argument("--profile-log", metavar="FILE",
+                        help="append timing events to this JSON Lines file")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    commands.required = True
+
+    probe = commands.add_parser("probe", help="check credentials and reachability (fast)")
+    probe.add_argument("--timeout", type=float, default=PROBE_TIMEOUT,
+                       help=f"seconds (default: {PROBE_TIMEOUT})")
+
+    for name, help_text in (("discover", "find USER_ID, host and calendars (cached)"),
+                            ("calendars", "list calendar names and IDs")):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument("--refresh", action="store_true", help="ignore the discovery cache")
+
+    read = commands.add_parser("read", help="list events")
+    read.add_argument("--date", help="first day (YYYY-MM-DD, default: today)")
+    read.add_argument("--days", type=int, default=1, help="days to read (default: 1)")
+    read.add_argument("--calendar", help="calendar name (default: all)")
+    read.add_argument("--tz", help="IANA time zone of the days and times (default: system local)")
+
+    write = commands.add_parser("write", help="create an event (or import a file)")
+    write.add_argument("--calendar", help="calendar name (needed with several calendars)")
+    write.add_argument("--title")
+    write.add_argument("--start", help="ISO 8601 date or date-time (no offset = UTC)")
+    write.add_argument("--end", help="default: start + 1 hour (+ 1 day for dates)")
+    write.add_argument("--location", default="")
+    write.add_argument("--description", default="")
+    write.add_argument("--events", metavar="FILE", help="CSV/JSON/JSONL file (see bulk_write.py)")
+    write.add_argument("--concurrency", type=int, default=8, help="PUTs in flight (default: 8)")
+
+    index = commands.add_parser("index", help="read a long span once to fill the search index")
+    index.add_argument("--years-back", type=float, default=5, help="default: 5")
+    index.add_argument("--days-ahead", type=int, default=365, help="default: 365")
+    index.add_argument("--calendar", help="calendar name (default: all)")
+
+    search = commands.add_parser("search", help="find events by keyword (local index only)")
+    search.add_argument("query", nargs="+", help="words to match in title, location, "
+                                                 "description or attendees")
+    search.add_argument("--from", dest="date_from", help="first day (YYYY-MM-DD)")
+    search.add_argument("--to", dest="date_to", help="last day (YYYY-MM-DD, inclusive)")
+    search.add_argument("--calendar", help="calendar name (default: all)")
+    search.add_argument("--limit", type=int, help="at most this many matches")
+    search.add_argument("--exact", action="store_true", help="whole words only (no prefixes)")
+    search.add_argument("--tz", help="IANA time zone of the days and times (default: system local)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        config = load_config(args.config)
+    except ConfigError as e:
+        print(f"Configuration error: {e}", file=sys.stderr)
+        return EXIT_CONFIG
+
+    if args.profile or args.profile_log:
+        import instrumentation
+        instrumentation.configure(args)
+
+    try:
+        result = COMMANDS[args.command](config, args)
+    except Exception as e:
+        if isinstance(e, CommandError):
+            status = e.exit_status
+        else:
+            # From the lazily imported modules (e.g. requests' ConnectionError)
+            status = EXIT_NETWORK if "Connection" in type(e).__name__ else EXIT_CALDAV
+        if args.json:
+            print(json.dumps({"ok": False, "error": str(e)}))
+        else:
+            print(f"Error: {e}", file=sys.stderr)
+        return status
+
+    output(args.command, result, args.json)
+    return EXIT_OK if result.get("ok", True) else EXIT_CALDAV
+
+
+if __name__ == "__main__":
+    sys.exit(main())
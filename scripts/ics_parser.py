@@ -0,0 +1,837 @@
+#!/usr/bin/env python3
+"""
+iCalendar (RFC 5545) parser with windowed recurrence expansion
+
+Handles what the old SUMMARY/DTSTART regexes ignored: folded lines,
+parameters (TZID, VALUE=DATE), VTIMEZONE definitions, DTEND/DURATION,
+RRULE/RDATE/EXDATE and RECURRENCE-ID overrides.
+
+Recurring events are expanded lazily: occurrences are produced one at a time
+in start order, the rule skips ahead to the query window instead of walking
+from DTSTART when it can, and expansion stops at the window end. An unbounded
+series is never materialized.
+
+Usage:
+    from ics_parser import iter_occurrences
+
+    for occ in iter_occurrences(ics_text, window_start, window_end):
+        print(occ["start"], occ["title"])
+"""
+
+import calendar
+import datetime
+import heapq
+import os
+import re
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+UTC = datetime.timezone.utc
+
+# Largest UTC offset in use (UTC+14). Servers match all-day and floating
+# events against a time-range as if they were UTC, so local windows are
+# widened by this much and trimmed afterwards.
+MAX_UTC_OFFSET = datetime.timedelta(hours=14)
+
+# Without a window end, unbounded series are cut this far after DTSTART
+DEFAULT_EXPANSION_HORIZON = datetime.timedelta(days=2 * 366)
+
+# Stop a rule after this many periods in a row produced nothing
+# (e.g. FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=30 never matches)
+MAX_EMPTY_PERIODS = 1000
+
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+
+
+# ============================================
+# Content lines and components
+# ============================================
+
+def unfold(text):
+    """Join folded lines (CRLF + space/tab) and split into content lines"""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"\n[ \t]", "", text)
+    return [line for line in text.split("\n") if line]
+
+
+def parse_line(line):
+    """
+    Split a content line into (NAME, {PARAM: value}, value)
+
+    Handles quoted parameter values that contain ':' or ';'.
+    """
+    params = {}
+    in_quotes = False
+    name_end = None
+    value_start = None
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif not in_quotes and ch == ";" and name_end is None:
+            name_end = i
+        elif not in_quotes and ch == ":":
+            value_start = i
+            break
+    if value_start is None:
+        return line.upper(), params, ""
+    if name_end is None:
+        name_end = value_start
+
+    name = line[:name_end].upper()
+    param_text = line[name_end + 1:value_start] if name_end < value_start else ""
+    if param_text:
+        for part in re.findall(r'(?:[^;"]|"[^"]*")+', param_text):
+            key, _, val = part.partition("=")
+            params[key.upper()] = val.strip('"')
+    return name, params, line[value_start + 1:]
+
+
+def unescape_text(value):
+    """Undo RFC 5545 TEXT escaping (\\n, \\, \\; \\\\)"""
+    return re.sub(r"\\([nN,;\\])",
+                  lambda m: "\n" if m.group(1) in "nN" else m.group(1),
+                  value)
+
+
+class Component:
+    """A BEGIN:X ... END:X block with its properties and sub-components"""
+
+    def __init__(self, name):
+        self.name = name
+        self.properties = []
+        self.components = []
+
+    def get(self, name, default=None):
+        """Return (value, params) of the first property called name"""
+        for prop_name, params, value in self.properties:
+            if prop_name == name:
+                return value, params
+        return default
+
+    def get_all(self, name):
+        return [(value, params) for prop_name, params, value in self.properties
+                if prop_name == name]
+
+    def text(self, name, default=""):
+        prop = self.get(name)
+        return unescape_text(prop[0]) if prop else default
+
+    def walk(self, name):
+        """Yield all nested components called name"""
+        for comp in self.components:
+            if comp.name == name:
+                yield comp
+            yield from comp.walk(name)
+
+
+def parse_calendar(text):
+    """Parse ICS text into a tree of Components (returns a synthetic root)"""
+    root = Component("ROOT")
+    stack = [root]
+    for line in unfold(text):
+        name, params, value = parse_line(line)
+        if name == "BEGIN":
+            comp = Component(value.strip().upper())
+            stack[-1].components.append(comp)
+            stack.append(comp)
+        elif name == "END":
+            if len(stack) > 1:
+                stack.pop()
+        else:
+            stack[-1].properties.append((name, params, value))
+    return root
+
+
+# ============================================
+# Values
+# ============================================
+
+_DATE_RE = re.compile(r"(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})?(Z)?)?")
+_DURATION_RE = re.compile(
+    r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?")
+
+
+def parse_datetime(value, params=None, tz_resolver=None):
+    """
+    Parse a DATE or DATE-TIME value
+
+    Returns a datetime.date for all-day values, an aware datetime for UTC or
+    TZID values, and a naive (floating) datetime otherwise.
+    """
+    params = params or {}
+    match = _DATE_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid date value: {value!r}")
+    year, month, day, hour, minute, second, utc = match.groups()
+    if hour is None or params.get("VALUE") == "DATE":
+        return datetime.date(int(year), int(month), int(day))
+
+    dt = datetime.datetime(int(year), int(month), int(day),
+                           int(hour), int(minute), int(second or 0))
+    if utc:
+        return dt.replace(tzinfo=UTC)
+    tzid = params.get("TZID")
+    if tzid and tz_resolver is not None:
+        tz = tz_resolver(tzid)
+        if tz is not None:
+            return dt.replace(tzinfo=tz)
+    return dt
+
+
+def parse_date_list(value, params=None, tz_resolver=None):
+    """Parse comma-separated EXDATE/RDATE values (PERIOD values use their start)"""
+    result = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            result.append(parse_datetime(item.split("/")[0], params, tz_resolver))
+    return result
+
+
+def parse_duration(value):
+    match = _DURATION_RE.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {value!r}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = datetime.timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+        minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == "-" else delta
+
+
+def to_utc(value, default_tz=UTC):
+    """
+    Normalize a date/datetime to an aware UTC datetime for comparisons
+
+    Dates and floating times are interpreted in default_tz.
+    """
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=default_tz)
+    return value.astimezone(UTC)
+
+
+# ============================================
+# Time zones
+# ============================================
+
+class VTimezone(datetime.tzinfo):
+    """
+    tzinfo built from a VTIMEZONE component
+
+    Used when a TZID is not a known IANA name (e.g. Outlook's
+    "W. Europe Standard Time"). Transitions are computed per year and cached.
+    """
+
+    def __init__(self, component):
+        self.tzid = component.text("TZID")
+        self.observances = []
+        for obs in component.components:
+            if obs.name not in ("STANDARD", "DAYLIGHT"):
+                continue
+            dtstart = obs.get("DTSTART")
+            offset_to = obs.get("TZOFFSETTO")
+            if not dtstart or not offset_to:
+                continue
+            start = parse_datetime(dtstart[0])
+            if not isinstance(start, datetime.datetime):
+                start = datetime.datetime(start.year, start.month, start.day)
+            start = start.replace(tzinfo=None)
+            offset_from = obs.get("TZOFFSETFROM", offset_to)
+            rrule = obs.get("RRULE")
+            rdates = []
+            for value, params in obs.get_all("RDATE"):
+                rdates.extend(d.replace(tzinfo=None) if isinstance(d, datetime.datetime) else d
+                              for d in parse_date_list(value, params))
+            self.observances.append({
+                "daylight": obs.name == "DAYLIGHT",
+                "start": start,
+                "offset_from": _parse_offset(offset_from[0]),
+                "offset_to": _parse_offset(offset_to[0]),
+                "rrule": parse_rrule(rrule[0]) if rrule else None,
+                "rdates": rdates,
+                "name": obs.text("TZNAME") or self.tzid,
+            })
+        self._cache = {}
+
+    def _transitions(self, year):
+        if year in self._cache:
+            return self._cache[year]
+        transitions = []
+        horizon = datetime.datetime(year + 1, 1, 1)
+        for obs in self.observances:
+            onsets = [obs["start"]] + [d for d in obs["rdates"] if isinstance(d, datetime.datetime)]
+            if obs["rrule"]:
+                window_start = datetime.datetime(year - 1, 1, 1)
+                for onset in iter_rrule(obs["start"], obs["rrule"], window_start, horizon):
+                    onsets.append(onset)
+            for onset in onsets:
+                if onset < horizon:
+                    transitions.append((onset, obs))
+        transitions.sort(key=lambda item: item[0])
+        self._cache[year] = transitions
+        return transitions
+
+    def _observance(self, dt):
+        local = dt.replace(tzinfo=None)
+        current = None
+        for onset, obs in self._transitions(local.year):
+            if onset <= local:
+                current = obs
+            else:
+                break
+        if current is None and self.observances:
+            first = min(self.observances, key=lambda o: o["start"])
+            return {"daylight": False, "offset_to": first["offset_from"], "name": first["name"]}
+        return current
+
+    def utcoffset(self, dt):
+        if dt is None or not self.observances:
+            return datetime.timedelta(0)
+        return self._observance(dt)["offset_to"]
+
+    def dst(self, dt):
+        if dt is None or not self.observances:
+            return datetime.timedelta(0)
+        obs = self._observance(dt)
+        if not obs["daylight"]:
+            return datetime.timedelta(0)
+        standard = [o["offset_to"] for o in self.observances if not o["daylight"]]
+        return obs["offset_to"] - standard[0] if standard else datetime.timedelta(hours=1)
+
+    def tzname(self, dt):
+        if dt is None or not self.observances:
+            return self.tzid
+        return self._observance(dt)["name"]
+
+    def __repr__(self):
+        return f"VTimezone({self.tzid!r})"
+
+
+def _parse_offset(value):
+    """'+0100' / '-053000' -> timedelta"""
+    value = value.strip()
+    sign = -1 if value.startswith("-") else 1
+    digits = value.lstrip("+-")
+    hours, minutes = int(digits[0:2]), int(digits[2:4])
+    seconds = int(digits[4:6]) if len(digits) >= 6 else 0
+    return sign * datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+def make_tz_resolver(root):
+    """
+    Return a function TZID -> tzinfo (or None for unknown, i.e. floating)
+
+    IANA names are resolved with zoneinfo; anything else falls back to the
+    VTIMEZONE definitions inside the calendar.
+    """
+    definitions = {}
+    for comp in root.walk("VTIMEZONE"):
+        tzid = comp.text("TZID")
+        if tzid:
+            definitions[tzid] = comp
+    cache = {}
+
+    def resolve(tzid):
+        tzid = tzid.strip('"')
+        if tzid in cache:
+            return cache[tzid]
+        tz = None
+        if ZoneInfo is not None:
+            try:
+                tz = ZoneInfo(tzid.lstrip("/"))
+            except Exception:
+                tz = None
+        if tz is None and tzid in definitions:
+            tz = VTimezone(definitions[tzid])
+        cache[tzid] = tz
+        return tz
+
+    return resolve
+
+
+def local_timezone(name=None):
+    """
+    tzinfo for an IANA zone name, or for the system's zone without one
+
+    The system zone is looked up by name (TZ, /etc/timezone, the
+    /etc/localtime link) so DST changes are followed; only if none of them
+    names a known zone is the current fixed UTC offset used.
+    """
+    if name:
+        if ZoneInfo is None:
+            raise ValueError("Time zone names need Python 3.9+ (zoneinfo)")
+        try:
+            return ZoneInfo(name)
+        except Exception:
+            raise ValueError(f"Unknown time zone: {name!r}")
+    if ZoneInfo is not None:
+        candidates = [os.environ.get("TZ", "").lstrip(":")]
+        try:
+            with open("/etc/timezone", encoding="utf-8") as f:
+                candidates.append(f.read().strip())
+        except OSError:
+            pass
+        candidates.append(os.path.realpath("/etc/localtime").partition("/zoneinfo/")[2])
+        for candidate in candidates:
+            if not candidate:
+                continue
+            try:
+                return ZoneInfo(candidate)
+            except Exception:
+                continue
+    return datetime.datetime.now().astimezone().tzinfo
+
+
+# ============================================
+# Recurrence rules
+# ============================================
+
+def parse_rrule(value, tz_resolver=None):
+    """Parse an RRULE value into a dict"""
+    rule = {
+        "FREQ": None, "INTERVAL": 1, "COUNT": None, "UNTIL": None,
+        "BYDAY": [], "BYMONTHDAY": [], "BYMONTH": [], "BYSETPOS": [],
+        "BYHOUR": [], "BYMINUTE": [], "WKST": 0,
+    }
+    for part in value.split(";"):
+        key, _, val = part.partition("=")
+        key = key.upper()
+        if not val:
+            continue
+        if key == "FREQ":
+            rule["FREQ"] = val.upper()
+        elif key in ("INTERVAL", "COUNT"):
+            rule[key] = int(val)
+        elif key == "UNTIL":
+            rule["UNTIL"] = parse_datetime(val, None, tz_resolver)
+        elif key == "BYDAY":
+            for item in val.split(","):
+                match = re.fullmatch(r"([+-]?\d+)?(MO|TU|WE|TH|FR|SA|SU)", item.strip().upper())
+                if match:
+                    nth = int(match.group(1)) if match.group(1) else 0
+                    rule["BYDAY"].append((nth, WEEKDAYS.index(match.group(2))))
+        elif key in ("BYMONTHDAY", "BYMONTH", "BYSETPOS", "BYHOUR", "BYMINUTE"):
+            rule[key] = [int(v) for v in val.split(",") if v.strip()]
+        elif key == "WKST" and val.upper() in WEEKDAYS:
+            rule["WKST"] = WEEKDAYS.index(val.upper())
+    rule["INTERVAL"] = max(rule["INTERVAL"], 1)
+    return rule
+
+
+def _month_days(year, month, rule, dtstart, byday_in_month=True):
+    """Candidate days of one month for MONTHLY/YEARLY rules"""
+    ndays = calendar.monthrange(year, month)[1]
+    days = None
+    if rule["BYMONTHDAY"]:
+        days = set()
+        for d in rule["BYMONTHDAY"]:
+            day = d if d > 0 else ndays + d + 1
+            if 1 <= day <= ndays:
+                days.add(day)
+    if rule["BYDAY"] and byday_in_month:
+        matches = set()
+        for nth, weekday in rule["BYDAY"]:
+            first = (weekday - calendar.weekday(year, month, 1)) % 7 + 1
+            candidates = list(range(first, ndays + 1, 7))
+            if nth == 0:
+                matches.update(candidates)
+            elif -len(candidates) <= nth <= len(candidates) and nth != 0:
+                matches.add(candidates[nth - 1] if nth > 0 else candidates[nth])
+        days = matches if days is None else days & matches
+    if days is None:
+        days = {dtstart.day} if dtstart.day <= ndays else set()
+    return [datetime.date(year, month, d) for d in sorted(days)]
+
+
+def _year_weekdays(year, rule):
+    """YEARLY;BYDAY without BYMONTH: nth weekday of the year"""
+    result = set()
+    start = datetime.date(year, 1, 1)
+    ndays = 366 if calendar.isleap(year) else 365
+    for nth, weekday in rule["BYDAY"]:
+        first = (weekday - start.weekday()) % 7
+        candidates = [start + datetime.timedelta(days=d) for d in range(first, ndays, 7)]
+        if nth == 0:
+            result.update(candidates)
+        elif -len(candidates) <= nth <= len(candidates):
+            result.add(candidates[nth - 1] if nth > 0 else candidates[nth])
+    return sorted(result)
+
+
+def _period_days(period, rule, dtstart):
+    """Candidate dates for the period that starts at `period`"""
+    freq = rule["FREQ"]
+    if freq == "YEARLY":
+        if rule["BYMONTH"]:
+            days = []
+            for month in sorted(rule["BYMONTH"]):
+                days.extend(_month_days(period.year, month, rule, dtstart))
+            return days
+        if rule["BYDAY"] and not rule["BYMONTHDAY"]:
+            return _year_weekdays(period.year, rule)
+        if rule["BYMONTHDAY"]:
+            return _month_days(period.year, dtstart.month, rule, dtstart)
+        ndays = calendar.monthrange(period.year, dtstart.month)[1]
+        return [datetime.date(period.year, dtstart.month, dtstart.day)] if dtstart.day <= ndays else []
+    if freq == "MONTHLY":
+        if rule["BYMONTH"] and period.month not in rule["BYMONTH"]:
+            return []
+        return _month_days(period.year, period.month, rule, dtstart)
+    if freq == "WEEKLY":
+        weekdays = sorted({wd for _, wd in rule["BYDAY"]}) or [dtstart.weekday()]
+        days = []
+        for offset in range(7):
+            day = period + datetime.timedelta(days=offset)
+            if day.weekday() in weekdays:
+                days.append(day)
+        if rule["BYMONTH"]:
+            days = [d for d in days if d.month in rule["BYMONTH"]]
+        return days
+    # DAILY and sub-daily: the period itself, filtered by BY* rules
+    day = period
+    if rule["BYMONTH"] and day.month not in rule["BYMONTH"]:
+        return []
+    if rule["BYMONTHDAY"]:
+        ndays = calendar.monthrange(day.year, day.month)[1]
+        wanted = {d if d > 0 else ndays + d + 1 for d in rule["BYMONTHDAY"]}
+        if day.day not in wanted:
+            return []
+    if rule["BYDAY"] and day.weekday() not in {wd for _, wd in rule["BYDAY"]}:
+        return []
+    return [day]
+
+
+def _add_months(date, months):
+    month_index = date.year * 12 + date.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _period_start(dtstart, rule, index):
+    """Start date of the index-th period (already multiplied by INTERVAL)"""
+    freq = rule["FREQ"]
+    base = dtstart.date()
+    if freq == "YEARLY":
+        return datetime.date(base.year + index, 1, 1)
+    if freq == "MONTHLY":
+        return _add_months(base, index)
+    if freq == "WEEKLY":
+        week_start = base - datetime.timedelta(days=(base.weekday() - rule["WKST"]) % 7)
+        return week_start + datetime.timedelta(weeks=index)
+    return base + datetime.timedelta(days=index)
+
+
+def _periods_to_skip(dtstart, rule, window_start):
+    """How many whole periods lie before window_start (0 if COUNT is set)"""
+    if window_start is None or rule["COUNT"] or window_start <= dtstart:
+        return 0
+    freq = rule["FREQ"]
+    delta_days = (window_start.date() - dtstart.date()).days
+    if freq == "YEARLY":
+        units = window_start.year - dtstart.year
+    elif freq == "MONTHLY":
+        units = (window_start.year - dtstart.year) * 12 + window_start.month - dtstart.month
+    elif freq == "WEEKLY":
+        units = delta_days // 7
+    elif freq == "DAILY":
+        units = delta_days
+    else:
+        return 0
+    # Step back one period so occurrences overlapping the window start are kept
+    return max(0, units // rule["INTERVAL"] - 1)
+
+
+def iter_rrule(dtstart, rule, window_start=None, window_end=None):
+    """
+    Yield naive wall-clock datetimes produced by rule, in order
+
+    dtstart must be a naive datetime. Periods before window_start are skipped
+    without being generated when the rule has no COUNT; generation stops at
+    window_end, UNTIL or COUNT, whichever comes first.
+    """
+    freq = rule["FREQ"]
+    if freq not in ("YEARLY", "MONTHLY", "WEEKLY", "DAILY", "HOURLY", "MINUTELY", "SECONDLY"):
+        return
+
+    until = rule["UNTIL"]
+    if until is not None:
+        if isinstance(until, datetime.datetime):
+            # Callers convert aware UNTIL values to dtstart's wall clock first
+            until = until.replace(tzinfo=None)
+        else:
+            until = datetime.datetime(until.year, until.month, until.day, 23, 59, 59)
+
+    count = rule["COUNT"]
+    interval = rule["INTERVAL"]
+    emitted = 0
+
+    if freq in ("HOURLY", "MINUTELY", "SECONDLY"):
+        step = {"HOURLY": datetime.timedelta(hours=interval),
+                "MINUTELY": datetime.timedelta(minutes=interval),
+                "SECONDLY": datetime.timedelta(seconds=interval)}[freq]
+        current = dtstart
+        if window_start is not None and not count and window_start > dtstart:
+            skipped = int((window_start - dtstart) / step) - 1
+            if skipped > 0:
+                current = dtstart + step * skipped
+        empty = 0
+        while empty < MAX_EMPTY_PERIODS:
+            if until is not None and current > until:
+                return
+            if window_end is not None and current >= window_end:
+                return
+            if _period_days(current.date(), dict(rule, FREQ="DAILY"), dtstart):
+                empty = 0
+                yield current
+                emitted += 1
+                if count and emitted >= count:
+                    return
+            else:
+                empty += 1
+            current += step
+        return
+
+    hours = sorted(rule["BYHOUR"]) or [dtstart.hour]
+    minutes = sorted(rule["BYMINUTE"]) or [dtstart.minute]
+
+    index = _periods_to_skip(dtstart, rule, window_start)
+    empty = 0
+    while empty < MAX_EMPTY_PERIODS:
+        period = _period_start(dtstart, rule, index * interval)
+        index += 1
+
+        candidates = [
+            datetime.datetime(day.year, day.month, day.day, h, m, dtstart.second)
+            for day in _period_days(period, rule, dtstart)
+            for h in hours
+            for m in minutes
+        ]
+        if rule["BYSETPOS"] and candidates:
+            picked = set()
+            for pos in rule["BYSETPOS"]:
+                if -len(candidates) <= pos <= len(candidates) and pos != 0:
+                    picked.add(candidates[pos - 1] if pos > 0 else candidates[pos])
+            candidates = sorted(picked)
+
+        produced = False
+        for candidate in candidates:
+            if candidate < dtstart:
+                continue
+            if until is not None and candidate > until:
+                return
+            if window_end is not None and candidate >= window_end:
+                return
+            produced = True
+            yield candidate
+            emitted += 1
+            if count and emitted >= count:
+                return
+
+        if produced:
+            empty = 0
+        else:
+            empty += 1
+            # Past the window/UNTIL with nothing left to produce
+            period_dt = datetime.datetime(period.year, period.month, period.day)
+            if window_end is not None and period_dt >= window_end:
+                return
+            if until is not None and period_dt > until:
+                return
+
+
+# ============================================
+# Events and occurrences
+# ============================================
+
+def _as_wall(value):
+    """date/datetime -> naive datetime on its own wall clock"""
+    if isinstance(value, datetime.datetime):
+        return value.replace(tzinfo=None)
+    return datetime.datetime(value.year, value.month, value.day)
+
+
+def _from_wall(wall, template):
+    """Inverse of _as_wall: restore the type/tzinfo of template"""
+    if not isinstance(template, datetime.datetime):
+        return wall.date()
+    return wall.replace(tzinfo=template.tzinfo)
+
+
+def _event_base(vevent, tz_resolver):
+    dtstart_prop = vevent.get("DTSTART")
+    if dtstart_prop is None:
+        return None
+    start = parse_datetime(dtstart_prop[0], dtstart_prop[1], tz_resolver)
+    all_day = not isinstance(start, datetime.datetime)
+
+    dtend_prop = vevent.get("DTEND")
+    duration_prop = vevent.get("DURATION")
+    if dtend_prop is not None:
+        end = parse_datetime(dtend_prop[0], dtend_prop[1], tz_resolver)
+        if isinstance(end, datetime.datetime) and isinstance(start, datetime.datetime):
+            duration = to_utc(end) - to_utc(start) if (end.tzinfo or start.tzinfo) else end - start
+        else:
+            duration = _as_wall(end) - _as_wall(start)
+    elif duration_prop is not None:
+        duration = parse_duration(duration_prop[0])
+    else:
+        duration = datetime.timedelta(days=1) if all_day else datetime.timedelta(0)
+
+    recurrence_id = vevent.get("RECURRENCE-ID")
+    return {
+        "uid": vevent.text("UID"),
+        "title": vevent.text("SUMMARY", "Untitled") or "Untitled",
+        "location": vevent.text("LOCATION"),
+        "description": vevent.text("DESCRIPTION"),
+        "status": vevent.text("STATUS"),
+        "transp": vevent.text("TRANSP"),
+        "start": start,
+        "duration": duration,
+        "all_day": all_day,
+        "recurrence_id": (parse_datetime(recurrence_id[0], recurrence_id[1], tz_resolver)
+                          if recurrence_id else None),
+    }
+
+
+def _occurrence(base, start, recurrence_id=None):
+    return {
+        "uid": base["uid"],
+        "title": base["title"],
+        "start": start,
+        "end": start + base["duration"],
+        "all_day": base["all_day"],
+        "location": base["location"],
+        "description": base["description"],
+        "status": base["status"],
+        "transp": base["transp"],
+        "recurrence_id": recurrence_id if recurrence_id is not None else base["recurrence_id"],
+    }
+
+
+def overlaps(occ, window_start, window_end, default_tz=UTC):
+    """Does occ overlap [window_start, window_end)? Dates/floating times are in default_tz"""
+    start = to_utc(occ["start"], default_tz)
+    end = to_utc(occ["end"], default_tz)
+    if window_end is not None and start >= window_end:
+        return False
+    if window_start is not None:
+        if end > start:
+            return end > window_start
+        return start >= window_start
+    return True
+
+
+def _expand_master(vevent, base, tz_resolver, window_start, window_end,
+                   overridden, default_tz):
+    """Yield occurrences of one master VEVENT, in start order"""
+    start = base["start"]
+    rrule_prop = vevent.get("RRULE")
+    rdates = []
+    for value, params in vevent.get_all("RDATE"):
+        rdates.extend(parse_date_list(value, params, tz_resolver))
+    exdates = set()
+    for value, params in vevent.get_all("EXDATE"):
+        exdates.update(to_utc(d, default_tz) for d in parse_date_list(value, params, tz_resolver))
+
+    def key(value):
+        return to_utc(value, default_tz)
+
+    if rrule_prop is None:
+        starts = iter([start])
+    else:
+        rule = parse_rrule(rrule_prop[0], tz_resolver)
+        until = rule["UNTIL"]
+        if isinstance(until, datetime.datetime) and until.tzinfo is not None:
+            rule["UNTIL"] = _as_wall(until.astimezone(_tz_of(start, default_tz)))
+        # Expand on the event's wall clock so DST changes keep the local time.
+        # Widen the window by the event duration and a day of TZ slack.
+        slack = abs(base["duration"]) + datetime.timedelta(days=1)
+        wall_start = wall_end = None
+        if window_start is not None:
+            wall_start = _as_wall(window_start.astimezone(_tz_of(start, default_tz))) - slack
+        if window_end is not None:
+            wall_end = _as_wall(window_end.astimezone(_tz_of(start, default_tz))) + slack
+        elif not rule["COUNT"] and rule["UNTIL"] is None:
+            wall_end = _as_wall(start) + DEFAULT_EXPANSION_HORIZON
+        starts = (_from_wall(wall, start)
+                  for wall in iter_rrule(_as_wall(start), rule, wall_start, wall_end))
+        # RFC 5545: DTSTART is always the first instance
+        starts = heapq.merge([start], starts, key=key)
+
+    all_starts = heapq.merge(starts, sorted(rdates, key=key), key=key)
+
+    previous = None
+    for occ_start in all_starts:
+        k = key(occ_start)
+        if k == previous:
+            continue
+        previous = k
+        if k in exdates or k in overridden:
+            continue
+        if window_end is not None and k >= window_end:
+            return
+        occ = _occurrence(base, occ_start, occ_start if rrule_prop or rdates else None)
+        if overlaps(occ, window_start, window_end, default_tz):
+            yield occ
+
+
+def _tz_of(value, default_tz):
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.tzinfo
+    return default_tz
+
+
+def iter_occurrences(ics_text, window_start=None, window_end=None, default_tz=UTC):
+    """
+    Yield one dict per event occurrence in ics_text, in start order
+
+    window_start/window_end (aware datetimes, end exclusive) limit recurrence
+    expansion; occurrences that overlap the window are returned. Dates and
+    floating times are interpreted in default_tz.
+
+    Each occurrence: {"uid", "title", "start", "end", "all_day", "location",
+    "description", "status", "transp", "recurrence_id"}; start/end keep the event's own
+    time zone (or are dates for all-day events).
+    """
+    if window_start is not None:
+        window_start = to_utc(window_start, default_tz)
+    if window_end is not None:
+        window_end = to_utc(window_end, default_tz)
+
+    root = parse_calendar(ics_text)
+    tz_resolver = make_tz_resolver(root)
+
+    masters = []
+    overrides = {}
+    for vevent in root.walk("VEVENT"):
+        base = _event_base(vevent, tz_resolver)
+        if base is None:
+            continue
+        if base["recurrence_id"] is not None:
+            overrides.setdefault(base["uid"], []).append(base)
+        else:
+            masters.append((vevent, base))
+
+    streams = []
+    for vevent, base in masters:
+        replaced = overrides.pop(base["uid"], [])
+        overridden = {to_utc(o["recurrence_id"], default_tz) for o in replaced}
+        streams.append(_expand_master(vevent, base, tz_resolver, window_start,
+                                      window_end, overridden, default_tz))
+        streams.append(iter(sorted(
+            (occ for occ in (_occurrence(o, o["start"]) for o in replaced)
+             if overlaps(occ, window_start, window_end, default_tz)),
+            key=lambda occ: to_utc(occ["start"], default_tz))))
+
+    # Overrides whose master is not part of this resource
+    for replaced in overrides.values():
+        streams.append(iter(sorted(
+            (occ for occ in (_occurrence(o, o["start"]) for o in replaced)
+             if overlaps(occ, window_start, window_end, default_tz)),
+            key=lambda occ: to_utc(occ["start"], default_tz))))
+
+    yield from heapq.merge(*streams, key=lambda occ: to_utc(occ["start"], default_tz))
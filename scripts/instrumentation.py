@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Timing instrumentation for CalDAV round-trips
+
+When enabled, every request sent through CalDAVClient is recorded as a
+structured event with per-phase timings:
+
+    wait      time spent in the rate limiter
+    connect   DNS lookup + TCP connect (new connections only)
+    tls       TLS handshake (new connections only)
+    server    request sent -> response headers received (server processing)
+    download  reading the response body
+    parse     multistatus/ICS parsing while a streamed body is consumed
+    backoff   sleeping between retries
+
+plus bytes out/in, status, attempts and new connections. Streamed bodies
+read through multistatus.response_chunks() add a second "body" event with
+the same id (download, parse time, bytes and number of resources parsed).
+
+Events can be appended to a JSON Lines log, summarised at exit (--profile)
+or exported in the Prometheus text format (calendar_service.py serves it
+at /metrics).
+
+Usage:
+    import instrumentation
+
+    instrumentation.enable(log_path="caldav-profile.jsonl")
+    ...
+    instrumentation.recorder.print_report()
+
+Setting CALDAV_PROFILE_LOG=path enables the JSON log for any script.
+"""
+
+import atexit
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+PHASES = ["wait", "connect", "tls", "server", "download", "parse", "backoff"]
+
+# Histogram buckets for request duration (seconds)
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# Latest request durations kept per method for percentiles
+MAX_SAMPLES = 10000
+
+# Append events to this JSON Lines file in every script
+PROFILE_LOG = os.environ.get("CALDAV_PROFILE_LOG")
+
+# The event of the request in progress on this thread, for connection timing
+_local = threading.local()
+
+
+def _new_stats():
+    return {
+        "count": 0,
+        "errors": 0,
+        "statuses": collections.Counter(),
+        "phases": dict.fromkeys(PHASES, 0.0),
+        "total": 0.0,
+        "bytes_out": 0,
+        "bytes_in": 0,
+        "resources": 0,
+        "connections": 0,
+        "buckets": [0] * len(LATENCY_BUCKETS),
+        "samples": collections.deque(maxlen=MAX_SAMPLES),
+    }
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+class Recorder:
+    """
+    Collects request events and per-method aggregates (thread-safe)
+
+    All methods are no-ops while disabled; begin() then returns None and
+    the other calls accept None in place of an event.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._log = None
+        self._ids = itertools.count(1)
+        self.stats = {}
+
+    def enable(self, log_path=None):
+        self.enabled = True
+        if log_path and self._log is None:
+            self._log = open(log_path, "a", encoding="utf-8", buffering=1)
+
+    def disable(self):
+        self.enabled = False
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def _emit(self, event):
+        if self._log is None:
+            return
+        line = json.dumps(event, separators=(",", ":"))
+        with self._lock:
+            if self._log is not None:
+                self._log.write(line + "\n")
+
+    # ---- request events (called by CalDAVClient) ----
+
+    def begin(self, method, url, body=None):
+        if not self.enabled:
+            return None
+        event = {
+            "type": "request",
+            "id": next(self._ids),
+            "ts": round(time.time(), 3),
+            "method": method,
+            "url": urlsplit(url).path,
+            "status": None,
+            "attempts": 0,
+            "connections": 0,
+            "bytes_out": 0,
+            "bytes_in": 0,
+            "_body": _body_size(body),
+            "_started": time.perf_counter(),
+        }
+        for phase in PHASES:
+            event[phase] = 0.0
+        _local.event = event
+        return event
+
+    @staticmethod
+    def add(event, phase, seconds):
+        if event is not None:
+            event[phase] += seconds
+
+    @staticmethod
+    def mark(event):
+        """Start of one attempt: (time, connection setup so far)"""
+        if event is None:
+            return None
+        event["attempts"] += 1
+        event["bytes_out"] += event["_body"]
+        return time.perf_counter(), event["connect"] + event["tls"]
+
+    @staticmethod
+    def sent(event, mark, response, stream=False):
+        """One attempt got its response; split the time into server/download"""
+        if event is None:
+            return
+        spent = time.perf_counter() - mark[0]
+        setup = event["connect"] + event["tls"] - mark[1]
+        elapsed = response.elapsed.total_seconds()
+        event["server"] += max(0.0, elapsed - setup)
+        if stream:
+            response.profile = event
+        else:
+            event["download"] += max(0.0, spent - elapsed)
+            event["bytes_in"] += len(response.content)
+
+    def end(self, event, response=None, error=None):
+        if event is None:
+            return
+        _local.event = None
+        total = time.perf_counter() - event.pop("_started")
+        event.pop("_body")
+        event["total"] = total
+        if response is not None:
+            event["status"] = response.status_code
+        if error is not None:
+            event["error"] = type(error).__name__
+        for phase in PHASES + ["total"]:
+            event[phase] = round(event[phase], 6)
+
+        with self._lock:
+            stats = self.stats.setdefault(event["method"], _new_stats())
+            stats["count"] += 1
+            if error is not None or (event["status"] or 0) >= 400:
+                stats["errors"] += 1
+            stats["statuses"][str(event["status"] or "error")] += 1
+            for phase in PHASES:
+                stats["phases"][phase] += event[phase]
+            stats["total"] += total
+            stats["bytes_out"] += event["bytes_out"]
+            stats["bytes_in"] += event["bytes_in"]
+            stats["connections"] += event["connections"]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if total <= bound:
+                    stats["buckets"][i] += 1
+            stats["samples"].append(total)
+        self._emit(event)
+
+    def end_body(self, event, download, parse, size, resources):
+        """A streamed body was consumed (see multistatus.response_chunks)"""
+        if event is None:
+            return
+        with self._lock:
+            stats = self.stats.setdefault(event["method"], _new_stats())
+            stats["phases"]["download"] += download
+            stats["phases"]["parse"] += parse
+            stats["total"] += download + parse
+            stats["bytes_in"] += size
+            stats["resources"] += resources
+        self._emit({
+            "type": "body",
+            "id": event["id"],
+            "method": event["method"],
+            "url": event["url"],
+            "download": round(download, 6),
+            "parse": round(parse, 6),
+            "bytes_in": size,
+            "resources": resources,
+        })
+
+    # ---- output ----
+
+    def summary(self):
+        """Per-method aggregates as plain dicts"""
+        with self._lock:
+            result = {}
+            for method, stats in sorted(self.stats.items()):
+                samples = list(stats["samples"])
+                result[method] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "statuses": dict(stats["statuses"]),
+                    "p50": _percentile(samples, 50),
+                    "p95": _percentile(samples, 95),
+                    "phases": dict(stats["phases"]),
+                    "total": stats["total"],
+                    "bytes_out": stats["bytes_out"],
+                    "bytes_in": stats["bytes_in"],
+                    "resources": stats["resources"],
+                    "connections": stats["connections"],
+                }
+            return result
+
+    def print_report(self, file=None):
+        """Print a per-method and per-phase breakdown"""
+        file = file or sys.stderr
+        summary = self.summary()
+        if not summary:
+            print("\nProfile: no CalDAV requests were made", file=file)
+            return
+        print("\n" + "=" * 78, file=file)
+        print("CalDAV profile", file=file)
+        print("=" * 78, file=file)
+        print(f"{'method':<10} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'conns':>6} {'KiB out':>9} {'KiB in':>9} {'resources':>10}", file=file)
+        for method, s in summary.items():
+            print(f"{method:<10} {s['count']:>6} {s['errors']:>6} {s['p50'] * 1000:>9.1f} "
+                  f"{s['p95'] * 1000:>9.1f} {s['connections']:>6} {s['bytes_out'] / 1024:>9.1f} "
+                  f"{s['bytes_in'] / 1024:>9.1f} {s['resources']:>10}", file=file)
+
+        print("\nTime by phase (seconds, share of all recorded time):", file=file)
+        print(f"{'method':<10}" + "".join(f"{phase:>10}" for phase in PHASES), file=file)
+        for method, s in summary.items():
+            total = s["total"] or 1.0
+            print(f"{method:<10}" + "".join(f"{s['phases'][phase]:>10.3f}" for phase in PHASES),
+                  file=file)
+            print(f"{'':<10}" + "".join(f"{s['phases'][phase] / total:>10.0%}" for phase in PHASES),
+                  file=file)
+
+    def prometheus(self):
+        """Aggregates in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self.stats.items())
+            lines = [
+                "# HELP caldav_requests_total CalDAV requests by method and final status",
+                "# TYPE caldav_requests_total counter",
+            ]
+            for method, stats in items:
+                for status, count in sorted(stats["statuses"].items()):
+                    lines.append(f'caldav_requests_total{{method="{method}",status="{status}"}} {count}')
+            lines += ["# HELP caldav_phase_seconds_total Time spent per request phase",
+                      "# TYPE caldav_phase_seconds_total counter"]
+            for method, stats in items:
+                for phase in PHASES:
+                    lines.append(f'caldav_phase_seconds_total{{method="{method}",phase="{phase}"}} '
+                                 f'{stats["phases"][phase]:.6f}')
+            lines += ["# HELP caldav_bytes_total Request and response body bytes",
+                      "# TYPE caldav_bytes_total counter"]
+            for method, stats in items:
+                lines.append(f'caldav_bytes_total{{method="{method}",direction="out"}} {stats["bytes_out"]}')
+                lines.append(f'caldav_bytes_total{{method="{method}",direction="in"}} {stats["bytes_in"]}')
+            lines += ["# HELP caldav_resources_total Calendar resources parsed from responses",
+                      "# TYPE caldav_resources_total counter"]
+            for method, stats in items:
+                lines.append(f'caldav_resources_total{{method="{method}"}} {stats["resources"]}')
+            lines += ["# HELP caldav_connections_total New connections opened",
+                      "# TYPE caldav_connections_total counter"]
+            for method, stats in items:
+                lines.append(f'caldav_connections_total{{method="{method}"}} {stats["connections"]}')
+            lines += ["# HELP caldav_request_duration_seconds Request duration until headers and retries",
+                      "# TYPE caldav_request_duration_seconds histogram"]
+            for method, stats in items:
+                for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+                    lines.append(f'caldav_request_duration_seconds_bucket{{method="{method}",le="{bound}"}} {count}')
+                lines.append(f'caldav_request_duration_seconds_bucket{{method="{method}",le="+Inf"}} '
+                             f'{stats["count"]}')
+                lines.append(f'caldav_request_duration_seconds_sum{{method="{method}"}} '
+                             f'{sum(stats["samples"]):.6f}')
+                lines.append(f'caldav_request_duration_seconds_count{{method="{method}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+recorder = Recorder()
+
+
+def enable(log_path=None, report=False):
+    """Start recording; with report=True a breakdown is printed at exit"""
+    recorder.enable(log_path)
+    if report:
+        atexit.register(recorder.print_report)
+
+
+def add_arguments(parser):
+    """Add --profile / --profile-log to a script's argument parser"""
+    parser.add_argument("--profile", action="store_true",
+                        help="print a per-request timing breakdown at exit")
+    parser.add_argument("--profile-log", metavar="FILE",
+                        help="append timing events to this JSON Lines file")
+
+
+def configure(args):
+    """Enable recording as requested by add_arguments() options"""
+    if args.profile or args.profile_log:
+        enable(log_path=args.profile_log, report=args.profile)
+
+
+# ============================================
+# Connection timing
+# ============================================
+
+def _add_current(phase, seconds):
+    event = getattr(_local, "event", None)
+    if event is not None:
+        event[phase] += seconds
+        if phase == "connect":
+            event["connections"] += 1
+
+
+class _TimedConnect:
+    def _new_conn(self):
+        started = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            self._socket_seconds = time.perf_counter() - started
+            _add_current("connect", self._socket_seconds)
+
+
+class TimedHTTPConnection(_TimedConnect, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnect, HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        self._socket_seconds = 0.0
+        try:
+            super().connect()
+        finally:
+            _add_current("tls", max(0.0, time.perf_counter() - started - self._socket_seconds))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report connect/TLS time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+if PROFILE_LOG:
+    enable(PROFILE_LOG)
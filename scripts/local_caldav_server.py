@@ -0,0 +1,716 @@
+#!/usr/bin/env python3
+"""
+Local CalDAV Stand-in Server
+An offline, iCloud-like CalDAV server for testing and benchmarking
+
+Implements what the scripts use: PROPFIND (well-known, principal, calendar
+home), REPORT (calendar-query with time-range / UID filters,
+calendar-multiget, sync-collection, free-busy-query; calendar-data partial
+retrieval and expand), PUT (If-None-Match / If-Match), GET and DELETE
+(If-Match), with iCloud-style responses and status codes:
+
+    401  wrong EMAIL/PASSWORD
+    403  write to a read-only (shared) calendar, or throttled
+    404  unknown USER_ID / CALENDAR_ID
+    207  Multi-Status on success
+
+Latency, throttling, the size of the synthetic calendars, gzip response
+compression and a bandwidth cap are configurable, so error branches and
+performance can be exercised without caldav.icloud.com.
+
+Usage:
+    python3 local_caldav_server.py --calendars 3 --events 2000 --latency 40
+    CALDAV_BASE_URL=http://127.0.0.1:8843 python3 3_test_read_events.py
+
+    from local_caldav_server import LocalCalDAVServer
+
+    with LocalCalDAVServer(events_per_calendar=1000) as server:
+        client = CalDAVClient(server.email, server.password, base_url=server.base_url)
+"""
+
+import argparse
+import base64
+import datetime
+import gzip
+import hashlib
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+from bulk_write import escape_text
+from etag_cache import ics_uid
+from ics_parser import iter_occurrences, parse_calendar, parse_datetime, to_utc
+
+DAV = "{DAV:}"
+CALDAV = "{urn:ietf:params:xml:ns:caldav}"
+
+DEFAULT_EMAIL = "test@example.com"
+DEFAULT_PASSWORD = "abcd-efgh-ijkl-mnop"
+DEFAULT_USER_ID = "123456789"
+
+SYSTEM_FOLDERS = ["inbox", "outbox", "notification"]
+
+SAMPLE_TITLES = [
+    "Standup", "1:1", "Design review", "Lunch", "Dentist appointment", "Gym",
+    "Project sync", "Customer call", "Planning", "Retro", "School pickup",
+    "Flight to Berlin", "Doctor", "Team dinner", "Interview", "Focus time",
+]
+SAMPLE_LOCATIONS = ["", "", "Office", "Zoom", "Room 4.12", "Cafe", "Downtown clinic"]
+
+# With compression on, bodies at least this large are gzipped (like most servers)
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+
+class TokenBucket:
+    """Simple token bucket used to emulate iCloud throttling"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def _etag(ics):
+    return '"' + hashlib.md5(ics.encode("utf-8")).hexdigest()[:16] + '"'
+
+
+def _event_bounds(ics):
+    """(start_ts, end_ts, recurring) for the first VEVENT of an ICS body"""
+    root = parse_calendar(ics)
+    for vevent in root.walk("VEVENT"):
+        recurring = vevent.get("RRULE") is not None or vevent.get("RDATE") is not None
+        dtstart = vevent.get("DTSTART")
+        if dtstart is None:
+            break
+        start = parse_datetime(dtstart[0], dtstart[1])
+        dtend = vevent.get("DTEND")
+        end = parse_datetime(dtend[0], dtend[1]) if dtend else start
+        start_ts = to_utc(start).timestamp()
+        end_ts = max(to_utc(end).timestamp(), start_ts)
+        if not isinstance(start, datetime.datetime) and not dtend:
+            end_ts = start_ts + 86400
+        return start_ts, end_ts, recurring
+    return 0.0, 0.0, False
+
+
+def synthetic_event(rng, calendar_id, index, start_date, days):
+    """One generated VEVENT; about 5% are weekly recurring"""
+    uid = f"{calendar_id}-{index:06d}"
+    day = start_date + datetime.timedelta(days=rng.randrange(days))
+    if rng.random() < 0.08:
+        dtstart = f"DTSTART;VALUE=DATE:{day:%Y%m%d}"
+        dtend = f"DTEND;VALUE=DATE:{day + datetime.timedelta(days=1):%Y%m%d}"
+    else:
+        start = datetime.datetime(day.year, day.month, day.day, rng.randrange(6, 20), rng.choice([0, 15, 30, 45]))
+        end = start + datetime.timedelta(minutes=rng.choice([15, 30, 45, 60, 90, 120]))
+        dtstart = f"DTSTART:{start:%Y%m%dT%H%M%S}Z"
+        dtend = f"DTEND:{end:%Y%m%dT%H%M%S}Z"
+    lines = [
+        "BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Local CalDAV Stand-in//EN",
+        "BEGIN:VEVENT", f"UID:{uid}", "DTSTAMP:20240101T000000Z", dtstart, dtend,
+        f"SUMMARY:{rng.choice(SAMPLE_TITLES)} #{index}",
+    ]
+    location = rng.choice(SAMPLE_LOCATIONS)
+    if location:
+        lines.append(f"LOCATION:{location}")
+    lines.append("DESCRIPTION:Synthetic event generated by the local CalDAV stand-in. " + "x" * rng.randrange(0, 400))
+    if rng.random() < 0.05:
+        lines.append("RRULE:FREQ=WEEKLY;COUNT=20")
+    lines += ["END:VEVENT", "END:VCALENDAR"]
+    return uid, "\r\n".join(lines) + "\r\n"
+
+
+class CalendarData:
+    """Resources of one calendar plus its sync-collection change log"""
+
+    def __init__(self, calendar_id, name, color="#1BADF8", writable=True):
+        self.calendar_id = calendar_id
+        self.name = name
+        self.color = color
+        self.writable = writable
+        self.resources = {}   # name (uid.ics) -> {"ics", "etag", "start", "end", "recurring"}
+        self.changes = []     # (seq, name, deleted)
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def put(self, name, ics):
+        start, end, recurring = _event_bounds(ics)
+        with self.lock:
+            existed = name in self.resources
+            self.resources[name] = {"ics": ics, "etag": _etag(ics), "start": start,
+                                    "end": end, "recurring": recurring}
+            self.seq += 1
+            self.changes.append((self.seq, name, False))
+            return existed
+
+    def delete(self, name):
+        with self.lock:
+            if self.resources.pop(name, None) is None:
+                return False
+            self.seq += 1
+            self.changes.append((self.seq, name, True))
+            return True
+
+    @property
+    def ctag(self):
+        return f"ctag-{self.seq}"
+
+
+class LocalCalDAVServer:
+    """
+    Threaded stand-in server; use as a context manager or start()/stop()
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, email=DEFAULT_EMAIL, password=DEFAULT_PASSWORD,
+                 user_id=DEFAULT_USER_ID, calendars=2, events_per_calendar=200,
+                 read_only_calendars=0, latency_ms=0.0, jitter_ms=0.0,
+                 rate_limit=None, burst=None, throttle_status=403, ignore_partial=False,
+                 free_busy=True, compress=False, bandwidth_mbit=None, seed=42):
+        self.email = email
+        self.password = password
+        self.user_id = user_id
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.throttle_status = throttle_status
+        # Behave like a server without RFC 4791 partial retrieval / expand
+        self.ignore_partial = ignore_partial
+        # Behave like a server without free-busy-query (403 DAV:supported-report)
+        self.free_busy = free_busy
+        # gzip bodies for clients that accept it, and the link speed to simulate
+        self.compress = compress
+        self.bandwidth = bandwidth_mbit * 1e6 / 8 if bandwidth_mbit else None
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+        self.stats = {"requests": 0, "throttled": 0, "bytes_out": 0}
+        self._stats_lock = threading.Lock()
+        self._auth = "Basic " + base64.b64encode(f"{email}:{password}".encode()).decode()
+
+        rng = random.Random(seed)
+        start_date = datetime.date.today() - datetime.timedelta(days=180)
+        self.calendars = {}
+        for i in range(calendars):
+            calendar_id = f"CAL-{i + 1:04d}-{rng.randrange(16 ** 8):08X}"
+            cal = CalendarData(calendar_id, f"Calendar {i + 1}",
+                               writable=i >= read_only_calendars)
+            for index in range(events_per_calendar):
+                uid, ics = synthetic_event(rng, calendar_id, index, start_date, 365)
+                cal.put(f"{uid}.ics", ics)
+            self.calendars[calendar_id] = cal
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+
+# ============================================
+# Request handling
+# ============================================
+
+def _multistatus(responses, sync_token=None):
+    body = ['<?xml version="1.0" encoding="UTF-8"?>',
+            '<multistatus xmlns="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav" '
+            'xmlns:CS="http://calendarserver.org/ns/" xmlns:ICAL="http://apple.com/ns/ical/">']
+    body.extend(responses)
+    if sync_token is not None:
+        body.append(f"<sync-token>{escape(sync_token)}</sync-token>")
+    body.append("</multistatus>")
+    return "".join(body)
+
+
+def _response(href, props, missing=()):
+    parts = [f"<response><href>{escape(href)}</href>"]
+    if props:
+        parts.append("<propstat><prop>" + "".join(props) +
+                     "</prop><status>HTTP/1.1 200 OK</status></propstat>")
+    if missing:
+        parts.append("<propstat><prop>" + "".join(missing) +
+                     "</prop><status>HTTP/1.1 404 Not Found</status></propstat>")
+    parts.append("</response>")
+    return "".join(parts)
+
+
+def _project(ics, names):
+    """Keep only the named properties inside VEVENTs (partial retrieval)"""
+    lines = []
+    in_event = False
+    for line in ics.replace("\r\n ", "").splitlines():
+        if line == "BEGIN:VEVENT":
+            in_event = True
+        elif line == "END:VEVENT":
+            in_event = False
+        elif in_event:
+            name = line.split(":", 1)[0].split(";", 1)[0].upper()
+            if name not in names:
+                continue
+        lines.append(line)
+    return "\r\n".join(lines) + "\r\n"
+
+
+def _expand(ics, window_start, window_end):
+    """Replace a recurring VEVENT by its instances in the window, in UTC"""
+    lines = []
+    for line in ics.replace("\r\n ", "").splitlines():
+        if line == "BEGIN:VEVENT":
+            break
+        lines.append(line)
+    for occ in iter_occurrences(ics, window_start, window_end):
+        start, end = to_utc(occ["start"]), to_utc(occ["end"])
+        recurrence_id = to_utc(occ["recurrence_id"] or occ["start"])
+        lines += ["BEGIN:VEVENT", f"UID:{occ['uid']}",
+                  f"RECURRENCE-ID:{recurrence_id:%Y%m%dT%H%M%SZ}",
+                  f"DTSTART:{start:%Y%m%dT%H%M%SZ}", f"DTEND:{end:%Y%m%dT%H%M%SZ}",
+                  f"SUMMARY:{escape_text(occ['title'])}"]
+        if occ["location"]:
+            lines.append(f"LOCATION:{escape_text(occ['location'])}")
+        if occ["description"]:
+            lines.append(f"DESCRIPTION:{escape_text(occ['description'])}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def _make_handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "LocalCalDAV/1.0"
+        # Headers and body are separate writes; without this Nagle adds ~40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        # ---------- plumbing ----------
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def _send(self, status, body="", content_type="application/xml; charset=utf-8", headers=None):
+            data = body.encode("utf-8") if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if (server.compress and len(data) >= GZIP_MIN_BYTES
+                    and "gzip" in self.headers.get("Accept-Encoding", "")):
+                data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                if server.bandwidth:
+                    time.sleep(len(data) / server.bandwidth)
+                self.wfile.write(data)
+            server.count("bytes_out", len(data))
+
+        def _preamble(self):
+            """Latency, throttling and auth; returns False if already answered"""
+            server.count("requests")
+            if server.latency or server.jitter:
+                time.sleep(server.latency + random.random() * server.jitter)
+            if server.bucket is not None and not server.bucket.take():
+                server.count("throttled")
+                self._body()
+                self._send(server.throttle_status, "Too many requests", "text/plain",
+                           {"Retry-After": "1"})
+                return False
+            if self.headers.get("Authorization") != server._auth:
+                self._body()
+                self._send(401, "Unauthorized", "text/plain",
+                           {"WWW-Authenticate": 'Basic realm="Local CalDAV"'})
+                return False
+            return True
+
+        def _route(self):
+            """-> (kind, calendar, resource name)"""
+            parts = [unquote(p) for p in urlsplit(self.path).path.split("/") if p]
+            if parts[:2] == [".well-known", "caldav"] or not parts:
+                return "root", None, None
+            if parts[0] != server.user_id:
+                return None, None, None
+            if parts[1:] == ["principal"]:
+                return "principal", None, None
+            if parts[1:2] != ["calendars"]:
+                return None, None, None
+            if len(parts) == 2:
+                return "home", None, None
+            if parts[2] in SYSTEM_FOLDERS:
+                return "system", None, None
+            cal = server.calendars.get(parts[2])
+            if cal is None:
+                return None, None, None
+            if len(parts) == 3:
+                return "calendar", cal, None
+            return "resource", cal, parts[3]
+
+        def _href(self, *parts):
+            return "/" + "/".join(quote(part, safe="@") for part in [server.user_id] + list(parts))
+
+        # ---------- PROPFIND ----------
+
+        def do_PROPFIND(self):
+            if not self._preamble():
+                return
+            self._body()
+            kind, cal, _ = self._route()
+            depth = self.headers.get("Depth", "0")
+            principal = f"/{server.user_id}/principal/"
+
+            if kind in ("root", "principal"):
+                props = [f"<current-user-principal><href>{principal}</href></current-user-principal>"]
+                if kind == "principal":
+                    props.append(f"<C:calendar-home-set><href>{server.base_url}/{server.user_id}/calendars/"
+                                 f"</href></C:calendar-home-set>")
+                href = "/" if kind == "root" else principal
+                self._send(207, _multistatus([_response(href, props)]))
+            elif kind == "home":
+                ctag = "home-" + "-".join(c.ctag for c in server.calendars.values())
+                home_props = ["<resourcetype><collection/></resourcetype>",
+                              f"<CS:getctag>{ctag}</CS:getctag>",
+                              f"<sync-token>{ctag}</sync-token>"]
+                responses = [_response(self._href("calendars") + "/", home_props)]
+                if depth != "0":
+                    for folder in SYSTEM_FOLDERS:
+                        responses.append(_response(self._href("calendars", folder) + "/",
+                                                   ["<resourcetype><collection/></resourcetype>"]))
+                    for c in server.calendars.values():
+                        responses.append(_response(self._href("calendars", c.calendar_id) + "/",
+                                                   self._calendar_props(c)))
+                self._send(207, _multistatus(responses))
+            elif kind == "calendar":
+                responses = [_response(self._href("calendars", cal.calendar_id) + "/",
+                                       self._calendar_props(cal))]
+                if depth != "0":
+                    with cal.lock:
+                        items = list(cal.resources.items())
+                    for name, res in items:
+                        responses.append(_response(self._href("calendars", cal.calendar_id, name),
+                                                   [f"<getetag>{escape(res['etag'])}</getetag>"]))
+                self._send(207, _multistatus(responses))
+            else:
+                self._send(404, "Not Found", "text/plain")
+
+        def _calendar_props(self, cal):
+            return [
+                "<resourcetype><collection/><C:calendar/></resourcetype>",
+                f"<displayname>{escape(cal.name)}</displayname>",
+                f"<ICAL:calendar-color>{cal.color}</ICAL:calendar-color>",
+                f"<CS:getctag>{cal.ctag}</CS:getctag>",
+                f"<sync-token>{cal.seq}</sync-token>",
+            ]
+
+        # ---------- REPORT ----------
+
+        def do_REPORT(self):
+            if not self._preamble():
+                return
+            body = self._body()
+            kind, cal, _ = self._route()
+            if kind != "calendar":
+                self._send(404, "Not Found", "text/plain")
+                return
+            try:
+                root = ET.fromstring(body)
+            except ET.ParseError:
+                self._send(400, "Bad Request", "text/plain")
+                return
+
+            if root.tag == CALDAV + "calendar-query":
+                self._calendar_query(cal, root)
+            elif root.tag == CALDAV + "calendar-multiget":
+                self._multiget(cal, root)
+            elif root.tag == DAV + "sync-collection":
+                self._sync_collection(cal, root)
+            elif root.tag == CALDAV + "free-busy-query" and server.free_busy:
+                self._free_busy(cal, root)
+            else:
+                self._send(403, '<?xml version="1.0"?><error xmlns="DAV:"><supported-report/></error>')
+
+        def _wants_data(self, root):
+            """
+            None if calendar-data wasn't asked for, else a dict describing the
+            partial retrieval: {"props": VEVENT property names or None,
+            "expand": (start, end) or None}
+            """
+            prop = root.find(DAV + "prop")
+            elem = prop.find(CALDAV + "calendar-data") if prop is not None else None
+            if elem is None:
+                return None
+            spec = {"props": None, "expand": None}
+            if server.ignore_partial:
+                return spec
+            expand = elem.find(CALDAV + "expand")
+            if expand is not None:
+                spec["expand"] = (to_utc(parse_datetime(expand.get("start"))),
+                                  to_utc(parse_datetime(expand.get("end"))))
+            for comp in elem.iter(CALDAV + "comp"):
+                if comp.get("name", "").upper() == "VEVENT" and comp.find(CALDAV + "allprop") is None:
+                    spec["props"] = {p.get("name", "").upper() for p in comp.findall(CALDAV + "prop")}
+            return spec
+
+        def _resource_response(self, cal, name, res, spec):
+            props = [f"<getetag>{escape(res['etag'])}</getetag>"]
+            if spec is not None:
+                ics = res["ics"]
+                if spec["expand"] is not None and res["recurring"]:
+                    ics = _expand(ics, *spec["expand"])
+                if spec["props"] is not None:
+                    ics = _project(ics, spec["props"])
+                props.append(f"<C:calendar-data>{escape(ics)}</C:calendar-data>")
+            return _response(self._href("calendars", cal.calendar_id, name), props)
+
+        def _time_range(self, root):
+            elem = root.find(f".//{CALDAV}time-range")
+            if elem is None:
+                return None, None
+            start = elem.get("start")
+            end = elem.get("end")
+            return (to_utc(parse_datetime(start)) if start else None,
+                    to_utc(parse_datetime(end)) if end else None)
+
+        def _matches(self, res, start, end):
+            if start is None and end is None:
+                return True
+            if res["recurring"]:
+                return next(iter_occurrences(res["ics"], start, end), None) is not None
+            start_ts = start.timestamp() if start else float("-inf")
+            end_ts = end.timestamp() if end else float("inf")
+            if res["end"] > res["start"]:
+                return res["start"] < end_ts and res["end"] > start_ts
+            return start_ts <= res["start"] < end_ts
+
+        def _uid_filter(self, root):
+            """UID of a <prop-filter name="UID"><text-match> (exact match only), or None"""
+            for elem in root.iter(CALDAV + "prop-filter"):
+                if elem.get("name", "").upper() == "UID":
+                    match = elem.find(CALDAV + "text-match")
+                    if match is not None:
+                        return (match.text or "").strip()
+            return None
+
+        def _calendar_query(self, cal, root):
+            start, end = self._time_range(root)
+            uid = self._uid_filter(root)
+            spec = self._wants_data(root)
+            with cal.lock:
+                items = list(cal.resources.items())
+            responses = [self._resource_response(cal, name, res, spec)
+                         for name, res in items
+                         if self._matches(res, start, end) and (uid is None or ics_uid(res["ics"]) == uid)]
+            self._send(207, _multistatus(responses))
+
+        def _multiget(self, cal, root):
+            spec = self._wants_data(root)
+            responses = []
+            for href_elem in root.findall(DAV + "href"):
+                href = (href_elem.text or "").strip()
+                name = unquote(href.rstrip("/").split("/")[-1])
+                res = cal.resources.get(name)
+                if res is None:
+                    responses.append(f"<response><href>{escape(href)}</href>"
+                                     f"<status>HTTP/1.1 404 Not Found</status></response>")
+                else:
+                    responses.append(self._resource_response(cal, name, res, spec))
+            self._send(207, _multistatus(responses))
+
+        def _sync_collection(self, cal, root):
+            token_elem = root.find(DAV + "sync-token")
+            token = (token_elem.text or "").strip() if token_elem is not None else ""
+            spec = self._wants_data(root)
+            with cal.lock:
+                seq = cal.seq
+                if not token:
+                    changed = {name: False for name in cal.resources}
+                else:
+                    if not token.isdigit() or int(token) > seq:
+                        self._send(403, '<?xml version="1.0"?><error xmlns="DAV:"><valid-sync-token/></error>')
+                        return
+                    changed = {}
+                    for change_seq, name, deleted in cal.changes:
+                        if change_seq > int(token):
+                            changed[name] = deleted
+                resources = dict(cal.resources)
+            responses = []
+            for name, deleted in changed.items():
+                res = resources.get(name)
+                if deleted or res is None:
+                    responses.append(f"<response><href>{escape(self._href('calendars', cal.calendar_id, name))}"
+                                     f"</href><status>HTTP/1.1 404 Not Found</status></response>")
+                else:
+                    responses.append(self._resource_response(cal, name, res, spec))
+            self._send(207, _multistatus(responses, sync_token=str(seq)))
+
+        def _free_busy(self, cal, root):
+            start, end = self._time_range(root)
+            periods = []
+            with cal.lock:
+                items = list(cal.resources.values())
+            for res in items:
+                for occ in iter_occurrences(res["ics"], start, end):
+                    if (occ.get("transp") or "").upper() == "TRANSPARENT":
+                        continue
+                    s, e = to_utc(occ["start"]), to_utc(occ["end"])
+                    if e > s:
+                        periods.append((s, e))
+            periods.sort()
+            lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Local CalDAV Stand-in//EN",
+                     "BEGIN:VFREEBUSY"]
+            for s, e in periods:
+                lines.append(f"FREEBUSY;FBTYPE=BUSY:{s:%Y%m%dT%H%M%SZ}/{e:%Y%m%dT%H%M%SZ}")
+            lines += ["END:VFREEBUSY", "END:VCALENDAR"]
+            self._send(200, "\r\n".join(lines) + "\r\n", "text/calendar; charset=utf-8")
+
+        # ---------- GET / PUT / DELETE ----------
+
+        def do_GET(self):
+            if not self._preamble():
+                return
+            kind, cal, name = self._route()
+            res = cal.resources.get(name) if kind == "resource" else None
+            if res is None:
+                self._send(404, "Not Found", "text/plain")
+                return
+            self._send(200, res["ics"], "text/calendar; charset=utf-8", {"ETag": res["etag"]})
+
+        def do_PUT(self):
+            if not self._preamble():
+                return
+            body = self._body()
+            kind, cal, name = self._route()
+            if kind != "resource":
+                self._send(404, "Not Found", "text/plain")
+                return
+            if not cal.writable:
+                self._send(403, "Forbidden", "text/plain")
+                return
+            ics = body.decode("utf-8", errors="replace")
+            if "BEGIN:VCALENDAR" not in ics:
+                self._send(400, "Bad Request", "text/plain")
+                return
+            current = cal.resources.get(name)
+            if self.headers.get("If-None-Match") == "*" and current is not None:
+                self._send(412, "Precondition Failed", "text/plain")
+                return
+            if_match = self.headers.get("If-Match")
+            if if_match and (current is None or if_match != current["etag"]):
+                self._send(412, "Precondition Failed", "text/plain")
+                return
+            existed = cal.put(name, ics)
+            self._send(204 if existed else 201, "", "text/plain",
+                       {"ETag": cal.resources[name]["etag"]})
+
+        def do_DELETE(self):
+            if not self._preamble():
+                return
+            self._body()
+            kind, cal, name = self._route()
+            if kind != "resource":
+                self._send(404, "Not Found", "text/plain")
+                return
+            if not cal.writable:
+                self._send(403, "Forbidden", "text/plain")
+                return
+            current = cal.resources.get(name)
+            if_match = self.headers.get("If-Match")
+            if current is not None and if_match and if_match != current["etag"]:
+                self._send(412, "Precondition Failed", "text/plain")
+                return
+            self._send(204 if cal.delete(name) else 404, "", "text/plain")
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local iCloud-like CalDAV stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8843)
+    parser.add_argument("--calendars", type=int, default=2, help="synthetic calendars (default: 2)")
+    parser.add_argument("--events", type=int, default=200, help="events per calendar (default: 200)")
+    parser.add_argument("--read-only", type=int, default=0,
+                        help="how many calendars reject writes with 403 (default: 0)")
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in ms")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="requests/second before throttling (default: unlimited)")
+    parser.add_argument("--throttle-status", type=int, default=403,
+                        help="status sent when throttled (default: 403, like iCloud)")
+    parser.add_argument("--ignore-partial", action="store_true",
+                        help="ignore calendar-data partial retrieval and expand requests")
+    parser.add_argument("--no-free-busy", action="store_true",
+                        help="reject free-busy-query REPORTs with 403 DAV:supported-report")
+    parser.add_argument("--gzip", action="store_true",
+                        help="gzip response bodies when the client accepts it")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="simulated link speed in Mbit/s (default: unlimited)")
+    args = parser.parse_args()
+
+    server = LocalCalDAVServer(
+        host=args.host, port=args.port, calendars=args.calendars,
+        events_per_calendar=args.events, read_only_calendars=args.read_only,
+        latency_ms=args.latency, jitter_ms=args.jitter, rate_limit=args.rate,
+        throttle_status=args.throttle_status, ignore_partial=args.ignore_partial,
+        free_busy=not args.no_free_busy, compress=args.gzip, bandwidth_mbit=args.bandwidth)
+
+    print("Local CalDAV stand-in server")
+    print("=" * 60)
+    print(f"URL:       {server.base_url}")
+    print(f"EMAIL:     {server.email}")
+    print(f"PASSWORD:  {server.password}")
+    print(f"USER_ID:   {server.user_id}")
+    for cal in server.calendars.values():
+        mode = "writable" if cal.writable else "read-only"
+        print(f"CALENDAR:  {cal.calendar_id}  ({len(cal.resources)} events, {mode})")
+    print("=" * 60)
+    print(f"\nRun the scripts against it with CALDAV_BASE_URL={server.base_url}")
+    print("Press Ctrl+C to stop.")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+iCloud CalDAV - Multi-Account Runner
+Run discovery / read / write jobs for many Apple IDs in one process
+
+Accounts are processed on a pool of worker threads (or processes), so the
+interpreter starts once, connection pools and discovery caches are reused,
+and one failing account never affects the others. Each result is printed
+as one JSON line as soon as it is ready.
+
+Accounts file (.json list, .jsonl or .csv with the same columns):
+    [
+      {"name": "anna", "email": "anna@example.com", "password_env": "ANNA_PW",
+       "calendars": {"work": "CALENDAR_ID"}},
+      {"email": "ben@example.com", "password": "xxxx-xxxx-xxxx-xxxx"}
+    ]
+
+"password_env" names an environment variable holding the app-specific
+password. Without "calendars", the account's calendars are discovered.
+The file is given with --accounts, or CALDAV_ACCOUNTS (path) or
+CALDAV_ACCOUNTS_JSON (the JSON itself) in the environment.
+
+Usage:
+    python3 multi_account.py discover --accounts staff.json
+    python3 multi_account.py read --date 2024-01-15 --days 7 --workers 16
+    python3 multi_account.py write --events shifts.jsonl --calendar work -o results.jsonl
+
+For write, events with an "account" field (name or email) go to that account
+only; the others go to every account.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import instrumentation
+from bulk_write import load_events, write_events
+from calendar_read import EXPAND, SUMMARY_PROPS, calendar_path, read_calendars
+from discovery import account_client, discover
+
+# Accounts processed at the same time
+DEFAULT_WORKERS = 8
+# PUTs in flight per account during write jobs
+DEFAULT_WRITE_CONCURRENCY = 4
+
+UTC = datetime.timezone.utc
+JOBS = ["discover", "read", "write"]
+
+
+class AccountError(ValueError):
+    """Raised for an invalid accounts file entry"""
+
+
+def load_accounts(path=None):
+    """
+    Read account entries from path, CALDAV_ACCOUNTS or CALDAV_ACCOUNTS_JSON
+
+    Returns a list of {"name", "email", "password", "calendars"} dicts.
+    """
+    path = path or os.environ.get("CALDAV_ACCOUNTS")
+    if path:
+        if path.endswith(".csv"):
+            with open(path, newline="", encoding="utf-8") as f:
+                entries = list(csv.DictReader(f))
+        elif path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+    elif os.environ.get("CALDAV_ACCOUNTS_JSON"):
+        entries = json.loads(os.environ["CALDAV_ACCOUNTS_JSON"])
+    else:
+        raise AccountError("No accounts: use --accounts, CALDAV_ACCOUNTS or CALDAV_ACCOUNTS_JSON")
+
+    if isinstance(entries, dict):
+        entries = entries.get("accounts", [])
+    accounts = []
+    for number, entry in enumerate(entries, 1):
+        email = (entry.get("email") or "").strip()
+        if not email:
+            raise AccountError(f"Account #{number}: missing email")
+        password = entry.get("password") or ""
+        if entry.get("password_env"):
+            password = os.environ.get(entry["password_env"], "")
+        if not password:
+            raise AccountError(f"Account #{number} ({email}): no password")
+        calendars = entry.get("calendars") or {}
+        if isinstance(calendars, str):
+            # CSV: "work=ID1;home=ID2"
+            calendars = dict(part.split("=", 1) for part in calendars.split(";") if "=" in part)
+        accounts.append({
+            "name": entry.get("name") or email,
+            "email": email,
+            "password": password,
+            "calendars": calendars,
+        })
+    return accounts
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _account_calendars(account, info):
+    """Configured calendars, else the discovered ones (name -> id)"""
+    if account["calendars"]:
+        return dict(account["calendars"])
+    return {cal["name"]: cal["id"] for cal in info["calendars"]}
+
+
+def run_discover(account, info, options):
+    return [{"user_id": info["user_id"], "host": info["host"],
+             "calendars": [{"name": c["name"], "id": c["id"]} for c in info["calendars"]]}]
+
+
+def run_read(account, info, options):
+    calendars = _account_calendars(account, info)
+    if options.get("calendar"):
+        calendars = {k: v for k, v in calendars.items() if k == options["calendar"]}
+        if not calendars:
+            raise AccountError(f"calendar {options['calendar']!r} not found")
+    client = account_client(account["email"], account["password"])
+    window_start = options["window_start"]
+    window_end = options["window_end"]
+    timeline, errors = read_calendars(client, info["user_id"], calendars, window_start, window_end,
+                                      props=SUMMARY_PROPS, recurrence=EXPAND)
+    events = [{"calendar": occ["calendar"], "title": occ["title"], "start": occ["start"],
+               "end": occ["end"], "all_day": occ["all_day"]} for occ in timeline]
+    result = {"events": events}
+    if errors:
+        result["errors"] = {name: str(e) for name, e in errors.items()}
+        result["ok"] = len(errors) < len(calendars)
+    return [result]
+
+
+def run_write(account, info, options):
+    calendars = _account_calendars(account, info)
+    name = options.get("calendar") or next(iter(calendars), None)
+    if name not in calendars:
+        raise AccountError(f"calendar {name!r} not found")
+    events = [e for e in options["events"]
+              if not e.get("account") or e["account"] in (account["name"], account["email"])]
+    client = account_client(account["email"], account["password"],
+                            pool_maxsize=max(options["write_concurrency"], 4))
+    results = []
+    for result in write_events(client, calendar_path(info["user_id"], calendars[name]),
+                               events, concurrency=options["write_concurrency"]):
+        result["calendar"] = name
+        result["ok"] = result["status"] in ("created", "exists")
+        results.append(result)
+    results.sort(key=lambda r: r["index"])
+    return results
+
+
+RUNNERS = {"discover": run_discover, "read": run_read, "write": run_write}
+
+
+def run_account(account, job, options):
+    """
+    Run one job for one account; never raises
+
+    Returns a list of result dicts, one per line of output.
+    """
+    base = {"account": account["name"], "job": job}
+    started = time.perf_counter()
+    try:
+        info = discover(account["email"], account["password"],
+                        revalidate=options.get("revalidate", True))
+        results = RUNNERS[job](account, info, options)
+    except Exception as e:
+        status = getattr(e, "status_code", None)
+        results = [{"ok": False, "error": str(e), "http_status": status}]
+    elapsed = round(time.perf_counter() - started, 3)
+    lines = []
+    for result in results:
+        line = dict(base)
+        line["ok"] = result.pop("ok", True)
+        line.update(result)
+        line.setdefault("elapsed", elapsed)
+        lines.append(line)
+    return lines
+
+
+def run_accounts(accounts, job, options, workers=DEFAULT_WORKERS, processes=False):
+    """
+    Run a job for every account on a bounded pool
+
+    Yields result dicts as accounts finish. With processes=True each worker is
+    a process (for CPU-heavy parsing across many accounts); it still handles
+    many accounts, so interpreter startup is paid once per worker.
+    """
+    pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool_class(max_workers=max(1, min(workers, len(accounts)))) as pool:
+        futures = [pool.submit(run_account, account, job, options) for account in accounts]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run CalDAV jobs for many iCloud accounts")
+    parser.add_argument("job", choices=JOBS)
+    parser.add_argument("--accounts", metavar="FILE",
+                        help="accounts file (.json, .jsonl, .csv); default: $CALDAV_ACCOUNTS")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"accounts processed at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--processes", action="store_true",
+                        help="use worker processes instead of threads")
+    parser.add_argument("--no-revalidate", action="store_true",
+                        help="trust cached discovery without the ctag check")
+    parser.add_argument("--date", help="first day for read (YYYY-MM-DD, default: today)")
+    parser.add_argument("--days", type=int, default=1, help="days to read (default: 1)")
+    parser.add_argument("--calendar", help="calendar name to read from / write to")
+    parser.add_argument("--events", metavar="FILE", help="events to write (.csv, .json, .jsonl)")
+    parser.add_argument("--write-concurrency", type=int, default=DEFAULT_WRITE_CONCURRENCY,
+                        help=f"PUTs in flight per account (default: {DEFAULT_WRITE_CONCURRENCY})")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write JSON lines here (default: stdout)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+
+    try:
+        accounts = load_accounts(args.accounts)
+    except (AccountError, OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        raise SystemExit(2)
+
+    first_day = datetime.date.fromisoformat(args.date) if args.date else datetime.date.today()
+    window_start = datetime.datetime.combine(first_day, datetime.time(), tzinfo=UTC)
+    options = {
+        "revalidate": not args.no_revalidate,
+        "calendar": args.calendar,
+        "window_start": window_start,
+        "window_end": window_start + datetime.timedelta(days=args.days),
+        "write_concurrency": args.write_concurrency,
+    }
+    if args.job == "write":
+        if not args.events:
+            print("ERROR: write needs --events FILE", file=sys.stderr)
+            raise SystemExit(2)
+        options["events"] = list(load_events(args.events))
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    failed = total = 0
+    started = time.perf_counter()
+    try:
+        for result in run_accounts(accounts, args.job, options, args.workers, args.processes):
+            output.write(json.dumps(result, default=_json_default, ensure_ascii=False) + "\n")
+            output.flush()
+            total += 1
+            if not result["ok"]:
+                failed += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"{len(accounts)} account(s), {total} result(s), {failed} failed "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Streaming WebDAV multistatus parser
+
+Parses 207 Multi-Status bodies incrementally with ElementTree's pull parser
+(the non-blocking form of iterparse), so a multi-megabyte REPORT response is
+consumed chunk by chunk from response.iter_content() and each <response> is
+yielded and discarded as soon as it is complete. Matching is done on
+namespace URIs, so <response>, <d:response> and <D:response> all work.
+
+Usage:
+    from multistatus import iter_calendars, response_chunks
+
+    response = client.propfind(path, depth="1", stream=True)
+    for calendar in iter_calendars(response_chunks(response)):
+        print(calendar["name"], calendar["id"])
+"""
+
+import time
+import xml.etree.ElementTree as ET
+
+from instrumentation import recorder
+
+DAV_NS = "DAV:"
+CALDAV_NS = "urn:ietf:params:xml:ns:caldav"
+APPLE_ICAL_NS = "http://apple.com/ns/ical/"
+CALSERVER_NS = "http://calendarserver.org/ns/"
+
+CHUNK_SIZE = 64 * 1024
+
+# Collections under /calendars/ that are not real calendars
+SYSTEM_FOLDERS = ["inbox", "outbox", "notification", "tasks"]
+
+_RESPONSE = f"{{{DAV_NS}}}response"
+_HREF = f"{{{DAV_NS}}}href"
+_STATUS = f"{{{DAV_NS}}}status"
+_PROPSTAT = f"{{{DAV_NS}}}propstat"
+_PROP = f"{{{DAV_NS}}}prop"
+_SYNC_TOKEN = f"{{{DAV_NS}}}sync-token"
+
+
+def local_name(tag):
+    """'{DAV:}displayname' -> 'displayname'"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def response_chunks(response, chunk_size=CHUNK_SIZE, head=None, head_limit=CHUNK_SIZE):
+    """
+    Yield raw body chunks from a (preferably stream=True) requests response
+
+    If head is a bytearray, the first head_limit bytes are copied into it so
+    callers can still show a raw preview after the body has been consumed.
+    With instrumentation enabled, the time spent reading vs. parsing the
+    body is recorded once it has been consumed.
+    """
+    event = getattr(response, "profile", None)
+    if event is not None:
+        return _ProfiledChunks(response, chunk_size, head, head_limit, event)
+    return _iter_chunks(response, chunk_size, head, head_limit)
+
+
+def _iter_chunks(response, chunk_size, head, head_limit):
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if not chunk:
+            continue
+        if head is not None and len(head) < head_limit:
+            head.extend(chunk[:head_limit - len(head)])
+        yield chunk
+
+
+class _ProfiledChunks:
+    """response_chunks() that times network reads and counts parsed resources"""
+
+    def __init__(self, response, chunk_size, head, head_limit, event):
+        self.chunks = _iter_chunks(response, chunk_size, head, head_limit)
+        self.event = event
+        self.resources = 0
+
+    def __iter__(self):
+        download = 0.0
+        size = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                chunk = next(self.chunks, None)
+                download += time.perf_counter() - t0
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+        finally:
+            parse = time.perf_counter() - started - download
+            recorder.end_body(self.event, download, parse, size, self.resources)
+
+
+def _prop_value(elem):
+    """
+    Text for leaf properties, the href for href-valued ones
+    (current-user-principal, calendar-home-set), and a list of child
+    names for other structured ones (resourcetype)
+    """
+    children = list(elem)
+    if children:
+        if all(child.tag == _HREF for child in children):
+            return (children[0].text or "").strip()
+        return [local_name(child.tag) for child in children]
+    return (elem.text or "").strip()
+
+
+def _status_ok(status_text):
+    # "HTTP/1.1 200 OK" -> ok; a missing status is treated as success
+    if not status_text:
+        return True
+    parts = status_text.split()
+    return len(parts) >= 2 and parts[1].startswith("2")
+
+
+def status_code(status_line):
+    """'HTTP/1.1 404 Not Found' -> 404 (None if missing)"""
+    if not status_line:
+        return None
+    parts = status_line.split()
+    if len(parts) >= 2 and parts[1].isdigit():
+        return int(parts[1])
+    return None
+
+
+def _build_record(elem):
+    href_elem = elem.find(_HREF)
+    record = {
+        "href": (href_elem.text or "").strip() if href_elem is not None else "",
+        "status": None,
+        "props": {},
+    }
+    status_elem = elem.find(_STATUS)
+    if status_elem is not None:
+        record["status"] = (status_elem.text or "").strip()
+
+    for propstat in elem.findall(_PROPSTAT):
+        status_elem = propstat.find(_STATUS)
+        if not _status_ok(status_elem.text if status_elem is not None else None):
+            continue
+        prop = propstat.find(_PROP)
+        if prop is None:
+            continue
+        for child in prop:
+            record["props"][local_name(child.tag)] = _prop_value(child)
+    return record
+
+
+def iter_responses(chunks, meta=None):
+    """
+    Yield one record per <DAV:response> as soon as it has been parsed
+
+    Each record is a dict: {"href", "status", "props"} where props maps the
+    local name of every successfully returned property to its text (or to a
+    list of child element names, e.g. resourcetype -> ["collection", "calendar"]).
+
+    chunks may be an iterable of bytes/str, or a single bytes/str body.
+    If meta is a dict, the top-level <sync-token> (RFC 6578) is stored in
+    meta["sync_token"] once the body has been consumed.
+    """
+    if isinstance(chunks, (bytes, str)):
+        chunks = [chunks]
+    profiled = chunks if isinstance(chunks, _ProfiledChunks) else None
+
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    depth = 0
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = elem
+                continue
+            depth -= 1
+            if depth == 1 and elem.tag == _SYNC_TOKEN and meta is not None:
+                meta["sync_token"] = (elem.text or "").strip()
+                continue
+            if elem.tag != _RESPONSE:
+                continue
+            if profiled is not None:
+                profiled.resources += 1
+            yield _build_record(elem)
+            # Drop the finished <response> so memory stays flat
+            elem.clear()
+            if root is not None and root is not elem:
+                try:
+                    root.remove(elem)
+                except ValueError:
+                    pass
+
+    parser.close()
+
+
+def calendar_id_from_href(href):
+    """
+    Return the CALENDAR_ID for a calendar collection href, or None
+
+    Only actual calendars under /calendars/ count; the home collection and
+    system folders (inbox, outbox, ...) are skipped.
+    """
+    if "/calendars/" not in href or href.count("/") < 4:
+        return None
+    calendar_id = href.split("/calendars/")[-1].rstrip("/")
+    if not calendar_id or calendar_id in SYSTEM_FOLDERS:
+        return None
+    return calendar_id
+
+
+def iter_calendars(chunks):
+    """
+    Yield {"name", "id", "color", "href"} for every calendar in a PROPFIND
+    Depth: 1 response on /{USER_ID}/calendars/
+    """
+    for record in iter_responses(chunks):
+        calendar_id = calendar_id_from_href(record["href"])
+        if calendar_id is None:
+            continue
+        props = record["props"]
+        yield {
+            "name": props.get("displayname") or "Unnamed",
+            "id": calendar_id,
+            "color": props.get("calendar-color") or "",
+            "href": record["href"],
+            "ctag": props.get("getctag") or "",
+            "sync_token": props.get("sync-token") or "",
+        }
+
+
+def iter_calendar_data(chunks):
+    """
+    Yield {"href", "etag", "calendar_data"} for every resource in a
+    calendar-query / calendar-multiget REPORT response
+    """
+    for record in iter_responses(chunks):
+        props = record["props"]
+        data = props.get("calendar-data")
+        if not data and "getetag" not in props:
+            continue
+        yield {
+            "href": record["href"],
+            "etag": props.get("getetag", ""),
+            "calendar_data": data or "",
+        }
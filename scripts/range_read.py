@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Windowed range reads for long date spans
+
+One calendar-query over a quarter or a year makes iCloud slow to answer
+(sometimes until the request times out) and returns one huge body.
+read_range() splits the span into consecutive time windows and fetches them
+concurrently:
+
+- The first window is short, so the first results arrive quickly; later
+  windows are sized from the event density seen so far (about
+  TARGET_PER_WINDOW occurrences each).
+- Results are yielded in start order as soon as every earlier window is done.
+- Each occurrence is emitted by the window its start falls in, and a
+  UID + RECURRENCE-ID key drops anything seen twice, so events spanning a
+  window boundary and recurring series appear once.
+- A failed window is retried on its own, split in half when it is longer than
+  a day (a timeout usually means the window was too big).
+
+Usage:
+    from range_read import read_range
+
+    for occ in read_range(client, path, year_start, year_end, props=SUMMARY_PROPS):
+        print(occ["start"], occ["title"])
+"""
+
+import datetime
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from calendar_read import ReadError, fetch_occurrences, occurrence_key
+from ics_parser import to_utc
+
+# Spans longer than this are read in windows by fetch_range() (days)
+SPLIT_THRESHOLD_DAYS = 31
+# Size of the first window, and the bounds for the adaptive ones (days)
+INITIAL_WINDOW_DAYS = 7
+MIN_WINDOW_DAYS = 1
+MAX_WINDOW_DAYS = 92
+# Occurrences aimed for per window once the density is known
+TARGET_PER_WINDOW = 500
+# Weight of the latest window in the density estimate
+DENSITY_SMOOTHING = 0.5
+# Windows in flight at once
+DEFAULT_CONCURRENCY = 4
+# Tries per window (each retry after the first failure splits the window)
+WINDOW_ATTEMPTS = 3
+# Pause before retrying a window (seconds, times the attempt number)
+RETRY_DELAY = 1.0
+
+
+def occurrence_id(occ):
+    """Dedup key: UID + RECURRENCE-ID (start for single events without one)"""
+    recurrence_id = occ.get("recurrence_id")
+    return occ["uid"], to_utc(recurrence_id if recurrence_id is not None else occ["start"])
+
+
+class WindowPlanner:
+    """Hands out consecutive windows sized from the density seen so far"""
+
+    def __init__(self, window_start, window_end, initial_days=INITIAL_WINDOW_DAYS,
+                 target=TARGET_PER_WINDOW):
+        self.next_start = window_start
+        self.window_end = window_end
+        self.initial_days = initial_days
+        self.target = target
+        self.density = None     # occurrences per day
+
+    def observe(self, window_start, window_end, count):
+        days = max((window_end - window_start).total_seconds() / 86400, 1 / 24)
+        density = count / days
+        if self.density is None:
+            self.density = density
+        else:
+            self.density += DENSITY_SMOOTHING * (density - self.density)
+
+    def next_window(self):
+        """(start, end) of the next window, or None when the span is covered"""
+        if self.next_start >= self.window_end:
+            return None
+        if self.density is None:
+            days = self.initial_days
+        else:
+            days = self.target / self.density if self.density > 0 else MAX_WINDOW_DAYS
+            days = min(MAX_WINDOW_DAYS, max(MIN_WINDOW_DAYS, days))
+        # Whole hours, so the boundaries survive the second-precision time-range
+        hours = max(1, round(days * 24))
+        start = self.next_start
+        end = min(self.window_end, start + datetime.timedelta(hours=hours))
+        self.next_start = end
+        return start, end
+
+
+def _owned(occurrences, window_start, window_end, first):
+    """Occurrences starting in [window_start, window_end) (or earlier for the first window)"""
+    return [occ for occ in occurrences
+            if (first or occurrence_key(occ) >= window_start)
+            and occurrence_key(occ) < window_end]
+
+
+def fetch_window(client, path, window_start, window_end, props=None, recurrence=None,
+                 attempts=WINDOW_ATTEMPTS, stats=None):
+    """
+    fetch_occurrences() for one window, retried on failure
+
+    After a failure the window is split in half (down to MIN_WINDOW_DAYS) and
+    each half retried on its own. Returns occurrences sorted by start. If
+    stats is a dict its "retries" count is increased; it isn't locked, so give
+    each concurrent call its own.
+    """
+    try:
+        return fetch_occurrences(client, path, window_start, window_end, props, recurrence)
+    except (ReadError, requests.exceptions.RequestException):
+        if attempts <= 1:
+            raise
+    if stats is not None:
+        stats["retries"] = stats.get("retries", 0) + 1
+    time.sleep(RETRY_DELAY * (WINDOW_ATTEMPTS - attempts + 1))
+
+    if window_end - window_start < datetime.timedelta(days=2 * MIN_WINDOW_DAYS):
+        return fetch_window(client, path, window_start, window_end, props, recurrence,
+                            attempts - 1, stats)
+    middle = window_start + (window_end - window_start) / 2
+    middle = middle.replace(minute=0, second=0, microsecond=0)
+    left = fetch_window(client, path, window_start, middle, props, recurrence,
+                        attempts - 1, stats)
+    right = fetch_window(client, path, middle, window_end, props, recurrence,
+                         attempts - 1, stats)
+    # right repeats what starts in the left half and runs into the right one
+    right = [occ for occ in right if occurrence_key(occ) >= middle]
+    return list(heapq.merge(left, right, key=occurrence_key))
+
+
+def read_range(client, path, window_start, window_end, props=None, recurrence=None,
+               concurrency=DEFAULT_CONCURRENCY, stats=None):
+    """
+    Yield the occurrences of [window_start, window_end) in start order,
+    fetched in adaptive windows with up to `concurrency` REPORTs in flight
+
+    props / recurrence are passed on to fetch_occurrences(). If stats is a
+    dict it receives "windows", "retries" and "occurrences" counts. A window
+    that still fails after its retries raises its error once every earlier
+    window has been yielded.
+    """
+    if stats is not None:
+        stats.update({"windows": 0, "retries": 0, "occurrences": 0})
+    window_start = to_utc(window_start)
+    window_end = to_utc(window_end)
+    planner = WindowPlanner(window_start, window_end)
+    seen = set()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    in_flight = []      # (window_start, window_end, window stats, future), in window order
+    first = True
+    try:
+        while True:
+            while len(in_flight) < concurrency:
+                window = planner.next_window()
+                if window is None:
+                    break
+                # Each window counts its own retries; they're added up below
+                window_stats = {"retries": 0}
+                in_flight.append(window + (window_stats, pool.submit(
+                    fetch_window, client, path, window[0], window[1], props, recurrence,
+                    WINDOW_ATTEMPTS, window_stats)))
+                if planner.density is None:
+                    # Size the rest from the first window's result
+                    break
+            if not in_flight:
+                return
+
+            start, end, window_stats, future = in_flight.pop(0)
+            occurrences = future.result()
+            planner.observe(start, end, len(occurrences))
+            if stats is not None:
+                stats["windows"] += 1
+                stats["retries"] += window_stats["retries"]
+            for occ in _owned(occurrences, start, end, first):
+                key = occurrence_id(occ)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if stats is not None:
+                    stats["occurrences"] += 1
+                yield occ
+            first = False
+    finally:
+        for _, _, _, future in in_flight:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def fetch_range(client, path, window_start, window_end, props=None, recurrence=None):
+    """
+    Drop-in for fetch_occurrences(): one REPORT for short spans, read_range()
+    for spans longer than SPLIT_THRESHOLD_DAYS. Returns a sorted list.
+    """
+    if window_end - window_start <= datetime.timedelta(days=SPLIT_THRESHOLD_DAYS):
+        return fetch_occurrences(client, path, window_start, window_end, props, recurrence)
+    return list(read_range(client, path, window_start, window_end, props, recurrence))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Read-through cache for calendar-query results
+
+Keyed on (account, calendar path, time range). Concurrent identical reads
+are coalesced ("single flight"): the first caller runs the REPORT, the others
+wait for its result instead of sending their own. Entries expire after a TTL
+and the least recently used ones are evicted once the estimated size of all
+cached occurrences exceeds a memory cap.
+
+Every PUT/DELETE sent through a CalDAVClient that isn't rejected with a 4xx
+invalidates the cached ranges of the calendar it wrote to, so a read after a
+write never sees stale data (see caldav_client.add_write_listener).
+
+Usage:
+    from read_cache import cached_occurrences
+
+    occurrences = cached_occurrences(client, calendar_path, window_start, window_end)
+
+The returned list is shared with other callers; treat it as read-only.
+"""
+
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from caldav_client import add_write_listener, collection_path
+from range_read import fetch_range
+
+# Cached results are served for this long (seconds)
+DEFAULT_TTL = 60
+# Upper bound for the estimated size of all cached occurrences (bytes)
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# Rough per-occurrence overhead: dict + datetimes, on top of its strings
+OCCURRENCE_OVERHEAD = 600
+
+
+def occurrences_size(occurrences):
+    """Estimated memory used by a list of occurrence dicts (bytes)"""
+    size = sys.getsizeof(occurrences)
+    for occ in occurrences:
+        size += OCCURRENCE_OVERHEAD
+        for value in occ.values():
+            if isinstance(value, str):
+                size += len(value)
+    return size
+
+
+class _Flight:
+    """One in-progress load that other callers can wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReadCache:
+    """
+    Thread-safe LRU cache with TTL, a size cap and single-flight loading
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+        self._entries = OrderedDict()   # key -> (expires, size, value)
+        self._flights = {}              # key -> _Flight
+        self._generation = {}           # (account, calendar) -> write counter
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key):
+        """Cached value (counted as a hit) or None; doesn't load"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.stats["hits"] += 1
+            return value
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+
+    def get_or_load(self, key, loader, size_of=occurrences_size):
+        """
+        Return the cached value for key, or call loader() once to fill it
+
+        key must start with (account, calendar path); writes to that calendar
+        invalidate it. Callers arriving while a load runs wait for its result.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return value
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                owner = True
+                self.stats["misses"] += 1
+                generation = self._generation.get(key[:2], 0)
+            else:
+                owner = False
+                self.stats["coalesced"] += 1
+
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                # A write during the load may have changed the calendar; don't keep it
+                if flight.error is None and self._generation.get(key[:2], 0) == generation:
+                    self._store(key, flight.value, size_of(flight.value))
+            flight.done.set()
+        return flight.value
+
+    def _store(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, account, calendar):
+        """Forget every cached range of one calendar"""
+        scope = (account.lower(), collection_path(calendar))
+        with self._lock:
+            self._generation[scope] = self._generation.get(scope, 0) + 1
+            for key in [k for k in self._entries if k[:2] == scope]:
+                self._drop(key)
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Every live cache, so writes invalidate all of them
+_caches = weakref.WeakSet()
+_shared = ReadCache()
+
+
+def shared_cache():
+    """The process-wide cache used by cached_occurrences() by default"""
+    return _shared
+
+
+def cache_key(client, path, window_start, window_end, props=None, recurrence=None):
+    return (client.email.lower(), collection_path(path),
+            window_start.isoformat(), window_end.isoformat(),
+            tuple(sorted(p.upper() for p in props)) if props else None, recurrence)
+
+
+def cached_occurrences(client, path, window_start, window_end, cache=None,
+                       props=None, recurrence=None):
+    """
+    fetch_occurrences() through the read-through cache
+
+    Spans longer than range_read.SPLIT_THRESHOLD_DAYS are loaded in parallel
+    windows (range_read.fetch_range) instead of one large REPORT.
+    """
+    if cache is None:
+        cache = _shared
+    return cache.get_or_load(
+        cache_key(client, path, window_start, window_end, props, recurrence),
+        lambda: fetch_range(client, path, window_start, window_end, props, recurrence))
+
+
+def _on_write(client, url, response):
+    # A rejected write (4xx) changed nothing; anything else may have
+    if response is not None and 400 <= response.status_code < 500:
+        return
+    for cache in list(_caches):
+        cache.invalidate(client.email, url)
+
+
+add_write_listener(_on_write)
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Local full-text search over events: keyword -> occurrences, no CalDAV traffic
+
+Answering "when is my dentist appointment?" used to mean reading a wide date
+range and scanning every title. SearchIndex keeps an inverted index from the
+words of SUMMARY, LOCATION, DESCRIPTION and the attendees (name and address)
+to events, plus the start/end of each event's occurrences, so a lookup is a
+few dict and bisect operations however many years are indexed.
+
+Words are case-folded and stripped of accents ("Zoë" matches "zoe"); every
+query word must match, by default as a prefix ("dent" finds "Dentist").
+
+The index fills itself as events pass through the scripts:
+
+- every calendar-query read (calendar_read.fetch_occurrences) replaces what
+  it knows about that calendar within the read window, so events deleted
+  elsewhere drop out too;
+- every sync-collection run (calendar_sync.sync_calendar) indexes the
+  changed resources and drops the deleted ones;
+- every successful PUT/DELETE through a CalDAVClient indexes or removes the
+  written event (write listener).
+
+`icloud-caldav index --years-back 5` reads a long span once to seed it. The
+shared index lives in CACHE_DIR/search/index.json; it is loaded on first use
+and saved at most every AUTOSAVE_INTERVAL seconds and at exit.
+
+Usage:
+    from search_index import shared_index
+
+    for hit in shared_index().search("dentist", start=today):
+        print(hit["start"], hit["title"], hit["location"])
+"""
+
+import atexit
+import bisect
+import datetime
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from urllib.parse import urlsplit
+
+from caldav_client import CACHE_DIR, add_write_listener, collection_path
+from ics_parser import DEFAULT_EXPANSION_HORIZON, UTC, iter_occurrences, to_utc
+
+DEFAULT_INDEX_PATH = os.path.join(CACHE_DIR, "search", "index.json")
+# Bump when the saved layout changes; older files are ignored
+INDEX_VERSION = 1
+# Dirty indexes are written back at most this often (seconds)
+AUTOSAVE_INTERVAL = 60
+
+# Indexed fields; a query can be limited to some of them
+FIELDS = ["title", "location", "description", "attendees"]
+# VEVENT property that fills each field (for partial calendar-data)
+FIELD_PROPS = {"title": "SUMMARY", "location": "LOCATION", "description": "DESCRIPTION",
+               "attendees": "ATTENDEE"}
+
+_FIELD_BITS = {field: 1 << i for i, field in enumerate(FIELDS)}
+_ALL_FIELDS = (1 << len(FIELDS)) - 1
+_DAY = 86400
+
+_WORD_RE = re.compile(r"\w+")
+_FOLD_RE = re.compile(r"\r?\n[ \t]")
+_ATTENDEE_RE = re.compile(r"^ATTENDEE((?:;[^:\r\n]*)?):(.*?)\r?$", re.MULTILINE)
+_CN_RE = re.compile(r';CN=("[^"]*"|[^;:]*)', re.IGNORECASE)
+
+
+def normalize(text):
+    """Case-fold and strip accents"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _WORD_RE.findall(normalize(text))
+
+
+def ics_attendees(ics):
+    """["Name <address>", ...] from the ATTENDEE lines of an ICS text"""
+    if "ATTENDEE" not in ics:
+        return []
+    attendees = []
+    for params, value in _ATTENDEE_RE.findall(_FOLD_RE.sub("", ics)):
+        address = value.strip()
+        if address.lower().startswith("mailto:"):
+            address = address[7:]
+        match = _CN_RE.search(params)
+        name = match.group(1).strip('"') if match else ""
+        entry = f"{name} <{address}>" if name else address
+        if entry not in attendees:
+            attendees.append(entry)
+    return attendees
+
+
+def index_entry(href, ics, occurrences):
+    """What update_window() needs of one fetched resource (the ICS itself isn't kept)"""
+    return {"href": href, "attendees": ics_attendees(ics or ""), "occurrences": occurrences}
+
+
+def _ts(value):
+    return int(to_utc(value).timestamp())
+
+
+def _href_path(href):
+    return href if href.startswith("/") else urlsplit(href).path
+
+
+class SearchIndex:
+    """
+    Thread-safe inverted index of events keyed by (account, calendar, UID)
+
+    path is where save() writes (and where the index was loaded from); None
+    keeps it in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.docs = {}          # doc id -> event record (see _add_doc)
+        self.postings = {}      # word -> {doc id: field bits}
+        self._ids = {}          # (account, calendar, uid) -> doc id
+        self._hrefs = {}        # (account, href) -> set of doc ids
+        self._days = {}         # (account, calendar) -> {day number: set of doc ids}
+        self._terms = None      # sorted words, for prefix lookups; rebuilt when needed
+        self._next_id = 0
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # ---------- persistence ----------
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        """Index saved at path (an empty one if missing, unreadable or outdated)"""
+        index = cls(path)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") != INDEX_VERSION:
+            return index
+        for record in data.get("docs", []):
+            doc_id = index._add_doc(record["account"], record["calendar"], record["uid"],
+                                    record["href"], record["all_day"])
+            index._set_text(doc_id, record, _ALL_FIELDS)
+            index._replace_occurrences(doc_id, None, None,
+                                       [tuple(pair) for pair in record["occurrences"]])
+        index._dirty = False
+        return index
+
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            data = {"version": INDEX_VERSION, "docs": list(self.docs.values())}
+            text = json.dumps(data, ensure_ascii=False)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def save_if_dirty(self):
+        if self._dirty and self.path:
+            self.save()
+
+    def _autosave(self):
+        if self._dirty and self.path and time.monotonic() - self._saved_at >= AUTOSAVE_INTERVAL:
+            self.save()
+
+    # ---------- documents ----------
+
+    def _add_doc(self, account, calendar, uid, href, all_day):
+        key = (account, calendar, uid)
+        doc_id = self._ids.get(key)
+        if doc_id is None:
+            doc_id = self._ids[key] = self._next_id
+            self._next_id += 1
+            self.docs[doc_id] = {
+                "account": account, "calendar": calendar, "uid": uid, "href": href,
+                "title": "", "location": "", "description": "", "attendees": [],
+                "all_day": all_day, "occurrences": [],
+            }
+            self._hrefs.setdefault((account, href), set()).add(doc_id)
+        doc = self.docs[doc_id]
+        if doc["href"] != href:
+            self._hrefs.get((account, doc["href"]), set()).discard(doc_id)
+            self._hrefs.setdefault((account, href), set()).add(doc_id)
+            doc["href"] = href
+        doc["all_day"] = all_day
+        return doc_id
+
+    def _words(self, doc):
+        """{word: field bits} of a document"""
+        words = {}
+        for field in FIELDS:
+            value = doc[field]
+            text = " ".join(value) if isinstance(value, list) else value
+            for word in tokenize(text):
+                words[word] = words.get(word, 0) | _FIELD_BITS[field]
+        return words
+
+    def _set_text(self, doc_id, values, fields):
+        """Replace the fields whose bits are in `fields` with those in values"""
+        doc = self.docs[doc_id]
+        changed = [f for f in FIELDS if _FIELD_BITS[f] & fields and doc[f] != values[f]]
+        if not changed:
+            return
+        old = self._words(doc)
+        for field in changed:
+            doc[field] = values[field]
+        new = self._words(doc)
+        for word, bits in old.items():
+            if new.get(word) != bits:
+                postings = self.postings[word]
+                del postings[doc_id]
+                if not postings:
+                    del self.postings[word]
+                    self._terms = None
+        for word, bits in new.items():
+            if old.get(word) != bits:
+                if word not in self.postings:
+                    self.postings[word] = {}
+                    self._terms = None
+                self.postings[word][doc_id] = bits
+        self._dirty = True
+
+    def _remove_doc(self, doc_id):
+        doc = self.docs[doc_id]
+        self._set_text(doc_id, {"title": "", "location": "", "description": "",
+                                "attendees": []}, _ALL_FIELDS)
+        days = self._days.get((doc["account"], doc["calendar"]), {})
+        for start, _ in doc["occurrences"]:
+            day = days.get(start // _DAY)
+            if day is not None:
+                day.discard(doc_id)
+                if not day:
+                    del days[start // _DAY]
+        del self._ids[(doc["account"], doc["calendar"], doc["uid"])]
+        self._hrefs.get((doc["account"], doc["href"]), set()).discard(doc_id)
+        del self.docs[doc_id]
+        self._dirty = True
+
+    def _replace_occurrences(self, doc_id, span_start, span_end, pairs):
+        """
+        Replace the doc's occurrences starting in [span_start, span_end)
+        (None = unbounded) with the (start_ts, end_ts) pairs that start there
+
+        A doc left without occurrences is removed.
+        """
+        doc = self.docs[doc_id]
+        occurrences = doc["occurrences"]
+        lo = 0 if span_start is None else bisect.bisect_left(occurrences, [span_start])
+        hi = len(occurrences) if span_end is None else bisect.bisect_left(occurrences, [span_end])
+        removed = occurrences[lo:hi]
+        new = [[start, end] for start, end in sorted(
+            {start: end for start, end in pairs
+             if (span_start is None or start >= span_start)
+             and (span_end is None or start < span_end)}.items())]
+        if new == removed and occurrences:
+            # Re-read of an unchanged event: the usual case
+            return
+        occurrences[lo:hi] = new
+
+        days = self._days.setdefault((doc["account"], doc["calendar"]), {})
+        for start, _ in removed:
+            day = start // _DAY
+            i = bisect.bisect_left(occurrences, [day * _DAY])
+            if day in days and not (i < len(occurrences) and occurrences[i][0] < (day + 1) * _DAY):
+                days[day].discard(doc_id)
+                if not days[day]:
+                    del days[day]
+        for start, _ in new:
+            days.setdefault(start // _DAY, set()).add(doc_id)
+        self._dirty = True
+        if not occurrences:
+            self._remove_doc(doc_id)
+
+    def _docs_starting_in(self, scope, span_start, span_end):
+        days = self._days.get(scope, {})
+        first, last = span_start // _DAY, (span_end - 1) // _DAY
+        if last - first + 1 > len(days):
+            buckets = [ids for day, ids in days.items() if first <= day <= last]
+        else:
+            buckets = [days[day] for day in range(first, last + 1) if day in days]
+        return set().union(*buckets)
+
+    def _index_resource(self, account, calendar, href, occurrences, attendees, fields,
+                        span_start, span_end):
+        """Update the docs of one resource; returns their doc ids"""
+        by_uid = {}
+        for occ in occurrences:
+            if occ["uid"]:
+                by_uid.setdefault(occ["uid"], []).append(occ)
+        doc_ids = set()
+        for uid, occs in by_uid.items():
+            # The master (or first instance) carries the texts
+            base = next((o for o in occs if o["recurrence_id"] is None), occs[0])
+            doc_id = self._add_doc(account, calendar, uid, href, bool(base["all_day"]))
+            self._set_text(doc_id, {"title": base["title"], "location": base["location"],
+                                    "description": base["description"],
+                                    "attendees": attendees}, fields)
+            doc_ids.add(doc_id)
+            self._replace_occurrences(doc_id, span_start, span_end,
+                                      [(_ts(o["start"]), _ts(o["end"])) for o in occs])
+        return doc_ids
+
+    # ---------- updates ----------
+
+    def update_window(self, account, calendar, window_start, window_end, entries, props=None):
+        """
+        Record the result of reading [window_start, window_end) of a calendar
+
+        entries are index_entry() dicts of every resource the read returned.
+        Occurrences starting in the window replace the indexed ones; events
+        the read didn't return lose theirs. props is the partial-retrieval
+        list the read used: fields it left out keep their indexed text.
+        """
+        account = account.lower()
+        calendar = collection_path(calendar)
+        span_start, span_end = _ts(window_start), _ts(window_end)
+        fields = _ALL_FIELDS
+        if props:
+            wanted = {p.upper() for p in props}
+            fields = sum(_FIELD_BITS[f] for f in FIELDS if FIELD_PROPS[f] in wanted)
+        with self._lock:
+            seen = set()
+            for entry in entries:
+                seen |= self._index_resource(account, calendar, _href_path(entry["href"]),
+                                             entry["occurrences"], entry["attendees"],
+                                             fields, span_start, span_end)
+            for doc_id in self._docs_starting_in((account, calendar), span_start, span_end) - seen:
+                self._replace_occurrences(doc_id, span_start, span_end, [])
+        self._autosave()
+
+    def put_resource(self, account, href, ics, horizon=DEFAULT_EXPANSION_HORIZON):
+        """
+        Index a complete event resource (written or synced), replacing what
+        was known about its events; recurrences are expanded up to now + horizon
+        """
+        account = account.lower()
+        href = _href_path(href)
+        window_end = datetime.datetime.now(UTC) + horizon
+        try:
+            occurrences = list(iter_occurrences(ics, None, window_end))
+        except ValueError:
+            return
+        with self._lock:
+            kept = self._index_resource(account, collection_path(href), href, occurrences,
+                                        ics_attendees(ics), _ALL_FIELDS, None, None)
+            for doc_id in self._hrefs.get((account, href), set()) - kept:
+                self._remove_doc(doc_id)
+        self._autosave()
+
+    def remove_href(self, account, href):
+        """Forget the events stored at href"""
+        with self._lock:
+            for doc_id in list(self._hrefs.pop((account.lower(), _href_path(href)), ())):
+                self._remove_doc(doc_id)
+        self._autosave()
+
+    def remove_calendar(self, account, calendar):
+        account = account.lower()
+        calendar = collection_path(calendar)
+        with self._lock:
+            for doc_id in [i for i, doc in self.docs.items()
+                           if doc["account"] == account and doc["calendar"] == calendar]:
+                self._remove_doc(doc_id)
+        self._autosave()
+
+    # ---------- queries ----------
+
+    def _matching_words(self, word, prefix):
+        if not prefix:
+            return [word] if word in self.postings else []
+        if self._terms is None:
+            self._terms = sorted(self.postings)
+        i = bisect.bisect_left(self._terms, word)
+        words = []
+        while i < len(self._terms) and self._terms[i].startswith(word):
+            words.append(self._terms[i])
+            i += 1
+        return words
+
+    def search(self, query, start=None, end=None, account=None, calendars=None,
+               fields=None, prefix=True, limit=None):
+        """
+        Occurrences of events matching every word of query, sorted by start
+
+        start/end (dates or datetimes, end exclusive) limit the occurrences by
+        their start time; account and calendars (paths) limit where to look;
+        fields limits which FIELDS are matched. prefix=False matches whole
+        words only. Each hit: {"uid", "title", "location", "description",
+        "attendees", "start", "end", "all_day", "calendar", "href", "account"}
+        with UTC datetimes (dates for all-day events).
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        mask = _ALL_FIELDS if not fields else sum(_FIELD_BITS[f] for f in fields)
+        start_ts = _ts(start) if start is not None else None
+        end_ts = _ts(end) if end is not None else None
+        account = account.lower() if account else None
+        calendars = {collection_path(c) for c in calendars} if calendars else None
+
+        hits = []
+        with self._lock:
+            candidates = None
+            for word in words:
+                matched = set()
+                for term in self._matching_words(word, prefix):
+                    matched.update(doc_id for doc_id, bits in self.postings[term].items()
+                                   if bits & mask)
+                candidates = matched if candidates is None else candidates & matched
+                if not candidates:
+                    return []
+
+            for doc_id in candidates:
+                doc = self.docs[doc_id]
+                if account is not None and doc["account"] != account:
+                    continue
+                if calendars is not None and doc["calendar"] not in calendars:
+                    continue
+                occurrences = doc["occurrences"]
+                lo = 0 if start_ts is None else bisect.bisect_left(occurrences, [start_ts])
+                hi = (len(occurrences) if end_ts is None
+                      else bisect.bisect_left(occurrences, [end_ts]))
+                for occ_start, occ_end in occurrences[lo:hi]:
+                    hits.append((occ_start, occ_end, doc))
+
+        hits.sort(key=lambda hit: (hit[0], hit[2]["title"]))
+        if limit is not None:
+            hits = hits[:limit]
+        return [self._hit(*hit) for hit in hits]
+
+    @staticmethod
+    def _hit(start_ts, end_ts, doc):
+        start = datetime.datetime.fromtimestamp(start_ts, UTC)
+        end = datetime.datetime.fromtimestamp(end_ts, UTC)
+        if doc["all_day"]:
+            start, end = start.date(), end.date()
+        return {"uid": doc["uid"], "title": doc["title"], "location": doc["location"],
+                "description": doc["description"], "attendees": list(doc["attendees"]),
+                "start": start, "end": end, "all_day": doc["all_day"],
+                "calendar": doc["calendar"], "href": doc["href"], "account": doc["account"]}
+
+    def stats(self):
+        with self._lock:
+            return {"events": len(self.docs), "words": len(self.postings),
+                    "occurrences": sum(len(doc["occurrences"]) for doc in self.docs.values())}
+
+    def __len__(self):
+        return len(self.docs)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_index():
+    """The process-wide index, loaded from DEFAULT_INDEX_PATH on first use"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SearchIndex.load(DEFAULT_INDEX_PATH)
+    return _shared
+
+
+def set_shared_index(index):
+    """Use index as the process-wide one (e.g. an in-memory SearchIndex() for benchmarks)"""
+    global _shared
+    with _shared_lock:
+        _shared = index
+
+
+def _save_shared():
+    if _shared is not None:
+        try:
+            _shared.save_if_dirty()
+        except OSError:
+            pass
+
+
+def _on_write(client, url, response):
+    if response is None:
+        return
+    method = response.request.method
+    if method == "DELETE" and (response.ok or response.status_code == 404):
+        shared_index().remove_href(client.email, url)
+    elif method == "PUT" and response.ok:
+        body = response.request.body
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "replace")
+        if body:
+            shared_index().put_resource(client.email, url, body)
+
+
+add_write_listener(_on_write)
+atexit.register(_save_shared)
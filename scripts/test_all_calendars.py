@@ -3,15 +3,23 @@
 iCloud CalDAV - Test All Calendars
 Optional: Find which calendars you can write to
 
-Usage: python3 test_all_calendars.py
+Usage: python3 test_all_calendars.py [--concurrency N] [--rate R]
 
 This script tests write access to multiple calendars.
 Useful when you have several calendars and want to find writable ones.
+
+With --concurrency above 1 the probes run on a bounded thread pool and
+results are printed as each one finishes. --rate caps requests per second
+to each iCloud host so bursts don't trigger 403 throttling (0: no limit).
 """
 
-import requests
-from requests.auth import HTTPBasicAuth
+import argparse
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import instrumentation
+from caldav_client import DEFAULT_POOL_MAXSIZE, AdaptiveRateLimiter, CalDAVClient
+from discovery import account_base_url, account_client
 
 # ============================================
 # CONFIGURATION - REPLACE WITH YOUR VALUES!
@@ -26,13 +34,18 @@ CALENDARS = [
     "CALENDAR_ID_2",
     # Add more as needed...
 ]
+
+CONCURRENCY = 1                             # Parallel probes (1 = one at a time)
+REQUESTS_PER_SECOND = 4                     # Per-host rate limit for concurrent mode
 # ============================================
 
 
-def test_calendar(calendar_id, index):
-    """Test write access to a single calendar"""
-    print(f"\n--- Calendar #{index + 1}: {calendar_id[:20]}... ---")
+def probe_calendar(calendar_id, index, client=None):
+    """
+    PUT a test event into a calendar
 
+    Returns (status_code, error); status_code is None when the request failed.
+    """
     event_uid = f"test-{index}-{int(datetime.datetime.now().timestamp())}"
     now = datetime.datetime.utcnow()
     start = (now + datetime.timedelta(hours=1)).strftime("%Y%m%dT%H%M%SZ")
@@ -52,29 +65,89 @@ SUMMARY:Write Test #{index + 1} - DELETE ME
 END:VEVENT
 END:VCALENDAR"""
 
-    url = f"https://caldav.icloud.com/{USER_ID}/calendars/{calendar_id}/{event_uid}.ics"
+    path = f"/{USER_ID}/calendars/{calendar_id}/{event_uid}.ics"
 
     try:
-        response = requests.put(
-            url,
-            data=ics_content,
-            auth=HTTPBasicAuth(EMAIL, PASSWORD),
-            headers={"Content-Type": "text/calendar; charset=utf-8"}
-        )
-
-        if response.status_code in [201, 204]:
-            print(f"WRITABLE! Status: {response.status_code}")
-            return True
-        else:
-            print(f"Not writable. Status: {response.status_code}")
-            return False
-
+        if client is None:
+            client = account_client(EMAIL, PASSWORD)
+        response = client.put(path, ics_content)
+        return response.status_code, None
     except Exception as e:
-        print(f"Error: {e}")
+        return None, e
+
+
+def test_calendar(calendar_id, index):
+    """Test write access to a single calendar"""
+    print(f"\n--- Calendar #{index + 1}: {calendar_id[:20]}... ---")
+
+    status, error = probe_calendar(calendar_id, index)
+    if error is not None:
+        print(f"Error: {error}")
+        return False
+
+    if status in [201, 204]:
+        print(f"WRITABLE! Status: {status}")
+        return True
+    else:
+        print(f"Not writable. Status: {status}")
         return False
 
 
+def test_calendars_concurrently(calendars, concurrency, rate):
+    """
+    Probe all calendars on a bounded thread pool
+
+    Each result is printed as soon as its probe finishes. Returns a list of
+    (number, calendar_id, success) in the original CALENDARS order.
+    """
+    # A burst of 1 keeps even the first probes under the printed rate
+    limiter = AdaptiveRateLimiter(rate=rate, max_rate=rate, burst=1) if rate > 0 else False
+    client = CalDAVClient(EMAIL, PASSWORD, base_url=account_base_url(EMAIL),
+                          pool_maxsize=max(concurrency, DEFAULT_POOL_MAXSIZE),
+                          rate_limiter=limiter)
+
+    print(f"\nProbing {len(calendars)} calendar(s), {concurrency} at a time "
+          f"({f'max {rate:g} req/s per host' if limiter else 'no rate limit'})...")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(probe_calendar, cal_id, i, client): (i, cal_id)
+            for i, cal_id in enumerate(calendars)
+        }
+        for future in as_completed(futures):
+            i, cal_id = futures[future]
+            status, error = future.result()
+            success = status in [201, 204]
+            if error is not None:
+                line = f"Error: {error}"
+            elif success:
+                line = f"WRITABLE! Status: {status}"
+            else:
+                line = f"Not writable. Status: {status}"
+            print(f"#{i + 1} {cal_id[:20]}... {line}")
+            results[i] = (i + 1, cal_id, success)
+
+    client.close()
+    return [results[i] for i in sorted(results)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Test write access to iCloud calendars")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help=f"parallel probes (default: {CONCURRENCY})")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help=f"max requests per second per host, 0 for no limit "
+                             f"(default: {REQUESTS_PER_SECOND})")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure(args)
+    return args
+
+
 def main():
+    args = parse_args()
+
     print("=" * 60)
     print("iCloud CalDAV - Test All Calendars for Write Access")
     print("=" * 60)
@@ -93,10 +166,13 @@ def main():
         print("then add them to the CALENDARS list in this file.")
         return
 
-    results = []
-    for i, cal_id in enumerate(CALENDARS):
-        success = test_calendar(cal_id, i)
-        results.append((i + 1, cal_id, success))
+    if args.concurrency > 1:
+        results = test_calendars_concurrently(CALENDARS, args.concurrency, args.rate)
+    else:
+        results = []
+        for i, cal_id in enumerate(CALENDARS):
+            success = test_calendar(cal_id, i)
+            results.append((i + 1, cal_id, success))
 
     print("\n" + "=" * 60)
     print("RESULTS:")
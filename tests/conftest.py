@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import search_index  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def memory_index():
+    """Keep the tests' events out of the user's saved search index"""
+    search_index.set_shared_index(search_index.SearchIndex())
+    yield
+    search_index.set_shared_index(None)
@@ -0,0 +1,70 @@
+"""CalendarService against the local stand-in server"""
+
+import asyncio
+from zoneinfo import ZoneInfo
+
+from caldav_client import CalDAVClient
+from calendar_service import CalendarService
+from local_caldav_server import LocalCalDAVServer
+
+BUDAPEST = ZoneInfo("Europe/Budapest")
+
+
+def _service(server, tz):
+    calendar_ids = list(server.calendars)
+    service = CalendarService(server.email, server.password, server.user_id,
+                              {"personal": calendar_ids[0], "work": calendar_ids[1]}, tz=tz)
+    service.client = CalDAVClient(server.email, server.password, base_url=server.base_url)
+    return service
+
+
+def test_naive_times_are_written_and_read_in_the_service_zone():
+    with LocalCalDAVServer(events_per_calendar=0) as server:
+        service = _service(server, BUDAPEST)
+        try:
+            written = asyncio.run(service.write({
+                "title": "Dentist", "date": "2030-01-15", "startTime": "10:00",
+                "calendar": "personal"}))
+            assert written["success"]
+            assert "Time: 10:00 - 11:00" in written["result"]
+
+            read = asyncio.run(service.read("2030-01-15", "personal"))
+            assert [(row["time"], row["title"]) for row in read["events"]] == [("10:00", "Dentist")]
+
+            changed = asyncio.run(service.change({
+                "eventUid": written["eventUid"], "calendar": "personal",
+                "date": "2030-01-15", "startTime": "23:30", "endTime": "23:45"}))
+            assert changed["success"]
+            read = asyncio.run(service.read("2030-01-15", "personal"))
+            assert [row["time"] for row in read["events"]] == ["23:30"]
+        finally:
+            service.close()
+
+
+def test_multi_calendar_read_keeps_the_calendars_that_work():
+    with LocalCalDAVServer(events_per_calendar=0) as server:
+        service = _service(server, BUDAPEST)
+        service.calendars["missing"] = "CAL-DOES-NOT-EXIST"
+        try:
+            asyncio.run(service.write({
+                "title": "Standup", "date": "2030-01-15", "startTime": "09:00",
+                "calendar": "work"}))
+            read = asyncio.run(service.read("2030-01-15", "work,missing"))
+            assert [row["title"] for row in read["events"]] == ["Standup"]
+            assert list(read["errors"]) == ["missing"]
+            assert "Could not read missing calendar" in read["result"]
+        finally:
+            service.close()
+
+
+def test_repeated_read_is_a_cache_hit():
+    with LocalCalDAVServer(events_per_calendar=0) as server:
+        service = _service(server, BUDAPEST)
+        try:
+            asyncio.run(service.read("2030-01-15", "personal"))
+            requests_before = server.stats["requests"]
+            asyncio.run(service.read("2030-01-15", "personal"))
+            assert server.stats["requests"] == requests_before
+            assert service.cache.stats["hits"] == 1
+        finally:
+            service.close()
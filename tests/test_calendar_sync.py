@@ -0,0 +1,42 @@
+"""calendar_sync against the local stand-in server"""
+
+import pytest
+
+from caldav_client import CalDAVClient
+from calendar_read import calendar_path
+from calendar_sync import SyncError, SyncStore, sync_calendar
+from local_caldav_server import LocalCalDAVServer, TokenBucket
+
+
+def _client(server):
+    return CalDAVClient(server.email, server.password, base_url=server.base_url,
+                        rate_limiter=False, retry=False)
+
+
+def test_throttled_sync_keeps_the_sync_token(tmp_path):
+    with LocalCalDAVServer(calendars=1, events_per_calendar=20) as server:
+        client = _client(server)
+        path = calendar_path(server.user_id, next(iter(server.calendars)))
+        store = SyncStore(str(tmp_path / "sync.json"))
+        sync_calendar(client, path, store)
+        token, resources = store.sync_token, dict(store.resources)
+
+        server.bucket = TokenBucket(0.001, 1)
+        server.bucket.tokens = 0
+        with pytest.raises(SyncError) as raised:
+            sync_calendar(client, path, store)
+        assert raised.value.status_code == 403
+        assert (store.sync_token, store.resources) == (token, resources)
+
+
+def test_expired_sync_token_starts_over(tmp_path):
+    with LocalCalDAVServer(calendars=1, events_per_calendar=20) as server:
+        client = _client(server)
+        path = calendar_path(server.user_id, next(iter(server.calendars)))
+        store = SyncStore(str(tmp_path / "sync.json"))
+        sync_calendar(client, path, store)
+        store.sync_token = "expired-token"
+
+        result = sync_calendar(client, path, store)
+        assert result["full"]
+        assert len(result["changed"]) == 20
@@ -0,0 +1,43 @@
+"""event_update against the local stand-in server"""
+
+from bulk_write import normalize_event, put_event
+from caldav_client import CalDAVClient
+from calendar_read import calendar_path
+from etag_cache import shared_etags
+from event_update import delete_event, update_event
+from local_caldav_server import LocalCalDAVServer
+
+
+def _moved_event(server):
+    """Write an event (remembered in etag_cache), then move it to another href"""
+    client = CalDAVClient(server.email, server.password, base_url=server.base_url,
+                          rate_limiter=False)
+    calendar_id = next(iter(server.calendars))
+    path = calendar_path(server.user_id, calendar_id)
+    event = normalize_event({"uid": "moved-event", "title": "Dentist",
+                             "start": "2030-01-15T10:00:00Z"})
+    assert put_event(client, path, event)["status"] == "created"
+    assert shared_etags().lookup(client.email, path, "moved-event") is not None
+    calendar = server.calendars[calendar_id]
+    ics = calendar.resources["moved-event.ics"]["ics"]
+    calendar.delete("moved-event.ics")
+    calendar.put("ELSEWHERE.ics", ics)
+    return client, path, calendar
+
+
+def test_update_falls_back_to_the_server_when_the_cached_href_is_stale():
+    with LocalCalDAVServer(calendars=1, events_per_calendar=0) as server:
+        client, path, calendar = _moved_event(server)
+        result = update_event(client, path, "moved-event", {"title": "Dentist (moved)"})
+        assert result["status"] == "updated"
+        assert "SUMMARY:Dentist (moved)" in calendar.resources["ELSEWHERE.ics"]["ics"]
+        assert shared_etags().lookup(client.email, path, "moved-event")["href"].endswith(
+            "/ELSEWHERE.ics")
+
+
+def test_delete_falls_back_to_the_server_when_the_cached_href_is_stale():
+    with LocalCalDAVServer(calendars=1, events_per_calendar=0) as server:
+        client, path, calendar = _moved_event(server)
+        assert delete_event(client, path, "moved-event")["status"] == "deleted"
+        assert calendar.resources == {}
+        assert delete_event(client, path, "moved-event")["status"] == "not_found"
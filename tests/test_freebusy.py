@@ -0,0 +1,30 @@
+"""freebusy against the local stand-in server"""
+
+import datetime
+
+import freebusy
+from caldav_client import AdaptiveRateLimiter, CalDAVClient
+from local_caldav_server import LocalCalDAVServer
+
+UTC = datetime.timezone.utc
+
+
+def test_unsupported_free_busy_query_is_asked_once_and_not_throttled():
+    freebusy.unsupported_hosts.clear()
+    with LocalCalDAVServer(events_per_calendar=20, free_busy=False) as server:
+        limiter = AdaptiveRateLimiter(rate=50, max_rate=50)
+        client = CalDAVClient(server.email, server.password, base_url=server.base_url,
+                              rate_limiter=limiter)
+        calendars = {f"cal{i}": calendar_id for i, calendar_id in enumerate(server.calendars)}
+        start = datetime.datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(2):
+            _, sources, errors = freebusy.find_free_slots(
+                client, server.user_id, calendars, start, start + datetime.timedelta(days=7))
+            assert errors == {}
+            assert set(sources.values()) == {"local"}
+        # One rejected free-busy-query per calendar at most, then only event reads
+        assert server.stats["requests"] <= len(calendars) + 2 * len(calendars)
+        assert server.stats["throttled"] == 0
+        host = server.base_url.split("//", 1)[1]
+        assert limiter.rate((server.email, host)) == 50
+    freebusy.unsupported_hosts.clear()
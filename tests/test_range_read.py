@@ -0,0 +1,24 @@
+"""range_read against the local stand-in server"""
+
+import datetime
+
+from caldav_client import CalDAVClient
+from calendar_read import calendar_path
+from local_caldav_server import LocalCalDAVServer
+from range_read import read_range
+
+
+def test_concurrent_window_retries_are_all_counted():
+    with LocalCalDAVServer(calendars=1, events_per_calendar=500,
+                           rate_limit=20, burst=3) as server:
+        client = CalDAVClient(server.email, server.password, base_url=server.base_url,
+                              rate_limiter=False, retry=False)
+        path = calendar_path(server.user_id, next(iter(server.calendars)))
+        start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=180)
+        stats = {}
+        occurrences = list(read_range(client, path, start, start + datetime.timedelta(days=365),
+                                      concurrency=8, stats=stats))
+        assert occurrences
+        # Every throttled REPORT was one window retry
+        assert server.stats["throttled"] > 0
+        assert stats["retries"] == server.stats["throttled"]